@@ -0,0 +1,141 @@
+"""
+Compara o envio das faturas dos processos de extração ao processo principal em lotes colunares
+(LoteFaturas) com o envio de um dicionário por fatura (como antes), com faturas sintéticas.
+
+Para cada formato, mede:
+- serialização nos processos de extração (pickle) e tamanho transferido;
+- processo principal: desserialização, verificação de duplicatas e somas da aba 'Controle';
+- montagem do DataFrame da aba 'Relatorio';
+- gravação do estado da execução (revinculação), como em _actual_processing_task. No formato de
+  dicionários, o estado é gravado como antes (lista de faturas em JSON).
+
+Com --memoria, mede também (tracemalloc, mais lento) a memória retida pelo processo principal
+e o pico da gravação do estado.
+
+Uso (na pasta do projeto):
+    python benchmarks/lotes_faturas.py [--faturas 500000] [--por-pdf 100] [--memoria]
+"""
+import argparse
+import json
+import os
+import pickle
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import relatorio  # noqa: E402
+
+def gerar_pdfs(quantidade, por_pdf, semente=1):
+    """Resultados sintéticos (faturas com as chaves da extração), agrupados por PDF."""
+    rnd = random.Random(semente)
+
+    def fatura(i):
+        return {"UC": str(40000000 + i), "Centro de Custo": 100 + i % 50, "Subseção": f"Cidade {i % 50}",
+                "ENERGIA (R$)": rnd.randint(0, 10**6), "COSIP (R$)": rnd.randint(0, 10**4),
+                "Valor Bruto (R$)": rnd.randint(0, 10**6), "RETENÇÃO (R$)": rnd.randint(0, 10**4),
+                "LÍQUIDO (R$)": rnd.randint(0, 10**6),
+                "Numero da Pagina": f"lote{i // por_pdf}.pdf (Pág. {(i % por_pdf) // 4 + 1})", "Referência": "03/2024",
+                "Energia (1,2%)": rnd.randint(0, 10**6), "Retenção(1,2%)": rnd.randint(0, 10**4),
+                "Energia (4,8%)": 0, "Retenção(4,8%)": 0}
+
+    return [[fatura(i) for i in range(inicio, min(inicio + por_pdf, quantidade))] for inicio in range(0, quantidade, por_pdf)]
+
+def consolidar_dicionarios(resultados):
+    """Processo principal no formato anterior: uma fatura (dicionário) de cada vez."""
+    indice, agregador, dados = relatorio.IndiceDuplicatas(), relatorio.AgregadorControle(), []
+    for faturas in resultados:
+        for fatura_data in faturas:
+            if indice.registrar_fatura(fatura_data) is None:
+                agregador.adicionar(fatura_data)
+                dados.append(fatura_data)
+    return dados, agregador
+
+def consolidar_lotes(resultados):
+    """Processo principal com LoteFaturas (como em extrair_faturas.registrar_lote)."""
+    indice, agregador, dados = relatorio.IndiceDuplicatas(), relatorio.AgregadorControle(), relatorio.TabelaFaturas()
+    for lote in resultados:
+        paginas = lote.coluna("Numero da Pagina")
+        aceitas = [i for i, (chave, pagina) in enumerate(zip(lote.chaves_identidade(), paginas))
+                   if indice.registrar_chave(chave, pagina) is None]
+        if len(aceitas) < len(lote):
+            lote = lote.selecionar(aceitas)
+        agregador.adicionar_lote(lote)
+        dados.adicionar_lote(lote)
+    agregador.somar_pendentes()
+    return dados, agregador
+
+def salvar_estado_dicionarios(estado_path, dados):
+    """Gravação do estado no formato anterior (um dicionário por fatura)."""
+    with open(estado_path, 'w', encoding='utf-8') as f:
+        json.dump({"dados": list(dados), "erros": [], "valor_cobrado": []}, f, ensure_ascii=False, default=str)
+
+def salvar_estado_lotes(estado_path, dados):
+    """Gravação do estado atual (salvar_estado_execucao, coluna a coluna)."""
+    relatorio.salvar_estado_execucao(estado_path, dados, [], [])
+
+def medir(nome, pdfs, serializar, consolidar, salvar_estado, estado_path, memoria):
+    inicio = time.perf_counter()
+    blobs = [pickle.dumps(serializar(faturas), protocol=pickle.HIGHEST_PROTOCOL) for faturas in pdfs]
+    tempo_serializar = time.perf_counter() - inicio
+
+    if memoria:
+        tracemalloc.start()
+    inicio = time.perf_counter()
+    dados, agregador = consolidar(pickle.loads(blob) for blob in blobs)
+    tempo_principal = time.perf_counter() - inicio
+    retida = tracemalloc.get_traced_memory()[0] if memoria else None
+    tracemalloc.stop()
+
+    inicio = time.perf_counter()
+    df = dados.dataframe() if isinstance(dados, relatorio.TabelaFaturas) else pd.DataFrame(dados)
+    tempo_dataframe = time.perf_counter() - inicio
+
+    if memoria:
+        tracemalloc.start()
+    inicio = time.perf_counter()
+    salvar_estado(estado_path, dados)
+    tempo_estado = time.perf_counter() - inicio
+    pico_estado = tracemalloc.get_traced_memory()[1] if memoria else None
+    tracemalloc.stop()
+
+    print(f"{nome}:")
+    print(f"  processos de extração (pickle): {tempo_serializar:6.2f} s, {sum(map(len, blobs)) / 1e6:7.1f} MB transferidos")
+    print(f"  processo principal (desserializar + duplicatas + Controle): {tempo_principal:6.2f} s"
+          + (f", {retida / 1e6:7.1f} MB retidos" if memoria else ""))
+    print(f"  DataFrame da aba 'Relatorio': {tempo_dataframe:6.2f} s")
+    print(f"  estado da execução: {tempo_estado:6.2f} s, arquivo de {os.path.getsize(estado_path) / 1e6:7.1f} MB"
+          + (f", pico de {pico_estado / 1e6:7.1f} MB" if memoria else ""))
+    return df, agregador
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--faturas", type=int, default=500000)
+    parser.add_argument("--por-pdf", type=int, default=100)
+    parser.add_argument("--memoria", action="store_true", help="mede a memória com tracemalloc (mais lento)")
+    args = parser.parse_args()
+
+    pdfs = gerar_pdfs(args.faturas, args.por_pdf)
+    print(f"{args.faturas} faturas em {len(pdfs)} PDFs ({args.por_pdf} por PDF)")
+    with tempfile.TemporaryDirectory() as pasta:
+        estado_path = os.path.join(pasta, "ultima_execucao.json")
+        df_dicionarios, agregador_dicionarios = medir("Dicionários (formato anterior)", pdfs, lambda faturas: faturas,
+                                                      consolidar_dicionarios, salvar_estado_dicionarios, estado_path, args.memoria)
+        df_lotes, agregador_lotes = medir("Lotes colunares (LoteFaturas)", pdfs, relatorio.LoteFaturas.de_resultados,
+                                          consolidar_lotes, salvar_estado_lotes, estado_path, args.memoria)
+        estado = relatorio.carregar_estado_execucao(estado_path)
+        iguais = {
+            "DataFrame": df_dicionarios.equals(df_lotes),
+            "Controle": agregador_dicionarios.dataframe().equals(agregador_lotes.dataframe())
+                        and agregador_dicionarios.totais == agregador_lotes.totais,
+            "estado": estado["dados"].dataframe().equals(df_lotes),
+        }
+    print("Resultados iguais: " + ", ".join(f"{nome} {'sim' if igual else 'NÃO'}" for nome, igual in iguais.items()))
+    return 0 if all(iguais.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
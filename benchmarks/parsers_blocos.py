@@ -0,0 +1,93 @@
+"""
+Confere e mede os analisadores de bloco de fatura (extract_item_value_from_block e
+extract_new_controle_data) contra os padrões com retrocesso usados antes deles.
+
+- Páginas patológicas (paginas_patologicas/*.txt): compara os resultados e o tempo de cada versão.
+- Fuzz: páginas aleatórias montadas com fragmentos do layout; os resultados devem ser idênticos, assim como a
+  conversão em lote (parse_centavos_lote) dos números de cada página e a conversão item a item (parse_centavos).
+
+Uso (na pasta do projeto):
+    python benchmarks/parsers_blocos.py [--fuzz 40000] [--semente 1]
+"""
+import argparse
+import glob
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import relatorio  # noqa: E402
+
+PASTA_PAGINAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "paginas_patologicas")
+
+ITENS = [r"Tributo Retido IRPJ", r"Tributo Retido PIS", r"Tributo Retido COFINS", r"Tributo Retido CSLL", r"COSIP Municipal"]
+
+FRAGMENTOS_FUZZ = ["Tributo Retido IRPJ", "tributo retido pis", "COSIP Municipal", " ", "  ", "\n", " \n ", "\t", "\xa0",
+                   "-", "--", "1", "23", "4,56", "1.234,56", ".", ",", "-7,89", "x", "Itens da Fatura", "Valores Medidos",
+                   "abc", " 1,2 ", " 4,8 ", "R$"]
+
+# --- Versões anteriores (padrões com '.*?' e DOTALL) ---
+
+def item_antigo(text_block, item_name_pattern):
+    if not text_block or not isinstance(text_block, str):
+        return 0
+    cleaned_text_block = "\n".join(line.strip() for line in text_block.splitlines() if line.strip())
+    cleaned_text_block = re.sub(r'[ \t]+', ' ', cleaned_text_block)
+    pattern = rf"{item_name_pattern}.*?\s+[\d\.,]+.*?\s+[\d\.,]+.*?\s+(-?[\d\.,]+)"
+    match = re.search(pattern, cleaned_text_block, re.MULTILINE | re.IGNORECASE | re.DOTALL)
+    return relatorio.parse_centavos(match.group(1)) if match else 0
+
+def controle_antigo(text_block):
+    match_itens = re.search(r"Itens da Fatura.*?(?=Valores Medidos|Tributo Retido IRPJ|$)", text_block, re.DOTALL | re.IGNORECASE)
+    if not match_itens:
+        return {"Energia (1,2%)": 0, "Retenção(1,2%)": 0, "Energia (4,8%)": 0, "Retenção(4,8%)": 0}
+    # A seção já delimitada não contém os marcadores de fim: a versão atual a usa inteira
+    return relatorio.extract_new_controle_data(match_itens.group(0))
+
+def analisar(texto, item, controle):
+    return [item(texto, re.escape(nome)) for nome in ITENS], controle(texto)
+
+def medir(funcao, *args):
+    inicio = time.perf_counter()
+    resultado = funcao(*args)
+    return resultado, time.perf_counter() - inicio
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--fuzz", type=int, default=40000, help="páginas aleatórias a comparar (0 = nenhuma)")
+    parser.add_argument("--semente", type=int, default=1)
+    args = parser.parse_args()
+    diferencas = 0
+
+    print(f"{'página':48s} {'caracteres':>10s} {'anterior (ms)':>14s} {'atual (ms)':>11s}")
+    for caminho in sorted(glob.glob(os.path.join(PASTA_PAGINAS, "*.txt"))):
+        with open(caminho, encoding="utf-8") as f:
+            texto = f.read()
+        antigo, tempo_antigo = medir(analisar, texto, item_antigo, controle_antigo)
+        atual, tempo_atual = medir(analisar, texto, relatorio.extract_item_value_from_block, relatorio.extract_new_controle_data)
+        igual = antigo == atual
+        diferencas += not igual
+        print(f"{os.path.basename(caminho):48s} {len(texto):10d} {tempo_antigo * 1000:14.1f} {tempo_atual * 1000:11.1f}"
+              + ("" if igual else f"  DIFERENTE: {antigo} != {atual}"))
+
+    rnd = random.Random(args.semente)
+    for _ in range(args.fuzz):
+        texto = "".join(rnd.choice(FRAGMENTOS_FUZZ) for _ in range(rnd.randint(0, 40)))
+        antigo = analisar(texto, item_antigo, controle_antigo)
+        atual = analisar(texto, relatorio.extract_item_value_from_block, relatorio.extract_new_controle_data)
+        if antigo != atual:
+            diferencas += 1
+            print(f"Fuzz DIFERENTE: {texto!r}: {antigo} != {atual}")
+        numeros = re.findall(r"-?[\d\.,]+", texto)
+        em_lote, item_a_item = relatorio.parse_centavos_lote(numeros), [relatorio.parse_centavos(numero) for numero in numeros]
+        if em_lote != item_a_item:
+            diferencas += 1
+            print(f"Fuzz DIFERENTE (parse_centavos_lote): {numeros!r}: {em_lote} != {item_a_item}")
+    print(f"Fuzz: {args.fuzz} página(s) aleatória(s) comparada(s).")
+    print(f"Diferenças: {diferencas}")
+    return 1 if diferencas else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
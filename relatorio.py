@@ -1,11 +1,27 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext, Canvas, Toplevel, Label, Frame
 import pandas as pd
+import numpy as np
 import re
+import argparse
 import os
 import subprocess
 import sys
 import threading
+import hashlib
+import io
+import json
+import time
+import zipfile
+import queue
+import concurrent.futures
+import http.server
+import multiprocessing
+import multiprocessing.connection
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from operator import itemgetter
 from datetime import datetime # Importado para a data no nome do arquivo
 
 # Tentar importar openpyxl e seus componentes necessários
@@ -37,17 +53,313 @@ except ImportError:
     sys.exit(1)
 
 
+# --- Configurações ---
+
+# Valores padrão das configurações avançadas. Podem ser sobrescritos pelo arquivo
+# opcional 'base/config.json' (apenas as chaves informadas são alteradas).
+CONFIGURACOES_PADRAO = {
+    "prefetch_profundidade": 4,      # Quantos PDFs à frente são lidos para a memória
+    "prefetch_memoria_mb": 256,      # Memória máxima ocupada pelos PDFs lidos antecipadamente
+    "fila_textos": 32,               # Páginas com texto extraído aguardando a análise dos blocos
+    "fila_blocos": 32,               # Páginas com blocos analisados aguardando a resolução das UCs
+    "fila_faturas": 32,              # Páginas com faturas prontas aguardando o acúmulo dos resultados
+    "ocr_ativo": False,              # Aplica OCR (Tesseract) em páginas sem texto extraível
+    "ocr_processos": 2,              # Quantidade máxima de processos de OCR em paralelo
+    "ocr_idioma": "por",             # Idioma(s) do Tesseract (ex: "por", "por+eng")
+    "ocr_dpi": 300,                  # Resolução usada para renderizar a página para o OCR
+    "processos_extracao": 1,         # Processos de extração em paralelo (1 = sem paralelismo)
+    "memoria_extracao_mb": 2048,     # Memória estimada máxima dos PDFs em extração simultânea
+    "tempo_limite_bloco_ms": 2000,   # Tempo máximo de análise de um bloco de fatura (0 = sem limite); excedido, vira erro
+    "tempo_limite_pdf_s": 0,         # Tempo máximo de extração de um PDF em processo isolado (0 = sem limite); excedido, vira erro
+    "memoria_limite_pdf_mb": 0,      # Memória máxima do processo isolado que extrai um PDF (0 = sem limite); excedida, vira erro
+    "nivel_log": "INFO",             # Nível mínimo exibido/gravado no log: DEBUG, INFO, WARNING ou ERROR
+    "log_estruturado": True,         # Grava também um log estruturado (JSONL) ao lado do relatório
+    "linhas_por_aba": 1000000,       # Máximo de faturas por aba 'Relatorio'; o excedente vai para 'Relatorio (2)', ...
+    "abas_por_arquivo": 0,           # Máximo de abas 'Relatorio' por arquivo Excel (0 = sem limite); o excedente vai para novos arquivos
+    "servico_porta": 8765            # Porta local do modo serviço (relatorio.py --servico)
+}
+
+def carregar_configuracoes(config_path, logger_func=None):
+    """
+    Carrega as configurações avançadas a partir de um arquivo JSON opcional.
+    Chaves ausentes ou inválidas mantêm o valor padrão.
+    """
+    configuracoes = dict(CONFIGURACOES_PADRAO)
+    if not os.path.exists(config_path):
+        return configuracoes
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            dados = json.load(f)
+        for chave, valor in dados.items():
+            if chave not in CONFIGURACOES_PADRAO:
+                if logger_func:
+                    logger_func(f"Configuração desconhecida ignorada em {config_path}: '{chave}'.", "WARNING")
+                continue
+            if type(valor) is not type(CONFIGURACOES_PADRAO[chave]):
+                if logger_func:
+                    logger_func(f"Valor inválido para '{chave}' em {config_path}: {valor!r}. Usando padrão {CONFIGURACOES_PADRAO[chave]!r}.", "WARNING")
+                continue
+            configuracoes[chave] = valor
+    except Exception as e:
+        if logger_func:
+            logger_func(f"Erro ao ler configurações de {config_path}: {e}. Usando valores padrão.", "WARNING")
+    return configuracoes
+
+
+# --- Log de Processamento ---
+
+# Ordem dos níveis de log (os nomes em português são aceitos como sinônimos)
+NIVEIS_LOG = {
+    "DEBUG": 10,
+    "INFO": 20, "SUCCESSO": 20,
+    "WARNING": 30, "AVISO": 30,
+    "ERROR": 40, "ERRO": 40,
+    "CRITICAL_ERROR": 50, "ERRO_CRITICO": 50, "ERRO_CRITICO!": 50
+}
+
+# Avisos repetitivos (um por fatura) que são contados e resumidos ao final do processamento.
+# As mensagens individuais são registradas apenas no nível DEBUG.
+MENSAGENS_AGREGADAS = {
+    "SEM_RETENCAO": "Nenhum tributo retido encontrado em {quantidade} fatura(s). 'RETENÇÃO (R$)' será 0.00 nessas faturas.",
+    "COSIP_ZERADO": "COSIP não encontrado ou zerado em {quantidade} fatura(s). 'COSIP (R$)' será 0.00 nessas faturas.",
+    "PAGINA_SEM_TEXTO": "{quantidade} página(s) sem texto extraível.",
+    "SEM_REFERENCIA": "Referência não encontrada em {quantidade} fatura(s). A verificação de fatura duplicada não foi feita nessas faturas."
+}
+
+class RegistroLog:
+    """
+    Filtra as mensagens de log por nível, formata o texto apenas quando a mensagem
+    será de fato registrada, conta os avisos repetitivos e grava um log estruturado (JSONL)
+    com os campos: nível, código, pdf, página, UC e mensagem.
+    O nível mais grave e os avisos/erros por código são contados mesmo quando filtrados
+    (ex: para o resumo final da interface com 'nivel_log' = ERROR).
+
+    'destino' recebe (mensagem, nível) das mensagens habilitadas (ex: o widget de log).
+    Pode ser usado como um logger_func comum: registro(mensagem, nível).
+    """
+
+    def __init__(self, destino=None, nivel_minimo="INFO", jsonl_path=None, coletar=False):
+        self.destino = destino
+        self.nivel_minimo = NIVEIS_LOG.get(str(nivel_minimo).upper(), NIVEIS_LOG["INFO"])
+        self.contadores = {}
+        self.nivel_maximo = 0 # Nível mais grave registrado (NIVEIS_LOG), inclusive o de mensagens filtradas
+        self.ocorrencias = {} # Avisos e erros por código, inclusive os filtrados
+        # Com 'coletar', as mensagens são guardadas para serem repassadas a outro registro (ex: processos de extração)
+        self.registros = [] if coletar else None
+        self.lock = threading.Lock()
+        self.jsonl_file = open(jsonl_path, 'a', encoding='utf-8') if jsonl_path else None
+
+    def habilitado(self, level):
+        """Indica se mensagens deste nível serão registradas."""
+        return NIVEIS_LOG.get(level, NIVEIS_LOG["INFO"]) >= self.nivel_minimo
+
+    def _contar(self, level, codigo):
+        """Atualiza o nível mais grave e, para avisos e erros, a contagem por código."""
+        nivel = NIVEIS_LOG.get(level, NIVEIS_LOG["INFO"])
+        if nivel < NIVEIS_LOG["WARNING"]:
+            return
+        with self.lock:
+            self.nivel_maximo = max(self.nivel_maximo, nivel)
+            if codigo is not None:
+                self.ocorrencias[codigo] = self.ocorrencias.get(codigo, 0) + 1
+
+    def __call__(self, message, level="INFO", codigo=None, **campos):
+        self._contar(level, codigo)
+        if self.habilitado(level):
+            self.emitir(message, level, codigo, campos)
+
+    def registrar(self, level, codigo, modelo, **campos):
+        """
+        Registra uma mensagem a partir de um modelo (str.format). Se o nível estiver
+        filtrado, o texto não é montado. Códigos em MENSAGENS_AGREGADAS são sempre contados.
+        """
+        if codigo in MENSAGENS_AGREGADAS:
+            with self.lock:
+                self.contadores[codigo] = self.contadores.get(codigo, 0) + 1
+        self._contar(level, codigo)
+        if self.habilitado(level):
+            self.emitir(modelo.format(**campos), level, codigo, campos)
+
+    def emitir(self, message, level, codigo=None, campos=None):
+        """Envia uma mensagem já formatada (e já filtrada) ao destino e ao log estruturado."""
+        if self.registros is not None:
+            self.registros.append((message, level, codigo, campos or {}))
+        if self.destino is not None:
+            self.destino(message, level)
+        if self.jsonl_file is not None:
+            campos = campos or {}
+            registro = {
+                "ts": datetime.now().isoformat(timespec='milliseconds'),
+                "level": level,
+                "code": codigo,
+                "pdf": campos.get("pdf"),
+                "page": campos.get("pagina"),
+                "uc": campos.get("uc"),
+                "message": message
+            }
+            linha = json.dumps(registro, ensure_ascii=False, default=str)
+            with self.lock:
+                # Um estágio de extração abandonado no cancelamento pode registrar depois de 'fechar'
+                if self.jsonl_file is not None:
+                    self.jsonl_file.write(linha + "\n")
+
+    def contagens(self):
+        """Contadores, avisos/erros por código e nível mais grave, para somar em outro registro (somar_contadores)."""
+        with self.lock:
+            return dict(self.contadores), dict(self.ocorrencias), self.nivel_maximo
+
+    def somar_contadores(self, contadores, ocorrencias=None, nivel_maximo=0):
+        """Acrescenta contadores vindos de outro registro (ex: de um processo de extração)."""
+        with self.lock:
+            for codigo, quantidade in contadores.items():
+                self.contadores[codigo] = self.contadores.get(codigo, 0) + quantidade
+            for codigo, quantidade in (ocorrencias or {}).items():
+                self.ocorrencias[codigo] = self.ocorrencias.get(codigo, 0) + quantidade
+            self.nivel_maximo = max(self.nivel_maximo, nivel_maximo)
+
+    def emitir_resumo(self):
+        """Registra uma linha de resumo para cada aviso repetitivo contado."""
+        for codigo, quantidade in sorted(self.contadores.items()):
+            if quantidade:
+                self(MENSAGENS_AGREGADAS[codigo].format(quantidade=quantidade), "INFO", codigo)
+
+    def fechar(self):
+        if self.jsonl_file is not None:
+            with self.lock:
+                self.jsonl_file.close()
+                self.jsonl_file = None
+
+def registrar_log(logger_func, level, codigo, modelo, **campos):
+    """
+    Registra uma mensagem com formatação preguiçosa. Com um RegistroLog, o texto só é
+    montado se o nível estiver habilitado; com uma função logger simples, é montado e repassado.
+    """
+    if logger_func is None:
+        return
+    registrar = getattr(logger_func, "registrar", None)
+    if registrar is not None:
+        registrar(level, codigo, modelo, **campos)
+    else:
+        logger_func(modelo.format(**campos), level)
+
+
 # --- Funções de Extração e Processamento (Existente) ---
 
-def parse_value(value_str):
-    """Converte uma string de valor monetário para float."""
+# Os valores monetários são mantidos como centavos inteiros (int) em todo o processamento,
+# para que somas e conferências de totais sejam exatas. A conversão para reais (float)
+# ocorre apenas na escrita do Excel e nas mensagens exibidas ao usuário.
+
+# Formato brasileiro já sem os pontos de milhar: sinal, parte inteira e parte decimal
+VALOR_BR_REGEX = re.compile(r"(-?)(\d*)(?:,(\d*))?")
+
+def _converter_centavos(value_str):
+    """Converte uma string no formato brasileiro para centavos. Retorna None se não for possível."""
+    match = VALOR_BR_REGEX.fullmatch(value_str.strip().replace('.', ''))
+    if not match:
+        return None
+    sinal, inteiro, fracao = match.groups()
+    fracao = fracao or ''
+    if not inteiro and not fracao:
+        return None
+    # Arredonda (meio para cima) casas decimais além dos centavos
+    centavos = int(inteiro or '0') * 100 + (int(fracao[:3].ljust(3, '0')) + 5) // 10
+    return -centavos if sinal else centavos
+
+@lru_cache(maxsize=65536)
+def parse_centavos(value_str):
+    """Converte uma string de valor monetário (ex: 1.234,56) para centavos inteiros (ex: 123456)."""
     if not value_str or not isinstance(value_str, str):
-        return 0.0
-    cleaned_str = value_str.replace('.', '').replace(',', '.')
-    try:
-        return float(cleaned_str)
-    except ValueError:
-        return 0.0
+        return 0
+    centavos = _converter_centavos(value_str)
+    return centavos if centavos is not None else 0
+
+# Strings mais longas que isto (ou com mais de DIGITOS_INTEIROS_LOTE dígitos inteiros) são convertidas por parse_centavos
+# em parse_centavos_lote: limitam a largura da matriz de caracteres e mantêm as somas dentro do int64
+TAMANHO_MAXIMO_LOTE = 32
+DIGITOS_INTEIROS_LOTE = 16
+
+def parse_centavos_lote(value_strs):
+    """
+    Converte de uma vez uma sequência de strings de valores monetários (ex: todos os valores capturados nos blocos
+    de uma página) para uma lista de centavos inteiros, com o mesmo resultado de parse_centavos para cada item.
+    A conversão é vetorizada (numpy) sobre a matriz de caracteres das strings (uma linha por string). Strings com
+    outros caracteres além de '-0123456789.,' (ex: espaços) ou muito longas são convertidas por parse_centavos.
+    """
+    textos = [v if isinstance(v, str) else "" for v in value_strs]
+    if not textos:
+        return []
+    tamanhos = np.fromiter(map(len, textos), dtype=np.int64, count=len(textos))
+    longos = tamanhos > TAMANHO_MAXIMO_LOTE
+    if longos.any():
+        textos_matriz = [texto if len(texto) <= TAMANHO_MAXIMO_LOTE else "" for texto in textos]
+        tamanhos[longos] = 0
+    else:
+        textos_matriz = textos
+    # Códigos dos caracteres, completados com zeros até a maior string
+    caracteres = np.array(textos_matriz, dtype=str).view(np.uint32).reshape(len(textos), -1)
+    dentro = np.arange(caracteres.shape[1]) < tamanhos[:, None]
+
+    def antes(mascara):
+        """Quantos caracteres de 'mascara' antecedem cada caractere na mesma string."""
+        return np.cumsum(mascara, axis=1) - mascara
+
+    digito = (caracteres >= ord("0")) & (caracteres <= ord("9"))
+    virgula = caracteres == ord(",")
+    menos = caracteres == ord("-")
+    ponto = caracteres == ord(".")
+    outros = dentro & ~(digito | virgula | menos | ponto)
+
+    # Os pontos (milhar) são ignorados; dígitos antes da vírgula formam a parte inteira, os seguintes a fração
+    virgulas_antes = antes(virgula)
+    inteiro = digito & (virgulas_antes == 0)
+    fracao = digito & (virgulas_antes == 1)
+    digitos_inteiros = inteiro.sum(axis=1)
+
+    # Formato válido: '-' opcional no início (sem contar os pontos), no máximo uma vírgula e ao menos um dígito
+    sinal = menos & (antes(~ponto) == 0)
+    validos = digito.any(axis=1) & (virgula.sum(axis=1) <= 1) & ~(menos & ~sinal).any(axis=1)
+    item_a_item = longos | outros.any(axis=1) | (digitos_inteiros > DIGITOS_INTEIROS_LOTE)
+
+    algarismos = caracteres.astype(np.int64) - ord("0")
+    potencias = 10 ** np.arange(DIGITOS_INTEIROS_LOTE, dtype=np.int64)
+    expoente = np.clip(digitos_inteiros[:, None] - 1 - antes(inteiro), 0, DIGITOS_INTEIROS_LOTE - 1)
+    parte_inteira = np.where(inteiro, algarismos * potencias[expoente], 0).sum(axis=1)
+
+    # Três primeiras casas decimais (completadas com zeros), arredondadas para centavos como em _converter_centavos
+    casa_decimal = antes(fracao)
+    milesimos = fracao & (casa_decimal < 3)
+    parte_milesimos = np.where(milesimos, algarismos * potencias[np.clip(2 - casa_decimal, 0, 2)], 0).sum(axis=1)
+
+    centavos = parte_inteira * 100 + (parte_milesimos + 5) // 10
+    centavos = np.where(sinal.any(axis=1), -centavos, centavos)
+    centavos = np.where(validos, centavos, 0).tolist()
+    for i in np.flatnonzero(item_a_item).tolist():
+        centavos[i] = parse_centavos(textos[i])
+    return centavos
+
+def centavos_para_reais(centavos):
+    """Converte centavos inteiros para reais (float), apenas para exibição."""
+    return centavos / 100
+
+def formatar_centavos_txt(centavos):
+    """Formata centavos no padrão dos arquivos TXT de rateio (ex: 123456 -> '1234,56', 120000 -> '1200')."""
+    sinal = '-' if centavos < 0 else ''
+    inteiro, resto = divmod(abs(int(centavos)), 100)
+    if resto == 0:
+        return f"{sinal}{inteiro}"
+    return f"{sinal}{inteiro},{resto:02d}"
+
+def converter_colunas_centavos_para_reais(df, colunas):
+    """
+    Retorna uma cópia do DataFrame com as colunas de centavos convertidas para reais.
+    Células não numéricas (linhas em branco, rótulos) são mantidas como estão.
+    """
+    df_reais = df.copy()
+    for col in colunas:
+        if col in df_reais.columns:
+            numericos = pd.to_numeric(df_reais[col], errors='coerce')
+            df_reais[col] = df_reais[col].astype(object).where(numericos.isna(), numericos / 100)
+    return df_reais
 
 def extract_uc_from_block(text_block):
     """Extrai o número da Unidade Consumidora (UC) do bloco de texto."""
@@ -56,75 +368,121 @@ def extract_uc_from_block(text_block):
         return match.group(1)
     return None
 
+def extract_referencia_from_block(text_block):
+    """
+    Extrai o mês de referência da fatura (ex: "10/2024") do bloco de texto.
+    Retorna uma string vazia se a referência não for encontrada.
+    """
+    if not text_block or not isinstance(text_block, str):
+        return ""
+    match = re.search(r"(?:Refer[êe]ncia|M[êe]s/Ano)\s*:?\s*(\d{2}/\d{4})", text_block, re.IGNORECASE)
+    if match:
+        return match.group(1)
+    return ""
+
 def extract_valor_total_fatura_from_block(text_block):
     """
     Extrai o valor total da fatura (que será o Valor Líquido) do bloco de texto.
     Tenta encontrar "Valor: R$ XXX" ou "Valor: XXX".
     """
     if not text_block or not isinstance(text_block, str):
-        return 0.0
+        return 0
+    valor_str = localizar_valor_total_fatura(text_block)
+    return parse_centavos(valor_str) if valor_str is not None else 0
 
+def localizar_valor_total_fatura(text_block):
+    """Texto do valor total da fatura (ver extract_valor_total_fatura_from_block). Retorna None se não for encontrado."""
     # Tenta encontrar o padrão "Valor: R$ [valor]"
     # O flag re.DOTALL permite que o '.' corresponda a quebras de linha, caso o valor esteja em outra linha.
     # O flag re.IGNORECASE ignora maiúsculas/minúsculas.
     match_valor_com_simbolo = re.search(r"Valor:\s*R\$\s*([\d\.,]+)", text_block, re.DOTALL | re.IGNORECASE)
     if match_valor_com_simbolo:
-        return parse_value(match_valor_com_simbolo.group(1))
+        return match_valor_com_simbolo.group(1)
 
     # Se o padrão com R$ não for encontrado, tenta encontrar o padrão "Valor: [valor]" (sem R$)
     # Este padrão é mais genérico e captura números logo após "Valor:", assumindo que não há "R$" se o anterior falhou.
     match_valor_sem_simbolo = re.search(r"Valor:\s*([\d\.,]+)", text_block, re.DOTALL | re.IGNORECASE)
     if match_valor_sem_simbolo:
-        return parse_value(match_valor_sem_simbolo.group(1))
+        return match_valor_sem_simbolo.group(1)
 
     # Se nenhum dos padrões "Valor:" for encontrado, tenta usar o fallback "TOTAL A PAGAR"
     match_total_a_pagar = re.search(r"TOTAL A PAGAR\s*R\$\s*([\d\.,]+)", text_block, re.IGNORECASE)
     if match_total_a_pagar:
-        return parse_value(match_total_a_pagar.group(1))
+        return match_total_a_pagar.group(1)
+
+    # Se nada for encontrado, retorna None
+    return None
 
-    # Se nada for encontrado, retorna 0.0
-    return 0.0
+# Número (opcionalmente negativo) precedido de espaço; o grupo 1 captura o sinal
+NUMERO_APOS_ESPACO_REGEX = re.compile(r"(?<!\s)\s+(-?)[\d\.,]+")
 
-def extract_item_value_from_block(text_block, item_name_pattern):
+def extract_item_value_from_block(text_block, item_name_pattern, prazo=None):
     """
     Extrai o valor da coluna 'Valor (R$)' para um item específico da seção 'Itens da Fatura'.
     Modificado para pegar o valor na 3ª coluna numérica após o nome do item,
     para lidar com o layout específico dos 'Tributos Retidos'.
     """
     if not text_block or not isinstance(text_block, str):
-        return 0.0
+        return 0
+    valor_str = localizar_valor_item(limpar_bloco_itens(text_block), item_name_pattern, prazo)
+    return parse_centavos(valor_str) if valor_str is not None else 0
 
+def limpar_bloco_itens(text_block):
+    """Remove linhas vazias e espaços repetidos do bloco, para a busca dos valores dos itens da fatura."""
     cleaned_text_block = "\n".join(line.strip() for line in text_block.splitlines() if line.strip())
-    cleaned_text_block = re.sub(r'[ \t]+', ' ', cleaned_text_block)
+    return re.sub(r'[ \t]+', ' ', cleaned_text_block)
+
+def localizar_valor_item(cleaned_text_block, item_name_pattern, prazo=None):
+    """
+    Texto do valor de um item (3ª coluna numérica após o nome) em um bloco já limpo por limpar_bloco_itens.
+    Retorna None se o item ou o valor não for encontrado. O 'prazo' (ver verificar_prazo_bloco) é
+    verificado a cada número percorrido.
+    """
+    match_item = re.search(item_name_pattern, cleaned_text_block, re.IGNORECASE)
+    if not match_item:
+        return None
 
-    pattern = rf"{item_name_pattern}.*?\s+[\d\.,]+.*?\s+[\d\.,]+.*?\s+(-?[\d\.,]+)"
-    match = re.search(pattern, cleaned_text_block, re.MULTILINE | re.IGNORECASE | re.DOTALL)
+    # Varredura linear dos números precedidos de espaço após o nome do item (equivale ao padrão
+    # "item.*?\s+[\d\.,]+.*?\s+[\d\.,]+.*?\s+(-?[\d\.,]+)", sem o retrocesso exponencial do '.*?' com DOTALL).
+    # As duas primeiras colunas não podem ser negativas; a terceira é o valor.
+    colunas_encontradas = 0
+    for match_numero in NUMERO_APOS_ESPACO_REGEX.finditer(cleaned_text_block, match_item.end()):
+        verificar_prazo_bloco(prazo)
+        if colunas_encontradas == 2:
+            return match_numero.group(0).lstrip()
+        if not match_numero.group(1):
+            colunas_encontradas += 1
+    return None
 
-    if match:
-        return parse_value(match.group(1))
-    return 0.0
+ITENS_DA_FATURA_REGEX = re.compile(r"Itens da Fatura", re.IGNORECASE)
+FIM_ITENS_DA_FATURA_REGEX = re.compile(r"Valores Medidos|Tributo Retido IRPJ", re.IGNORECASE)
 
-def extract_new_controle_data(text_block):
+def extract_new_controle_data(text_block, prazo=None):
     """
     Extrai os dados de Energia e Retenção baseados na alíquota de IRPJ (1,2% ou 4,8%)
-    para a nova planilha de 'Controle'.
+    para a nova planilha de 'Controle'. O 'prazo' (ver verificar_prazo_bloco) é verificado a cada linha.
     """
-    data = {
-        "Energia (1,2%)": 0.0,
-        "Retenção(1,2%)": 0.0,
-        "Energia (4,8%)": 0.0,
-        "Retenção(4,8%)": 0.0
-    }
+    linhas_controle = localizar_valores_controle(text_block, prazo)
+    return somar_valores_controle(linhas_controle, parse_centavos_lote(texto for _, _, textos in linhas_controle for texto in textos))
 
-    # Procura a seção de "Itens da Fatura" para focar a extração
-    match_itens = re.search(r"Itens da Fatura.*?(?=Valores Medidos|Tributo Retido IRPJ|$)", text_block, re.DOTALL | re.IGNORECASE)
-    if not match_itens:
-        return data
+def localizar_valores_controle(text_block, prazo=None):
+    """
+    Textos dos valores da aba 'Controle' em um bloco (ver extract_new_controle_data), sem convertê-los: para cada
+    linha de Energia dos 'Itens da Fatura', (chave da Energia, chave da Retenção, [Valor (R$), IRPJ, PIS, COFINS, CSLL]).
+    """
+    linhas_controle = []
 
-    relevant_text = match_itens.group(0)
+    # Procura a seção de "Itens da Fatura" (até "Valores Medidos", "Tributo Retido IRPJ" ou o fim do bloco)
+    # para focar a extração. Duas buscas simples, em tempo linear.
+    match_itens = ITENS_DA_FATURA_REGEX.search(text_block)
+    if not match_itens:
+        return linhas_controle
+    match_fim_itens = FIM_ITENS_DA_FATURA_REGEX.search(text_block, match_itens.end())
+    relevant_text = text_block[match_itens.start():match_fim_itens.start() if match_fim_itens else len(text_block)]
     lines = relevant_text.split('\n')
     
     for line in lines:
+        verificar_prazo_bloco(prazo)
         # Verifica se a linha parece conter a estrutura de dados esperada
         if re.search(r'\s1,2\s', line) or re.search(r'\s4,8\s', line):
             # Extrai todos os números (incluindo negativos e decimais com vírgula/ponto) da linha
@@ -152,49 +510,176 @@ def extract_new_controle_data(text_block):
                 # Os 4 valores de retenção são os 4 números após a alíquota
                 if percent_index >= 3 and (percent_index + 4) < len(numbers):
                     # O 'Valor (R$)' é o 3º valor antes da alíquota, conforme a estrutura de colunas
-                    valor_energia = parse_value(numbers[percent_index - 3])
-                    
                     # Os valores de retenção (IRPJ, PIS, COFINS, CSLL) são os quatro após a alíquota
-                    irpj_val = parse_value(numbers[percent_index + 1])
-                    pis_val = parse_value(numbers[percent_index + 2])
-                    cofins_val = parse_value(numbers[percent_index + 3])
-                    csll_val = parse_value(numbers[percent_index + 4])
-                    
-                    soma_retencao = abs(irpj_val) + abs(pis_val) + abs(cofins_val) + abs(csll_val)
-                    
-                    # Soma os valores encontrados aos totais
-                    data[target_key_energia] += valor_energia
-                    data[target_key_retencao] += soma_retencao
+                    linhas_controle.append((target_key_energia, target_key_retencao,
+                                            [numbers[percent_index - 3]] + numbers[percent_index + 1:percent_index + 5]))
             
             except (ValueError, IndexError):
                 # Ocorre se o formato da linha for inesperado. Ignora a linha e continua.
                 continue
     
+    return linhas_controle
+
+def somar_valores_controle(linhas_controle, centavos):
+    """
+    Dados da aba 'Controle' de um bloco a partir das linhas de localizar_valores_controle e dos seus valores
+    já convertidos para centavos ('centavos': cinco por linha, na mesma ordem).
+    """
+    data = {
+        "Energia (1,2%)": 0,
+        "Retenção(1,2%)": 0,
+        "Energia (4,8%)": 0,
+        "Retenção(4,8%)": 0
+    }
+    for i, (target_key_energia, target_key_retencao, _) in enumerate(linhas_controle):
+        valor_energia, irpj_val, pis_val, cofins_val, csll_val = centavos[5 * i:5 * i + 5]
+        soma_retencao = abs(irpj_val) + abs(pis_val) + abs(cofins_val) + abs(csll_val)
+
+        # Soma os valores encontrados aos totais
+        data[target_key_energia] += valor_energia
+        data[target_key_retencao] += soma_retencao
     return data
 
 
-def extract_fatura_data_from_text_block(text_block, df_base, pdf_filename_for_error_logging, logger_func, page_num=None):
+def resolve_uc_na_base(uc_number, df_base):
+    """
+    Procura a UC na planilha base.
+    Retorna a tupla (Cod de Reg, Nome) ou None se a UC não estiver cadastrada.
+    """
+    base_info = df_base[df_base['UC'].astype(str) == uc_number]
+    if base_info.empty:
+        return None
+    return base_info['Cod de Reg'].iloc[0], base_info['Nome'].iloc[0]
+
+class LogAdiado:
+    """
+    Guarda as chamadas de log de uma etapa para repassá-las depois a outro logger.
+    Usado para analisar um bloco antes de saber se a UC existe na planilha base: os avisos
+    da análise só são repassados se a UC for encontrada (a formatação continua adiada).
+    """
+
+    def __init__(self):
+        self.chamadas = []
+
+    def registrar(self, level, codigo, modelo, **campos):
+        self.chamadas.append((level, codigo, modelo, campos))
+
+    def __call__(self, message, level="INFO", codigo=None, **campos):
+        self.chamadas.append((level, codigo, "{mensagem}", dict(campos, mensagem=message)))
+
+    def repassar(self, logger_func):
+        for level, codigo, modelo, campos in self.chamadas:
+            registrar_log(logger_func, level, codigo, modelo, **campos)
+
+class TempoLimiteBloco(Exception):
+    """Levantada quando a análise de um bloco excede o tempo limite ('tempo_limite_bloco_ms')."""
+
+def verificar_prazo_bloco(prazo):
+    """Levanta TempoLimiteBloco se o prazo (time.perf_counter()) tiver passado. 'prazo' None = sem limite."""
+    if prazo is not None and time.perf_counter() > prazo:
+        raise TempoLimiteBloco()
+
+def analisar_bloco_fatura(text_block, pdf_filename_for_error_logging, page_num=None, tempo_limite=None):
+    """
+    Extrai a UC e os valores de um bloco de texto, sem consultar a planilha base.
+    Se a análise exceder 'tempo_limite' (segundos), os valores são substituídos por um item de erro.
+    Retorna (UC, valores ou item de erro, LogAdiado com os avisos da análise) ou None se o bloco não tiver UC.
+    """
+    blocos_analisados = analisar_blocos_fatura([text_block], pdf_filename_for_error_logging, page_num, tempo_limite)
+    return blocos_analisados[0] if blocos_analisados else None
+
+def analisar_blocos_fatura(text_blocks, pdf_filename_for_error_logging, page_num=None, tempo_limite=None):
+    """
+    Analisa os blocos de texto de uma página como analisar_bloco_fatura. Os textos dos valores são capturados
+    bloco a bloco (cada um com o seu 'tempo_limite') e os de todos os blocos convertidos para centavos de uma
+    só vez (parse_centavos_lote). Retorna a lista de blocos analisados, sem os blocos sem UC.
+    """
+    capturas = []
+    for text_block in text_blocks:
+        uc_number = extract_uc_from_block(text_block)
+        if not uc_number:
+            continue
+        prazo = time.perf_counter() + tempo_limite if tempo_limite else None
+        try:
+            capturas.append((uc_number, text_block, capturar_valores_fatura(text_block, prazo)))
+        except TempoLimiteBloco:
+            capturas.append((uc_number, text_block, None))
+
+    centavos = parse_centavos_lote(texto for _, _, captura in capturas if captura is not None for texto in captura.textos)
+    blocos_analisados = []
+    inicio = 0
+    for uc_number, text_block, captura in capturas:
+        log_adiado = LogAdiado()
+        if captura is None:
+            numero_pagina = f"{pdf_filename_for_error_logging} (Pág. {page_num + 1})" if page_num is not None else pdf_filename_for_error_logging
+            error_msg = (f"Tempo limite ({tempo_limite * 1000:.0f} ms) excedido ao analisar o bloco da UC {uc_number} "
+                         f"({len(text_block)} caracteres) em {numero_pagina}. Fatura não extraída.")
+            registrar_log(log_adiado, "ERROR", "TEMPO_LIMITE_BLOCO", "{mensagem}", mensagem=error_msg,
+                          pdf=pdf_filename_for_error_logging, pagina=page_num + 1 if page_num is not None else None, uc=uc_number)
+            valores = {"error": error_msg, "Observação": error_msg, "UC": uc_number, "Numero da Pagina": numero_pagina}
+        else:
+            fim = inicio + len(captura.textos)
+            valores = montar_valores_fatura(captura, centavos[inicio:fim], uc_number, pdf_filename_for_error_logging, log_adiado, page_num)
+            inicio = fim
+        blocos_analisados.append((uc_number, valores, log_adiado))
+    return blocos_analisados
+
+def resolver_uc_fatura(bloco_analisado, df_base, pdf_filename_for_error_logging, logger_func, page_num=None):
+    """
+    Associa um bloco já analisado (ver analisar_bloco_fatura) ao centro de custo e subseção da planilha base.
+    Retorna um dicionário com os dados da fatura ou um dicionário de erro.
+    """
+    uc_number, fatura_data, log_adiado = bloco_analisado
+    if "error" in fatura_data:
+        log_adiado.repassar(logger_func)
+        return fatura_data
+    dados_base = resolve_uc_na_base(uc_number, df_base)
+    if dados_base is None:
+        error_msg = f"UC {uc_number} (de {pdf_filename_for_error_logging}) não encontrada na planilha base."
+        registrar_log(logger_func, "ERROR", "UC_NAO_ENCONTRADA", "{mensagem}", mensagem=error_msg,
+                      pdf=pdf_filename_for_error_logging, pagina=page_num + 1 if page_num is not None else None, uc=uc_number)
+        # Guarda os valores já extraídos para que a UC possa ser revinculada
+        # (após atualizar a planilha base) sem reprocessar o PDF
+        return {"error": error_msg, "UC": uc_number, "Numero da Pagina": fatura_data["Numero da Pagina"], "_dados_extraidos": fatura_data}
+
+    log_adiado.repassar(logger_func)
+    fatura_data["Centro de Custo"], fatura_data["Subseção"] = dados_base
+    return fatura_data
+
+def extract_fatura_data_from_text_block(text_block, df_base, pdf_filename_for_error_logging, logger_func, page_num=None,
+                                        tempo_limite=None):
     """
     Extrai todos os dados de uma fatura a partir de um bloco de texto.
     Retorna um dicionário com os dados ou um dicionário de erro.
     """
-    uc_number = extract_uc_from_block(text_block)
-    if not uc_number:
+    bloco_analisado = analisar_bloco_fatura(text_block, pdf_filename_for_error_logging, page_num, tempo_limite)
+    if bloco_analisado is None:
         return None
+    return resolver_uc_fatura(bloco_analisado, df_base, pdf_filename_for_error_logging, logger_func, page_num)
 
-    base_info = df_base[df_base['UC'].astype(str) == uc_number]
-    if base_info.empty:
-        error_msg = f"UC {uc_number} (de {pdf_filename_for_error_logging}) não encontrada na planilha base."
-        if logger_func:
-            logger_func(error_msg, "ERROR")
-        return {"error": error_msg, "UC": uc_number, "Numero da Pagina": pdf_filename_for_error_logging}
+def extract_fatura_values_from_block(text_block, uc_number, pdf_filename_for_error_logging, logger_func, page_num=None, prazo=None):
+    """
+    Extrai os valores de uma fatura (independentes da planilha base) a partir de um bloco de texto.
+    'Centro de Custo' e 'Subseção' são deixados em branco (None) para serem preenchidos pela base.
+    Se 'prazo' (time.perf_counter()) for informado, levanta TempoLimiteBloco quando ele for ultrapassado.
+    """
+    captura = capturar_valores_fatura(text_block, prazo)
+    return montar_valores_fatura(captura, parse_centavos_lote(captura.textos), uc_number, pdf_filename_for_error_logging,
+                                 logger_func, page_num)
 
-    cod_reg = base_info['Cod de Reg'].iloc[0]
-    nome_base = base_info['Nome'].iloc[0]
+# Textos dos valores de um bloco de fatura, ainda não convertidos para centavos: 'textos' traz o valor da fatura,
+# os tributos retidos (IRPJ, PIS, COFINS, CSLL), a COSIP e os cinco valores de cada linha de 'linhas_controle'
+# (ver localizar_valores_controle); textos não encontrados são None
+ValoresCapturados = namedtuple("ValoresCapturados", ["textos", "linhas_controle", "referencia"])
 
-    valor_liquido_fatura = extract_valor_total_fatura_from_block(text_block)
-    if valor_liquido_fatura == 0.0 and logger_func:
-         logger_func(f"Valor Líquido da fatura (Valor Total da Fatura) não encontrado ou zerado para UC {uc_number} em {pdf_filename_for_error_logging}. Verifique o PDF ou o padrão de extração.", "WARNING")
+def capturar_valores_fatura(text_block, prazo=None):
+    """
+    Localiza os textos dos valores de uma fatura em um bloco, sem convertê-los (ver extract_fatura_values_from_block).
+    Se 'prazo' (time.perf_counter()) for informado, levanta TempoLimiteBloco quando ele for ultrapassado.
+    Retorna ValoresCapturados.
+    """
+    textos = [localizar_valor_total_fatura(text_block)]
+    verificar_prazo_bloco(prazo)
 
     tributos_retidos_patterns = {
         "IRPJ": r"Tributo Retido IRPJ",
@@ -203,25 +688,53 @@ def extract_fatura_data_from_text_block(text_block, df_base, pdf_filename_for_er
         "CSLL": r"Tributo Retido CSLL"
     }
 
-    soma_valores_negativos_tributos = 0.0
-    found_any_tax_value_non_zero = False
-
+    cleaned_text_block = limpar_bloco_itens(text_block)
     for nome_tributo, pattern_str in tributos_retidos_patterns.items():
-        valor_tributo = extract_item_value_from_block(text_block, re.escape(pattern_str))
-        soma_valores_negativos_tributos += valor_tributo
-        if valor_tributo != 0.0:
-            found_any_tax_value_non_zero = True
+        textos.append(localizar_valor_item(cleaned_text_block, re.escape(pattern_str), prazo))
+        verificar_prazo_bloco(prazo)
+
+    cosip_item_name_pattern = r"COSIP Municipal"
+    textos.append(localizar_valor_item(cleaned_text_block, cosip_item_name_pattern, prazo))
+    verificar_prazo_bloco(prazo)
+
+    # Valores EXCLUSIVOS da aba de Controle
+    linhas_controle = localizar_valores_controle(text_block, prazo)
+    verificar_prazo_bloco(prazo)
+    for _, _, textos_linha in linhas_controle:
+        textos.extend(textos_linha)
+
+    return ValoresCapturados(textos, linhas_controle, extract_referencia_from_block(text_block))
+
+def montar_valores_fatura(captura, centavos, uc_number, pdf_filename_for_error_logging, logger_func, page_num=None):
+    """
+    Monta os valores de uma fatura a partir dos textos capturados (ver capturar_valores_fatura) e de 'centavos',
+    os mesmos textos já convertidos, na mesma ordem (textos não encontrados valem 0).
+    """
+    valor_liquido_fatura = centavos[0]
+    pagina_log = page_num + 1 if page_num is not None else None
+
+    if valor_liquido_fatura == 0:
+        registrar_log(logger_func, "WARNING", "LIQUIDO_NAO_ENCONTRADO",
+                      "Valor Líquido da fatura (Valor Total da Fatura) não encontrado ou zerado para UC {uc} em {pdf}. Verifique o PDF ou o padrão de extração.",
+                      pdf=pdf_filename_for_error_logging, pagina=pagina_log, uc=uc_number)
+
+    valores_tributos = centavos[1:5]
+    soma_valores_negativos_tributos = sum(valores_tributos)
+    found_any_tax_value_non_zero = any(valor_tributo != 0 for valor_tributo in valores_tributos)
 
     retencao_tributos = abs(soma_valores_negativos_tributos)
 
-    if retencao_tributos == 0.0 and not found_any_tax_value_non_zero and logger_func:
-         logger_func(f"INFO: Nenhum item de tributo retido ('Tributo Retido IRPJ/PIS/COFINS/CSLL') encontrado ou extraído com valor não zero para UC {uc_number} em {pdf_filename_for_error_logging}. 'RETENÇÃO (R$)' será 0.00.", "INFO")
+    if retencao_tributos == 0 and not found_any_tax_value_non_zero:
+        registrar_log(logger_func, "DEBUG", "SEM_RETENCAO",
+                      "Nenhum item de tributo retido ('Tributo Retido IRPJ/PIS/COFINS/CSLL') encontrado ou extraído com valor não zero para UC {uc} em {pdf}. 'RETENÇÃO (R$)' será 0.00.",
+                      pdf=pdf_filename_for_error_logging, pagina=pagina_log, uc=uc_number)
 
-    cosip_item_name_pattern = r"COSIP Municipal"
-    valor_cosip = extract_item_value_from_block(text_block, cosip_item_name_pattern)
+    valor_cosip = centavos[5]
 
-    if valor_cosip == 0.0 and logger_func:
-        logger_func(f"INFO: COSIP (ou 'COSIP Municipal') não encontrado ou extraído com valor zero para UC {uc_number} em {pdf_filename_for_error_logging}. 'COSIP (R$)' será 0.00.", "INFO")
+    if valor_cosip == 0:
+        registrar_log(logger_func, "DEBUG", "COSIP_ZERADO",
+                      "COSIP (ou 'COSIP Municipal') não encontrado ou extraído com valor zero para UC {uc} em {pdf}. 'COSIP (R$)' será 0.00.",
+                      pdf=pdf_filename_for_error_logging, pagina=pagina_log, uc=uc_number)
 
     valor_bruto_fatura_calculado = valor_liquido_fatura + retencao_tributos
     valor_energia_calculado = valor_bruto_fatura_calculado - valor_cosip
@@ -231,91 +744,389 @@ def extract_fatura_data_from_text_block(text_block, df_base, pdf_filename_for_er
     # Dados para a aba Relatorio (formato antigo)
     fatura_data = {
         "UC": uc_number,
-        "Centro de Custo": cod_reg,
-        "Subseção": nome_base,
+        "Centro de Custo": None,
+        "Subseção": None,
         "ENERGIA (R$)": valor_energia_calculado,
         "COSIP (R$)": valor_cosip,
         "Valor Bruto (R$)": valor_bruto_fatura_calculado,
         "RETENÇÃO (R$)": retencao_tributos,
         "LÍQUIDO (R$)": valor_liquido_fatura,
-        "Numero da Pagina": numero_pagina_display
+        "Numero da Pagina": numero_pagina_display,
+        "Referência": captura.referencia
     }
 
-    # Extrai e adiciona os novos dados EXCLUSIVAMENTE para a aba de Controle
-    controle_data = extract_new_controle_data(text_block)
-    fatura_data.update(controle_data)
+    # Adiciona os novos dados EXCLUSIVAMENTE para a aba de Controle
+    fatura_data.update(somar_valores_controle(captura.linhas_controle, centavos[6:]))
 
     return fatura_data
 
-def process_pdf_file(pdf_path, df_base, logger_func, progress_callback):
+# Âncora presente em toda fatura Celesc: início de cada bloco de fatura de uma página
+# (usada também na verificação preliminar dos PDFs e na contagem de UCs dos totais rápidos)
+UC_ANCORA_REGEX = re.compile(r"(?:UC:|Unidade Consumidora:)\s*\d+")
+
+def dividir_blocos_pagina(page_text, page_num, pdf_filename, logger_func):
+    """
+    Divide o texto de uma página em blocos (um por UC).
+    Sem nenhuma UC explícita, a primeira página (provável sumário) é pulada e as demais
+    são tratadas como um bloco único. Retorna a lista de blocos de texto.
+    """
+    matches = list(UC_ANCORA_REGEX.finditer(page_text))
+
+    if not matches:
+        if page_num == 0:
+            registrar_log(logger_func, "INFO", "PAGINA_SUMARIO", "Nenhuma UC explícita na página {pagina} (provável sumário) de {pdf}. Pulando página.",
+                          pdf=pdf_filename, pagina=page_num + 1)
+            return []
+        registrar_log(logger_func, "INFO", "PAGINA_SEM_UC", "Nenhuma UC explícita na página {pagina} de {pdf}. Tentando processar a página inteira como um bloco único.",
+                      pdf=pdf_filename, pagina=page_num + 1)
+        return [page_text]
+
+    blocos = []
+    for i, match in enumerate(matches):
+        start_block = match.start()
+        end_block = matches[i+1].start() if i + 1 < len(matches) else len(page_text)
+        blocos.append(page_text[start_block:end_block])
+    return blocos
+
+def extract_faturas_from_page_text(page_text, page_num, df_base, pdf_filename, logger_func, tempo_limite=None):
+    """
+    Divide o texto de uma página em blocos (um por UC) e extrai os dados de cada fatura.
+    'tempo_limite' (segundos) limita a análise de cada bloco (ver analisar_bloco_fatura).
+    Retorna uma lista de dicionários (dados da fatura ou erros).
+    """
+    blocos_analisados = analisar_blocos_fatura(dividir_blocos_pagina(page_text, page_num, pdf_filename, logger_func),
+                                               pdf_filename, page_num, tempo_limite)
+    return [resolver_uc_fatura(bloco_analisado, df_base, pdf_filename, logger_func, page_num) for bloco_analisado in blocos_analisados]
+
+# --- Perfis de Extração de Texto ---
+
+def _texto_perfil_pymupdf(page, page_fitz):
+    return page_fitz.get_text("text", sort=True)
+
+def _texto_perfil_pdfplumber(page, page_fitz):
+    return page.extract_text(x_tolerance=2, y_tolerance=3)
+
+def _texto_perfil_pdfplumber_preciso(page, page_fitz):
+    # Remove caracteres sobrepostos (negrito simulado de geradores antigos) e separa palavras mais próximas
+    return page.dedupe_chars().extract_text(x_tolerance=1, y_tolerance=3)
+
+# Perfis de extração de texto, do mais barato ao mais pesado
+PERFIS_EXTRACAO = [
+    ("pymupdf", _texto_perfil_pymupdf),
+    ("pdfplumber", _texto_perfil_pdfplumber),
+    ("pdfplumber_preciso", _texto_perfil_pdfplumber_preciso)
+]
+PERFIL_PADRAO = 1 # Perfil de referência (usado na calibração e quando nenhum perfil é validado)
+NOMES_PERFIS = [nome for nome, _ in PERFIS_EXTRACAO]
+
+# Itens que, presentes no bloco, devem ter valor extraído para que o texto da página seja considerado válido
+ROTULOS_VALIDACAO = ["Tributo Retido IRPJ", "Tributo Retido PIS", "Tributo Retido COFINS", "Tributo Retido CSLL", "COSIP Municipal"]
+# Âncora do valor da fatura (ver extract_valor_total_fatura_from_block)
+VALOR_FATURA_REGEX = re.compile(r"Valor:\s*(?:R\$\s*)?[\d\.,]+|TOTAL A PAGAR\s*R\$\s*[\d\.,]+", re.IGNORECASE)
+# Páginas com faturas em que um perfil mais barato deve reproduzir as faturas do perfil de referência para ser adotado
+PAGINAS_CALIBRACAO = 2
+# Com um perfil mais barato que o de referência, uma página com faturas a cada PAGINAS_ENTRE_CONFERENCIAS (por PDF)
+# tem as faturas conferidas contra as do perfil de referência
+PAGINAS_ENTRE_CONFERENCIAS = 25
+
+def impressao_digital_pdf(doc_fitz):
+    """
+    Identifica o gerador e o layout de um PDF: produtor, criador, tamanho da primeira página e fontes usadas nela
+    (sem o prefixo de subconjunto, ex: 'ABCDEF+Arial'). Retorna (impressão digital, descrição legível).
+    """
+    metadados = doc_fitz.metadata or {}
+    pagina = doc_fitz[0]
+    fontes = sorted({fonte[3].split("+", 1)[-1] for fonte in doc_fitz.get_page_fonts(0)})
+    descricao = (f"{metadados.get('producer') or '?'} | {metadados.get('creator') or '?'} | "
+                 f"{round(pagina.rect.width)}x{round(pagina.rect.height)} | {', '.join(fontes)}")
+    return hashlib.sha256(descricao.encode('utf-8')).hexdigest()[:16], descricao
+
+def validar_texto_pagina(page_text):
+    """
+    Verificação barata do texto extraído por um perfil, sem analisar as faturas: cada bloco de UC deve ter a
+    âncora do valor da fatura ('Valor:') e um valor para cada item de tributo/COSIP presente no bloco
+    (um valor zerado é válido). Páginas sem texto ou sem UC são consideradas válidas.
+    """
+    if not page_text or not page_text.strip():
+        return True
+    inicios = [match.start() for match in UC_ANCORA_REGEX.finditer(page_text)]
+    for inicio, fim in zip(inicios, inicios[1:] + [len(page_text)]):
+        text_block = page_text[inicio:fim]
+        if not VALOR_FATURA_REGEX.search(text_block):
+            return False
+        rotulos = [rotulo for rotulo in ROTULOS_VALIDACAO if rotulo in text_block]
+        if rotulos:
+            cleaned_text_block = limpar_bloco_itens(text_block)
+            if any(localizar_valor_item(cleaned_text_block, re.escape(rotulo)) is None for rotulo in rotulos):
+                return False
+    return True
+
+def analisar_texto_pagina(page_text, page_num):
+    """
+    Analisa os blocos de uma página (sem registrar log), para comparar as faturas extraídas por dois perfis
+    na calibração. Retorna a tupla (UC, valores) dos blocos, ou None se o texto não for validado
+    (ver validar_texto_pagina) ou algum bloco não for reconhecido.
+    """
+    if not validar_texto_pagina(page_text):
+        return None
+    if not page_text or not page_text.strip():
+        return ()
+    analises = []
+    for uc_number, valores, _ in analisar_blocos_fatura(dividir_blocos_pagina(page_text, page_num, "", LogAdiado()), "", page_num):
+        if "error" in valores:
+            return None
+        analises.append((uc_number, tuple(sorted(valores.items()))))
+    return tuple(analises)
+
+class PerfisExtracao:
+    """
+    Perfil de extração de texto conhecido para cada impressão digital de PDF (ver impressao_digital_pdf),
+    guardado em JSON entre execuções. Um perfil só é trocado por um mais pesado (escalonamento).
+    Pode ser usado por várias threads; os processos de extração devolvem os perfis alterados para 'mesclar'.
+    """
+
+    def __init__(self, cache_path=None, logger_func=None, conhecidos=None):
+        self.cache_path = cache_path
+        self.logger_func = logger_func
+        self.lock = threading.Lock()
+        self.perfis = dict(conhecidos or {}) # impressão digital -> {"perfil": nome, "descricao": ...}
+        self.alterados = {}
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    self.perfis.update(json.load(f))
+            except Exception as e:
+                if logger_func:
+                    logger_func(f"Não foi possível ler os perfis de extração ({cache_path}): {e}. Os perfis serão recalibrados.", "WARNING")
+
+    def indice(self, impressao):
+        """Índice (em PERFIS_EXTRACAO) do perfil conhecido para a impressão digital, ou None se ainda não calibrado."""
+        with self.lock:
+            registro = self.perfis.get(impressao)
+        if registro is None or registro.get("perfil") not in NOMES_PERFIS:
+            return None
+        return NOMES_PERFIS.index(registro["perfil"])
+
+    def registrar(self, impressao, indice, descricao):
+        """Associa o perfil à impressão digital (um perfil já conhecido só é trocado por um mais pesado)."""
+        with self.lock:
+            atual = self.perfis.get(impressao)
+            if atual is not None and atual.get("perfil") in NOMES_PERFIS and NOMES_PERFIS.index(atual["perfil"]) >= indice:
+                return
+            registro = {"perfil": NOMES_PERFIS[indice], "descricao": descricao}
+            self.perfis[impressao] = registro
+            self.alterados[impressao] = registro
+
+    def mesclar(self, alterados):
+        """Incorpora os perfis alterados em outro processo."""
+        for impressao, registro in alterados.items():
+            if registro.get("perfil") in NOMES_PERFIS:
+                self.registrar(impressao, NOMES_PERFIS.index(registro["perfil"]), registro.get("descricao", ""))
+
+    def salvar(self):
+        """Grava os perfis em disco, se houver alterações."""
+        with self.lock:
+            if not self.alterados or not self.cache_path:
+                return
+            perfis = dict(self.perfis)
+        try:
+            temp_path = self.cache_path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(perfis, f, ensure_ascii=False, indent=1)
+            os.replace(temp_path, self.cache_path)
+            with self.lock:
+                self.alterados = {}
+        except Exception as e:
+            if self.logger_func:
+                self.logger_func(f"Não foi possível gravar os perfis de extração ({self.cache_path}): {e}", "WARNING")
+
+class LeitorTextoPdf:
+    """
+    Extrai o texto das páginas de um PDF com o perfil mais barato conhecido para a sua impressão digital.
+    PDFs de impressão digital ainda desconhecida são calibrados nas primeiras PAGINAS_CALIBRACAO páginas com
+    faturas: o perfil mais barato que produz as mesmas faturas do perfil de referência em todas elas é adotado.
+    Uma página que não é validada (validar_texto_pagina) com o perfil atual é extraída com os perfis mais
+    pesados, e o primeiro validado passa a ser usado no restante do PDF (e nas próximas execuções).
+    Como a validação não confere os valores, um perfil mais barato que o de referência é conferido por amostragem
+    (ver _conferir): texto com colunas reordenadas, mas com valores plausíveis, também leva ao perfil de referência.
+    """
+
+    def __init__(self, pdf_path, pdf_bytes, perfis, logger_func):
+        self.pdf_path = pdf_path
+        self.pdf_bytes = pdf_bytes
+        self.pdf_filename = nome_pdf(pdf_path)
+        self.perfis = perfis
+        self.logger_func = logger_func
+        self.doc_fitz = None # Aberto na primeira página lida
+        self.impressao = None
+        self.descricao = None
+        self.indice = None # None = calibrando
+        self.paginas_calibradas = 0
+        self.candidatos = list(range(PERFIL_PADRAO)) # Perfis mais baratos ainda de acordo com o de referência
+        self.escalonamento_esgotado = False # Uma página já falhou com todos os perfis: as seguintes não são reextraídas
+        self.paginas_ate_conferencia = 0 # Páginas até a próxima conferência do perfil (0 = na próxima página com faturas)
+
+    def _extrair(self, indice, page, page_num):
+        return PERFIS_EXTRACAO[indice][1](page, self.doc_fitz[page_num])
+
+    def _adotar(self, indice, page_num, codigo, modelo):
+        self.indice = indice
+        self.paginas_ate_conferencia = PAGINAS_ENTRE_CONFERENCIAS - 1
+        self.perfis.registrar(self.impressao, indice, self.descricao)
+        registrar_log(self.logger_func, "DEBUG" if codigo == "PERFIL_CALIBRADO" else "INFO", codigo, modelo,
+                      pdf=self.pdf_filename, pagina=page_num + 1, perfil=NOMES_PERFIS[indice], gerador=self.descricao)
+
+    def _escalonar(self, indice_atual, textos, page, page_num, modelo):
+        """
+        Extrai a página com os perfis mais pesados que 'indice_atual' e adota o primeiro validado.
+        'textos' ({índice: texto}) guarda os textos já extraídos da página, para que nenhum perfil seja
+        extraído duas vezes. Sem perfil validado, retorna o texto do perfil de referência.
+        """
+        if not self.escalonamento_esgotado:
+            for indice in range(indice_atual + 1, len(PERFIS_EXTRACAO)):
+                textos[indice] = self._extrair(indice, page, page_num)
+                if validar_texto_pagina(textos[indice]):
+                    self._adotar(indice, page_num, "PERFIL_ESCALONADO", modelo)
+                    return textos[indice]
+            self.escalonamento_esgotado = True
+        # Nenhum perfil reconhece a página: usa o texto do perfil de referência (os erros são apontados normalmente)
+        if PERFIL_PADRAO not in textos:
+            textos[PERFIL_PADRAO] = self._extrair(PERFIL_PADRAO, page, page_num)
+        return textos[PERFIL_PADRAO]
+
+    def texto(self, page, page_num):
+        """Texto da página (objeto pdfplumber 'page', numerada a partir de 0)."""
+        if self.doc_fitz is None:
+            self.doc_fitz = abrir_documento_fitz(self.pdf_path, self.pdf_bytes)
+            self.impressao, self.descricao = impressao_digital_pdf(self.doc_fitz)
+            self.indice = self.perfis.indice(self.impressao)
+
+        if self.indice is None:
+            return self._calibrar(page, page_num)
+
+        page_text = self._extrair(self.indice, page, page_num)
+        if not validar_texto_pagina(page_text):
+            return self._escalonar(self.indice, {self.indice: page_text}, page, page_num,
+                                   "Página {pagina} de {pdf} não reconhecida com o perfil de extração anterior; "
+                                   "usando o perfil '{perfil}' (gerador: {gerador}).")
+        if self.indice < PERFIL_PADRAO:
+            if self.paginas_ate_conferencia <= 0:
+                return self._conferir(page_text, page, page_num)
+            self.paginas_ate_conferencia -= 1
+        return page_text
+
+    def _conferir(self, page_text, page, page_num):
+        """
+        Confere as faturas extraídas com o perfil atual (mais barato) contra as do perfil de referência.
+        Se forem diferentes, o perfil de referência passa a ser usado no restante do PDF (e nas próximas
+        execuções) e o seu texto é retornado. Uma página sem faturas adia a conferência para a seguinte.
+        """
+        texto_referencia = self._extrair(PERFIL_PADRAO, page, page_num)
+        analise_referencia = analisar_texto_pagina(texto_referencia, page_num)
+        if analise_referencia == ():
+            return page_text
+        self.paginas_ate_conferencia = PAGINAS_ENTRE_CONFERENCIAS - 1
+        if analise_referencia is None or analisar_texto_pagina(page_text, page_num) == analise_referencia:
+            return page_text
+        self._adotar(PERFIL_PADRAO, page_num, "PERFIL_DIVERGENTE",
+                     "Faturas da página {pagina} de {pdf} diferentes das do perfil de extração padrão; "
+                     "usando o perfil '{perfil}' (gerador: {gerador}).")
+        return texto_referencia
+
+    def _calibrar(self, page, page_num):
+        texto_referencia = self._extrair(PERFIL_PADRAO, page, page_num)
+        if not validar_texto_pagina(texto_referencia):
+            return self._escalonar(PERFIL_PADRAO, {PERFIL_PADRAO: texto_referencia}, page, page_num,
+                                   "Página {pagina} de {pdf} não reconhecida com o perfil de extração padrão; "
+                                   "usando o perfil '{perfil}' (gerador: {gerador}).")
+        analise_referencia = analisar_texto_pagina(texto_referencia, page_num)
+        if not analise_referencia:
+            return texto_referencia # Página sem faturas (ou não reconhecida): a calibração continua na próxima
+
+        self.candidatos = [indice for indice in self.candidatos
+                           if analisar_texto_pagina(self._extrair(indice, page, page_num), page_num) == analise_referencia]
+        self.paginas_calibradas += 1
+        # Um PDF com menos páginas de faturas não registra perfil (segue com o de referência)
+        if not self.candidatos or self.paginas_calibradas >= PAGINAS_CALIBRACAO:
+            self._adotar(self.candidatos[0] if self.candidatos else PERFIL_PADRAO, page_num, "PERFIL_CALIBRADO",
+                         "Perfil de extração '{perfil}' calibrado até a página {pagina} de {pdf} (gerador: {gerador}).")
+        return texto_referencia
+
+    def fechar(self):
+        if self.doc_fitz is not None:
+            self.doc_fitz.close()
+            self.doc_fitz = None
+
+def process_pdf_file(pdf_path, df_base, logger_func, progress_callback, pdf_bytes=None, ocr_servico=None, ocr_pendentes=None,
+                     tempo_limite_bloco=None, perfis_extracao=None):
     """
     Processa um único arquivo PDF.
+    Se 'pdf_bytes' for informado (conteúdo já lido para a memória), o PDF é aberto a partir dele.
+    Se 'ocr_servico' for informado, páginas sem texto extraível são enviadas para OCR em segundo plano;
+    os pedidos pendentes são acrescentados a 'ocr_pendentes' para serem resolvidos pelo chamador.
+    'tempo_limite_bloco' (segundos) limita a análise de cada bloco de fatura.
+    O texto das páginas é extraído com o perfil conhecido em 'perfis_extracao' (ver LeitorTextoPdf).
     Retorna uma lista de dicionários (dados da fatura ou erros).
     """
     results_for_this_pdf = []
-    pdf_filename = os.path.basename(pdf_path)
+    pdf_filename = nome_pdf(pdf_path)
+    paginas_enviadas_ocr = 0
 
     try:
-        with pdfplumber.open(pdf_path) as pdf:
+        if pdf_bytes is None and dividir_caminho_zip(pdf_path):
+            pdf_bytes = ler_pdf_bytes(pdf_path)
+        with pdfplumber.open(io.BytesIO(pdf_bytes) if pdf_bytes is not None else pdf_path) as pdf:
             if not pdf.pages:
                 error_msg = f"PDF sem páginas: {pdf_filename}"
-                logger_func(error_msg, "ERROR")
+                registrar_log(logger_func, "ERROR", "PDF_SEM_PAGINAS", "{mensagem}", mensagem=error_msg, pdf=pdf_filename)
                 results_for_this_pdf.append({"error": error_msg, "Numero da Pagina": pdf_filename})
                 if progress_callback:
                     progress_callback(0)
                 return results_for_this_pdf
 
             total_pages_in_pdf = len(pdf.pages)
-
-            for page_num, page in enumerate(pdf.pages):
-                page_text = page.extract_text(x_tolerance=2, y_tolerance=3)
-                if not page_text or not page_text.strip():
-                    logger_func(f"Página {page_num + 1} de {pdf_filename} não contém texto extraível.", "INFO")
-                    if progress_callback:
-                        progress_callback(1)
-                    continue
-
-                uc_pattern = r"(?:UC:|Unidade Consumidora:)\s*\d+"
-                matches = list(re.finditer(uc_pattern, page_text))
-
-                if not matches:
-                    if page_num == 0:
-                         logger_func(f"Nenhuma UC explícita na página {page_num+1} (provável sumário) de {pdf_filename}. Pulando página.", "INFO")
-                         if progress_callback:
-                            progress_callback(1)
-                         continue
-                    else:
-                        logger_func(f"Nenhuma UC explícita na página {page_num+1} de {pdf_filename}. Tentando processar a página inteira como um bloco único.", "INFO")
-                        fatura_data = extract_fatura_data_from_text_block(page_text, df_base, pdf_filename, logger_func, page_num=page_num)
-                        if fatura_data:
-                            results_for_this_pdf.append(fatura_data)
+            leitor = LeitorTextoPdf(pdf_path, pdf_bytes, perfis_extracao or PerfisExtracao(), logger_func)
+            try:
+                for page_num, page in enumerate(pdf.pages):
+                    page_text = leitor.texto(page, page_num)
+                    if not page_text or not page_text.strip():
+                        if ocr_servico is not None and ocr_pendentes is not None:
+                            pedido = ocr_servico.submeter(pdf_path, pdf_bytes, page_num)
+                            if pedido is not None:
+                                registrar_log(logger_func, "INFO", "PAGINA_ENVIADA_OCR", "Página {pagina} de {pdf} não contém texto extraível. Enviada para OCR.",
+                                              pdf=pdf_filename, pagina=page_num + 1)
+                                ocr_pendentes.append((pdf_path, page_num, pedido))
+                                paginas_enviadas_ocr += 1
+                            else:
+                                registrar_log(logger_func, "DEBUG", "PAGINA_SEM_TEXTO", "Página {pagina} de {pdf} não contém texto nem imagem para OCR.",
+                                              pdf=pdf_filename, pagina=page_num + 1)
+                        else:
+                            registrar_log(logger_func, "DEBUG", "PAGINA_SEM_TEXTO", "Página {pagina} de {pdf} não contém texto extraível.",
+                                          pdf=pdf_filename, pagina=page_num + 1)
                         if progress_callback:
-                           progress_callback(1)
+                            progress_callback(1)
                         continue
 
-                for i, match in enumerate(matches):
-                    start_block = match.start()
-                    end_block = matches[i+1].start() if i + 1 < len(matches) else len(page_text)
-                    current_text_block = page_text[start_block:end_block]
-
-                    fatura_data = extract_fatura_data_from_text_block(current_text_block, df_base, pdf_filename, logger_func, page_num=page_num)
-                    if fatura_data:
-                        results_for_this_pdf.append(fatura_data)
+                    results_for_this_pdf.extend(extract_faturas_from_page_text(page_text, page_num, df_base, pdf_filename, logger_func,
+                                                                               tempo_limite_bloco))
 
-                if progress_callback:
-                   progress_callback(1)
+                    if progress_callback:
+                       progress_callback(1)
+            finally:
+                leitor.fechar()
 
-            if not results_for_this_pdf:
-                 no_data_msg = f"Nenhum dado de fatura (com UC identificável) ou erro relevante encontrado em {pdf_filename} após processar todas as páginas com texto extraível."
-                 logger_func(no_data_msg, "WARNING")
+            if not results_for_this_pdf and not paginas_enviadas_ocr:
+                 registrar_log(logger_func, "WARNING", "PDF_SEM_FATURAS",
+                               "Nenhum dado de fatura (com UC identificável) ou erro relevante encontrado em {pdf} após processar todas as páginas com texto extraível.",
+                               pdf=pdf_filename)
 
     except Exception as e:
         critical_error_msg = f"Erro crítico ao processar {pdf_filename}: {e}"
-        logger_func(critical_error_msg, "CRITICAL_ERROR")
+        registrar_log(logger_func, "CRITICAL_ERROR", "ERRO_CRITICO_PDF", "{mensagem}", mensagem=critical_error_msg, pdf=pdf_filename)
         results_for_this_pdf.append({"error": critical_error_msg, "Numero da Pagina": pdf_filename, "UC": "N/A"})
         if progress_callback:
            try:
-               with fitz.open(pdf_path) as pdf_err: # Using fitz here for consistency if pdfplumber failed to open
+               with abrir_documento_fitz(pdf_path, pdf_bytes) as pdf_err: # Using fitz here for consistency if pdfplumber failed to open
                     progress_callback(len(pdf_err.pages) - (page_num + 1 if 'page_num' in locals() else 0))
            except Exception:
                 progress_callback(1)
@@ -323,18 +1134,3612 @@ def process_pdf_file(pdf_path, df_base, logger_func, progress_callback):
     return results_for_this_pdf
 
 
-# --- Classe da Interface Gráfica ---
-class AppCelescReporter:
-    def __init__(self, root_window):
-        self.root = root_window
-        self.root.title("Gerador de Relatório Celesc - ver 1.2.1a")
-        self.center_window(700, 650)
-        self.root.resizable(False, False)
+def abrir_documento_fitz(pdf_path, pdf_bytes=None):
+    """Abre um documento com PyMuPDF (fitz) a partir dos bytes em memória, se disponíveis, ou do caminho."""
+    if pdf_bytes is None and dividir_caminho_zip(pdf_path):
+        pdf_bytes = ler_pdf_bytes(pdf_path)
+    if pdf_bytes is not None:
+        return fitz.open(stream=pdf_bytes, filetype="pdf")
+    return fitz.open(pdf_path)
+
+
+# --- PDFs Dentro de Arquivos ZIP ---
+
+# Um PDF dentro de um ZIP é referenciado como 'C:/faturas/lote.zip!fatura.pdf'
+SEPARADOR_ZIP = "!"
 
-        if getattr(sys, 'frozen', False):
-             basedir = os.path.dirname(sys.executable)
+def dividir_caminho_zip(pdf_path):
+    """Retorna (caminho do ZIP, nome do PDF no ZIP) se o caminho referencia um PDF dentro de um ZIP, senão None."""
+    indice = pdf_path.lower().find(".zip" + SEPARADOR_ZIP)
+    if indice == -1:
+        return None
+    return pdf_path[:indice + 4], pdf_path[indice + 5:]
+
+def nome_pdf(pdf_path):
+    """Nome do PDF para mensagens e referências: 'fatura.pdf' ou 'lote.zip!fatura.pdf'."""
+    partes_zip = dividir_caminho_zip(pdf_path)
+    if partes_zip:
+        return f"{os.path.basename(partes_zip[0])}{SEPARADOR_ZIP}{partes_zip[1]}"
+    return os.path.basename(pdf_path)
+
+@contextmanager
+def abrir_pdf(pdf_path):
+    """
+    Abre um PDF para leitura binária (do disco ou, descompactado sob demanda, de dentro de um ZIP).
+    Cada uso abre o seu próprio ZipFile, fechado ao final: as threads não compartilham handles e o
+    ZIP não fica bloqueado (no Windows) depois da execução.
+    """
+    partes_zip = dividir_caminho_zip(pdf_path)
+    if partes_zip is None:
+        with open(pdf_path, 'rb') as f:
+            yield f
+        return
+    with zipfile.ZipFile(partes_zip[0]) as arquivo_zip, arquivo_zip.open(partes_zip[1]) as f:
+        yield f
+
+def ler_pdf_bytes(pdf_path):
+    """Lê o conteúdo de um PDF (do disco ou, descompactado em memória, de dentro de um ZIP)."""
+    with abrir_pdf(pdf_path) as f:
+        return f.read()
+
+def tamanho_pdf(pdf_path):
+    """Tamanho em bytes do PDF (descompactado, se estiver dentro de um ZIP)."""
+    partes_zip = dividir_caminho_zip(pdf_path)
+    if partes_zip:
+        with zipfile.ZipFile(partes_zip[0]) as arquivo_zip:
+            return arquivo_zip.getinfo(partes_zip[1]).file_size
+    return os.path.getsize(pdf_path)
+
+def expandir_arquivos_zip(caminhos, logger_func):
+    """
+    Substitui cada arquivo .zip da seleção pelos PDFs que ele contém (na ordem do ZIP), sem extraí-los para o disco.
+    Retorna (caminhos de PDFs, itens de erro dos ZIPs inválidos ou sem PDFs).
+    """
+    pdf_files = []
+    erros = []
+    for caminho in caminhos:
+        if not caminho.lower().endswith(".zip"):
+            pdf_files.append(caminho)
+            continue
+        zip_name = os.path.basename(caminho)
+        try:
+            with zipfile.ZipFile(caminho) as arquivo_zip:
+                membros = [info.filename for info in arquivo_zip.infolist()
+                           if not info.is_dir() and info.filename.lower().endswith(".pdf")]
+        except (OSError, zipfile.BadZipFile) as e:
+            msg = f"Não foi possível abrir o arquivo ZIP {zip_name}: {e}"
+            logger_func(msg, "ERROR", "ZIP_INVALIDO", pdf=zip_name)
+            erros.append({"error": msg, "Observação": msg, "Numero da Pagina": zip_name, "UC": "N/A"})
+            continue
+        if not membros:
+            msg = f"Nenhum PDF encontrado no arquivo ZIP {zip_name}."
+            logger_func(msg, "WARNING", "ZIP_SEM_PDF", pdf=zip_name)
+            erros.append({"error": msg, "Observação": msg, "Numero da Pagina": zip_name, "UC": "N/A"})
+            continue
+        logger_func(f"{zip_name}: {len(membros)} PDF(s) encontrados no arquivo ZIP.", "INFO")
+        pdf_files.extend(f"{caminho}{SEPARADOR_ZIP}{membro}" for membro in membros)
+    return pdf_files, erros
+
+
+# --- Extração e Verificação do Valor Cobrado ---
+
+def clean_currency(value_str):
+    """Limpa uma string de valor monetário (ex: 1.234,56) para centavos inteiros (ex: 123456)."""
+    if not isinstance(value_str, str) or not value_str.strip():
+        return None
+    # Retorna None se não puder converter
+    return _converter_centavos(value_str)
+
+def extract_and_verify_valor_cobrado(pdf_path, pdf_bytes=None):
+    """
+    Extrai o 'Valor Cobrado' e verifica sua duplicação na primeira página do PDF.
+    Se 'pdf_bytes' for informado, o PDF é aberto a partir da memória.
+    Retorna o valor cobrado, sua string original, o líquido total (se duplicado)
+    e uma lista de mensagens de status.
+    """
+    try:
+        # 1 Abrir o PDF e acessar a primeira página
+        doc = abrir_documento_fitz(pdf_path, pdf_bytes)
+        if doc.page_count == 0:
+            doc.close()
+            return None, None, None, ["Erro: O PDF não contém páginas."]
+        
+        page = doc[0] # Foca apenas na primeira página
+        text = page.get_text("text") # Extrai todo o texto da primeira página
+        doc.close() # Fecha o documento
+
+        return verificar_valor_cobrado_texto(text)
+
+    except Exception as e:
+        # Captura qualquer erro inesperado durante o processamento
+        return None, None, None, [f"Erro inesperado durante a extração/verificação: {e}"]
+
+def verificar_valor_cobrado_texto(text):
+    """
+    Extrai o 'Valor Cobrado' do texto da primeira página e verifica sua duplicação.
+    Retorna o valor cobrado, sua string original, o líquido total (se duplicado)
+    e uma lista de mensagens de status.
+    """
+    valor_cobrado = None
+    valor_cobrado_str_original = None
+    liquido_total = None # Representa o valor cobrado verificado
+    status_messages = []
+
+    try:
+        # 2 Procurar o rótulo "Valor Cobrado (R$)"
+        match_label_cobrado = re.search(r"Valor Cobrado \(R\$\)", text, re.IGNORECASE)
+
+        if match_label_cobrado:
+            # 3 Definir uma área de busca restrita após o rótulo
+            search_start = match_label_cobrado.end()
+            # Limita a busca aos próximos 150 caracteres após o rótulo (ajustável)
+            search_end = min(search_start + 150, len(text))
+            search_text_area = text[search_start:search_end]
+
+            # 4 Extrair o(s) valor(es) numérico(s) da área de busca
+            potential_values = re.findall(r"([\d.,]+)", search_text_area)
+
+            if potential_values:
+                # 5 Limpar e converter as strings de valores para números reais
+                # 6 Pegar o primeiro valor numérico encontrado
+                for val_str in potential_values:
+                    cleaned_val = clean_currency(val_str)
+                    if cleaned_val is not None:
+                        valor_cobrado_str_original = val_str # Guarda a string original
+                        valor_cobrado = cleaned_val
+                        status_messages.append(f"Encontrado 'Valor Cobrado': '{valor_cobrado_str_original}' -> {centavos_para_reais(valor_cobrado):.2f}")
+                        break # Para no primeiro valor válido encontrado
+
+                if valor_cobrado is None:
+                    status_messages.append("Aviso: Nenhum valor numérico válido encontrado após 'Valor Cobrado (R$)'.")
+            else:
+                status_messages.append("Aviso: Nenhum valor numérico encontrado na área de busca após 'Valor Cobrado (R$)'.")
         else:
-             basedir = os.path.dirname(__file__)
+            status_messages.append("Aviso: Rótulo 'Valor Cobrado (R$)' não encontrado na primeira página.")
+
+        # 7 Verificar a duplicação na primeira página
+        if valor_cobrado is not None and valor_cobrado_str_original is not None:
+            # Busca TODAS as ocorrências da STRING original do valor cobrado no texto COMPLETO da primeira página
+            all_occurrences = list(re.finditer(re.escape(valor_cobrado_str_original), text))
+
+            # Conta as ocorrências
+            if len(all_occurrences) >= 2: # Se o valor aparece 2 vezes ou mais
+                # 9 Salvar o resultado: Se duplicado
+                liquido_total = valor_cobrado # Confirma o valor que será somado
+                status_messages.append(f"Sucesso: Valor '{valor_cobrado_str_original}' encontrado {len(all_occurrences)} vezes na página.")
+            else:
+                status_messages.append("Falha: O valor do 'Valor Cobrado' não foi encontrado duplicado na página.")
+        elif valor_cobrado is None:
+             status_messages.append("Falha: Não é possível verificar duplicação pois 'Valor Cobrado' não foi extraído.")
+
+        return valor_cobrado, valor_cobrado_str_original, liquido_total, status_messages
+
+    except Exception as e:
+        # Captura qualquer erro inesperado durante o processamento
+        status_messages.append(f"Erro inesperado durante a extração/verificação: {e}")
+        return None, None, None, status_messages
+
+
+# --- Leitura Antecipada (Prefetch) ---
+
+class PrefetchPDF:
+    """
+    Lê antecipadamente os próximos PDFs da lista para a memória em uma thread separada,
+    para que a leitura (ex: de um compartilhamento de rede) ocorra enquanto o PDF atual é processado.
+
+    A leitura é limitada pela profundidade (quantidade de PDFs à frente) e por um orçamento de
+    memória em bytes. Arquivos maiores que o orçamento não são lidos antecipadamente
+    (são entregues com bytes None e abertos diretamente do disco).
+
+    Uso: for pdf_path, pdf_bytes in PrefetchPDF(pdf_files, 4, 256 * 1024 * 1024): ...
+    """
+
+    def __init__(self, pdf_paths, profundidade, orcamento_bytes, logger_func=None):
+        self.pdf_paths = list(pdf_paths)
+        self.profundidade = max(1, profundidade)
+        self.orcamento_bytes = max(0, orcamento_bytes)
+        self.logger_func = logger_func
+        self.fila = queue.Queue(maxsize=self.profundidade)
+        self.bytes_em_memoria = 0
+        self.condicao_memoria = threading.Condition()
+        self.cancelado = False
+
+    def _ler_arquivos(self):
+        """Thread produtora: lê os arquivos em ordem, respeitando o orçamento de memória."""
+        for pdf_path in self.pdf_paths:
+            if self.cancelado:
+                return
+            pdf_bytes = None
+            reservado = 0
+            try:
+                tamanho = tamanho_pdf(pdf_path)
+                if tamanho <= self.orcamento_bytes:
+                    if not self._reservar(tamanho):
+                        return
+                    reservado = tamanho
+                    pdf_bytes = ler_pdf_bytes(pdf_path)
+                elif self.logger_func:
+                    self.logger_func(f"{nome_pdf(pdf_path)} excede o orçamento de memória da leitura antecipada. Será lido diretamente do disco.", "INFO")
+            except (OSError, KeyError, zipfile.BadZipFile) as e:
+                # O erro real será reportado ao abrir o arquivo no processamento
+                self._liberar(reservado)
+                reservado = 0
+                pdf_bytes = None
+                if self.logger_func:
+                    self.logger_func(f"Falha na leitura antecipada de {nome_pdf(pdf_path)}: {e}", "WARNING")
+            if not self._colocar((pdf_path, pdf_bytes, reservado)):
+                return
+        self._colocar(None) # Sinaliza o fim da lista
+
+    def _reservar(self, tamanho):
+        """Aguarda até que os buffers já consumidos liberem memória suficiente. Retorna False se cancelado."""
+        with self.condicao_memoria:
+            while not self.cancelado and self.bytes_em_memoria + tamanho > self.orcamento_bytes:
+                self.condicao_memoria.wait()
+            if self.cancelado:
+                return False
+            self.bytes_em_memoria += tamanho
+            return True
+
+    def _liberar(self, tamanho):
+        if not tamanho:
+            return
+        with self.condicao_memoria:
+            self.bytes_em_memoria -= tamanho
+            self.condicao_memoria.notify_all()
+
+    def _colocar(self, item):
+        """Coloca um item na fila, desistindo se a leitura for cancelada. Retorna False se cancelado."""
+        while not self.cancelado:
+            try:
+                self.fila.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def cancelar(self):
+        """Interrompe a leitura antecipada (ex: em caso de erro no consumidor)."""
+        self.cancelado = True
+        with self.condicao_memoria:
+            self.condicao_memoria.notify_all()
+
+    def __iter__(self):
+        leitor = threading.Thread(target=self._ler_arquivos, daemon=True)
+        leitor.start()
+        try:
+            while True:
+                item = self.fila.get()
+                if item is None:
+                    break
+                pdf_path, pdf_bytes, reservado = item
+                yield pdf_path, pdf_bytes
+                # O consumidor pediu o próximo item: o buffer anterior pode ser liberado
+                self._liberar(reservado)
+        finally:
+            self.cancelar()
+
+
+# --- Extração em Estágios (produtor/consumidor) ---
+
+# Sinaliza o fim da fila de um estágio
+_FIM_ESTAGIO = object()
+
+# Espera máxima (em segundos) pelo trabalho em andamento quando a extração é cancelada pelo usuário
+TEMPO_ESPERA_CANCELAMENTO = 0.5
+
+class FilaEstagio(queue.Queue):
+    """Fila limitada entre dois estágios que registra a maior ocupação atingida (para ajustar as profundidades)."""
+
+    def __init__(self, nome, maxsize):
+        super().__init__(maxsize=max(1, maxsize))
+        self.nome = nome
+        self.ocupacao_maxima = 0
+
+    def _put(self, item):
+        super()._put(item)
+        self.ocupacao_maxima = max(self.ocupacao_maxima, self._qsize())
+
+    def descrever(self):
+        return f"{self.nome} {self.ocupacao_maxima}/{self.maxsize}"
+
+def _colocar_na_fila(fila, item, cancelado):
+    """Coloca um item na fila, desistindo se o pipeline for cancelado. Retorna False se cancelado."""
+    while not cancelado.is_set():
+        try:
+            fila.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _consumir_fila(fila, cancelado):
+    """Itera sobre os eventos de uma fila até o fim do estágio anterior (ou o cancelamento), repassando falhas como exceção."""
+    while not cancelado.is_set():
+        try:
+            evento = fila.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if evento is _FIM_ESTAGIO:
+            return
+        if evento[0] == "falha":
+            raise evento[1]
+        yield evento
+
+def _executar_estagio(transformar, entrada, saida, cancelado):
+    """
+    Corpo da thread de um estágio: aplica 'transformar' (que gera zero ou mais eventos) a cada item
+    da entrada e coloca os eventos gerados na fila de saída. Uma exceção é repassada adiante como
+    evento ("falha", exceção) e o fim é sempre sinalizado, para que nenhum estágio fique bloqueado.
+    """
+    try:
+        for item in entrada:
+            if cancelado.is_set():
+                return
+            for evento in transformar(item):
+                if not _colocar_na_fila(saida, evento, cancelado):
+                    return
+    except Exception as e:
+        _colocar_na_fila(saida, ("falha", e), cancelado)
+    finally:
+        _colocar_na_fila(saida, _FIM_ESTAGIO, cancelado)
+
+def _extrair_textos_pdf(pdf_path, pdf_bytes, logger_func, verificar_arquivo_duplicado, ocr_servico, ocr_pendentes, paginas=None,
+                        perfis_extracao=None):
+    """
+    Estágio 'extrair texto': gera um evento ("pagina", pdf, nº da página, texto ou None) por página
+    (apenas as páginas do conjunto 'paginas', numeradas a partir de 0, se informado) e, ao final, ("fim_pdf", pdf, item de erro ou None, páginas não lidas, páginas enviadas ao OCR,
+    verificação do 'Valor Cobrado'). PDFs com conteúdo repetido geram apenas ("duplicado", pdf, item de erro).
+    """
+    pdf_filename = nome_pdf(pdf_path)
+    duplicate_item = verificar_arquivo_duplicado(pdf_path, pdf_bytes)
+    if duplicate_item is not None:
+        yield ("duplicado", pdf_path, duplicate_item)
+        return
+
+    logger_func(f"Processando PDF: {pdf_filename}", "INFO")
+    erro_item = None
+    paginas_lidas = 0
+    paginas_restantes = 0
+    paginas_enviadas_ocr = 0
+    try:
+        if pdf_bytes is None and dividir_caminho_zip(pdf_path):
+            pdf_bytes = ler_pdf_bytes(pdf_path)
+        with pdfplumber.open(io.BytesIO(pdf_bytes) if pdf_bytes is not None else pdf_path) as pdf:
+            if not pdf.pages:
+                error_msg = f"PDF sem páginas: {pdf_filename}"
+                registrar_log(logger_func, "ERROR", "PDF_SEM_PAGINAS", "{mensagem}", mensagem=error_msg, pdf=pdf_filename)
+                erro_item = {"error": error_msg, "Numero da Pagina": pdf_filename}
+
+            leitor = LeitorTextoPdf(pdf_path, pdf_bytes, perfis_extracao or PerfisExtracao(), logger_func)
+            try:
+                for page_num, page in enumerate(pdf.pages):
+                    if paginas is not None and page_num not in paginas:
+                        continue
+                    page_text = leitor.texto(page, page_num)
+                    paginas_lidas += 1
+                    if not page_text or not page_text.strip():
+                        if ocr_servico is not None:
+                            pedido = ocr_servico.submeter(pdf_path, pdf_bytes, page_num)
+                            if pedido is not None:
+                                registrar_log(logger_func, "INFO", "PAGINA_ENVIADA_OCR", "Página {pagina} de {pdf} não contém texto extraível. Enviada para OCR.",
+                                              pdf=pdf_filename, pagina=page_num + 1)
+                                ocr_pendentes.append((pdf_path, page_num, pedido))
+                                paginas_enviadas_ocr += 1
+                            else:
+                                registrar_log(logger_func, "DEBUG", "PAGINA_SEM_TEXTO", "Página {pagina} de {pdf} não contém texto nem imagem para OCR.",
+                                              pdf=pdf_filename, pagina=page_num + 1)
+                        else:
+                            registrar_log(logger_func, "DEBUG", "PAGINA_SEM_TEXTO", "Página {pagina} de {pdf} não contém texto extraível.",
+                                          pdf=pdf_filename, pagina=page_num + 1)
+                        page_text = None
+                    yield ("pagina", pdf_path, page_num, page_text)
+            finally:
+                leitor.fechar()
+    except Exception as e:
+        critical_error_msg = f"Erro crítico ao processar {pdf_filename}: {e}"
+        registrar_log(logger_func, "CRITICAL_ERROR", "ERRO_CRITICO_PDF", "{mensagem}", mensagem=critical_error_msg, pdf=pdf_filename)
+        erro_item = {"error": critical_error_msg, "Numero da Pagina": pdf_filename, "UC": "N/A"}
+        try:
+            with abrir_documento_fitz(pdf_path, pdf_bytes) as pdf_err:
+                paginas_restantes = max(0, (len(paginas) if paginas is not None else len(pdf_err)) - paginas_lidas)
+        except Exception:
+            paginas_restantes = 1
+
+    # Extrai e verifica o 'Valor Cobrado' enquanto o PDF ainda está em memória
+    verificacao = extract_and_verify_valor_cobrado(pdf_path, pdf_bytes)
+    yield ("fim_pdf", pdf_path, erro_item, paginas_restantes, paginas_enviadas_ocr, verificacao)
+
+def _erro_critico_pagina(pdf_path, page_num, erro, logger_func):
+    """Item de erro de uma página cuja análise falhou (as demais páginas do PDF continuam sendo processadas)."""
+    pdf_filename = nome_pdf(pdf_path)
+    critical_error_msg = f"Erro crítico ao processar a página {page_num + 1} de {pdf_filename}: {erro}"
+    registrar_log(logger_func, "CRITICAL_ERROR", "ERRO_CRITICO_PDF", "{mensagem}", mensagem=critical_error_msg,
+                  pdf=pdf_filename, pagina=page_num + 1)
+    return {"error": critical_error_msg, "Numero da Pagina": f"{pdf_filename} (Pág. {page_num + 1})", "UC": "N/A"}
+
+def _analisar_blocos_pagina(evento, logger_func, tempo_limite=None):
+    """Estágio 'analisar blocos': ("pagina", ...) com texto -> ("blocos", pdf, página, [blocos analisados])."""
+    if evento[0] != "pagina" or evento[3] is None:
+        yield evento
+        return
+    _, pdf_path, page_num, page_text = evento
+    pdf_filename = nome_pdf(pdf_path)
+    try:
+        blocos = analisar_blocos_fatura(dividir_blocos_pagina(page_text, page_num, pdf_filename, logger_func),
+                                        pdf_filename, page_num, tempo_limite)
+    except Exception as e:
+        yield ("faturas", pdf_path, page_num, [_erro_critico_pagina(pdf_path, page_num, e, logger_func)])
+        return
+    yield ("blocos", pdf_path, page_num, blocos)
+
+def _resolver_ucs_pagina(evento, df_base, logger_func):
+    """Estágio 'resolver UC': ("blocos", ...) -> ("faturas", pdf, página, [faturas ou erros])."""
+    if evento[0] == "pagina":
+        # Página sem texto extraível (eventualmente enviada ao OCR)
+        yield ("faturas", evento[1], evento[2], [])
+        return
+    if evento[0] != "blocos":
+        yield evento
+        return
+    _, pdf_path, page_num, blocos = evento
+    pdf_filename = nome_pdf(pdf_path)
+    try:
+        results = [resolver_uc_fatura(bloco, df_base, pdf_filename, logger_func, page_num) for bloco in blocos]
+    except Exception as e:
+        results = [_erro_critico_pagina(pdf_path, page_num, e, logger_func)]
+    yield ("faturas", pdf_path, page_num, results)
+
+def executar_estagios_extracao(pdf_files, df_base, configuracoes, logger_func, verificar_arquivo_duplicado,
+                               ocr_servico=None, ocr_pendentes=None, paginas_por_pdf=None, perfis_extracao=None,
+                               documentos=None, cancelamento=None):
+    """
+    Extrai os PDFs em estágios ligados por filas limitadas, cada um em sua própria thread:
+    ler arquivo (PrefetchPDF) -> extrair texto -> analisar blocos -> resolver UC.
+    Enquanto uma página tem seus blocos analisados, as seguintes já estão sendo extraídas e o
+    próximo PDF já está sendo lido. A profundidade de cada fila vem das configurações
+    ('prefetch_profundidade', 'fila_textos', 'fila_blocos' e 'fila_faturas').
+
+    Gera, na ordem dos PDFs, os eventos ("duplicado", ...), ("faturas", pdf, página, resultados)
+    e ("fim_pdf", ...) descritos em _extrair_textos_pdf, para o estágio final (acumular) do chamador.
+    As páginas sem texto são enviadas a 'ocr_servico' e os pedidos acrescentados a 'ocr_pendentes'.
+    'paginas_por_pdf' ({caminho: conjunto de páginas a partir de 0}) restringe a extração a essas páginas.
+    'perfis_extracao' (PerfisExtracao) define o perfil de extração de texto de cada PDF.
+    'documentos', se informado, substitui a leitura antecipada de 'pdf_files': um iterável de
+    (caminho ou nome do PDF, bytes ou None), consumido sob demanda pelo estágio 'extrair texto'.
+    'cancelamento' (threading.Event), se informado, encerra a geração de eventos assim que sinalizado;
+    os estágios param entre uma página e a seguinte.
+    """
+    paginas_por_pdf = paginas_por_pdf or {}
+    tempo_limite_bloco = configuracoes["tempo_limite_bloco_ms"] / 1000 or None
+    cancelado = threading.Event()
+    fila_textos = FilaEstagio("textos", configuracoes["fila_textos"])
+    fila_blocos = FilaEstagio("blocos", configuracoes["fila_blocos"])
+    fila_faturas = FilaEstagio("faturas", configuracoes["fila_faturas"])
+    prefetch = None
+    if documentos is None:
+        documentos = prefetch = PrefetchPDF(pdf_files,
+                                            configuracoes["prefetch_profundidade"],
+                                            configuracoes["prefetch_memoria_mb"] * 1024 * 1024,
+                                            logger_func)
+
+    estagios = [
+        threading.Thread(target=_executar_estagio, daemon=True, name="estagio-extrair-texto",
+                         args=(lambda item: _extrair_textos_pdf(item[0], item[1], logger_func, verificar_arquivo_duplicado,
+                                                                ocr_servico, ocr_pendentes, paginas_por_pdf.get(item[0]),
+                                                                perfis_extracao),
+                               documentos, fila_textos, cancelado)),
+        threading.Thread(target=_executar_estagio, daemon=True, name="estagio-analisar-blocos",
+                         args=(lambda evento: _analisar_blocos_pagina(evento, logger_func, tempo_limite_bloco),
+                               _consumir_fila(fila_textos, cancelado), fila_blocos, cancelado)),
+        threading.Thread(target=_executar_estagio, daemon=True, name="estagio-resolver-uc",
+                         args=(lambda evento: _resolver_ucs_pagina(evento, df_base, logger_func),
+                               _consumir_fila(fila_blocos, cancelado), fila_faturas, cancelado)),
+    ]
+    for estagio in estagios:
+        estagio.start()
+    try:
+        yield from _consumir_fila(fila_faturas, cancelamento or cancelado)
+    finally:
+        # Em caso de erro (ou abandono) no consumidor, interrompe os estágios anteriores
+        cancelado.set()
+        if prefetch is not None:
+            prefetch.cancelar()
+        # No cancelamento, a página em andamento não é aguardada (os estágios são threads daemon):
+        # um único prazo vale para os três estágios juntos
+        espera = TEMPO_ESPERA_CANCELAMENTO if cancelamento is not None and cancelamento.is_set() else 5
+        prazo = time.monotonic() + espera
+        for estagio in estagios:
+            estagio.join(timeout=max(0, prazo - time.monotonic()))
+    # Uma fila que chega cheia indica que o estágio seguinte é o gargalo
+    registrar_log(logger_func, "INFO", "OCUPACAO_FILAS", "Ocupação máxima das filas de extração: {filas}.",
+                  filas=", ".join(fila.descrever() for fila in (fila_textos, fila_blocos, fila_faturas)))
+
+# --- Processos Auxiliares ---
+
+def contexto_processos():
+    """
+    Retorna o contexto de multiprocessing usado pelos pools de processos.
+    Usa sempre 'spawn' (padrão do Windows): criar processos com 'fork' a partir de um
+    programa com várias threads (Tk, leitura antecipada) pode travar o processo filho.
+    """
+    return multiprocessing.get_context("spawn")
+
+
+# --- Processos de Extração Isolados (limites de tempo e memória por PDF) ---
+
+class LimiteExtracaoExcedido(Exception):
+    """Levantada quando um PDF excede o tempo ou a memória limite e o seu processo de extração é encerrado."""
+
+if sys.platform == "win32":
+    import ctypes
+    from ctypes import wintypes
+
+    class _ContadoresMemoriaProcesso(ctypes.Structure):
+        """Estrutura PROCESS_MEMORY_COUNTERS da API do Windows (GetProcessMemoryInfo)."""
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+def memoria_processo(pid):
+    """
+    Memória residente (bytes) de um processo, lida do sistema operacional (Linux: /proc; Windows: GetProcessMemoryInfo).
+    Retorna None se não for possível medi-la.
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            with open(f"/proc/{pid}/statm", 'r') as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return None
+    if sys.platform == "win32":
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid) # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return None
+        try:
+            contadores = _ContadoresMemoriaProcesso()
+            contadores.cb = ctypes.sizeof(contadores)
+            if not ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(contadores), contadores.cb):
+                return None
+            return contadores.WorkingSetSize
+        finally:
+            ctypes.windll.kernel32.CloseHandle(handle)
+    return None
+
+def _laco_processo_isolado(conexao, inicializador, argumentos_inicializador):
+    """Laço de um processo isolado: executa, uma de cada vez, as tarefas recebidas pela conexão e devolve o resultado."""
+    if inicializador is not None:
+        inicializador(*argumentos_inicializador)
+    while True:
+        try:
+            tarefa = conexao.recv()
+        except EOFError:
+            return
+        if tarefa is None:
+            return
+        funcao, args, kwargs = tarefa
+        try:
+            resposta = (True, funcao(*args, **kwargs))
+        except Exception as e:
+            resposta = (False, e)
+        try:
+            conexao.send(resposta)
+        except Exception as e: # Resultado ou exceção que não pode ser serializado
+            conexao.send((False, RuntimeError(f"Resultado não pôde ser devolvido ao processo principal: {e}")))
+
+class PoolExtracaoIsolada(concurrent.futures.Executor):
+    """
+    Pool de processos em que cada tarefa (um PDF) é vigiada pelo processo principal. Se a tarefa exceder
+    'tempo_limite' (segundos) ou o processo ultrapassar 'memoria_limite' (bytes), apenas esse processo é
+    encerrado: o Future recebe LimiteExtracaoExcedido e um novo processo assume as próximas tarefas, sem
+    interromper as demais em execução. Um processo que termina inesperadamente (ex: falha em uma biblioteca
+    nativa) também é substituído. Tem a mesma interface do ProcessPoolExecutor (submit/shutdown).
+    """
+
+    INTERVALO_VIGIA = 0.2 # Segundos entre as verificações dos limites
+
+    def __init__(self, max_workers, tempo_limite=None, memoria_limite=None, initializer=None, initargs=()):
+        self.processos = max(1, max_workers)
+        self.tempo_limite = tempo_limite
+        self.memoria_limite = memoria_limite
+        self.initializer = initializer
+        self.initargs = initargs
+        self.contexto = contexto_processos()
+        self.pendentes = [] # (Future, função, args, kwargs), na ordem de envio
+        self.trabalhadores = [] # {"processo", "conexao", "tarefa": (Future, início) ou None}
+        self.lock = threading.Lock()
+        self.encerrando = False
+        self.vigia = None
+        # Acorda a thread vigia quando chega uma tarefa (ou o encerramento) enquanto ela aguarda os processos
+        self.sinal_leitura, self.sinal_escrita = self.contexto.Pipe(duplex=False)
+        self.sinalizado = False
+
+    def submit(self, fn, /, *args, **kwargs):
+        pedido = concurrent.futures.Future()
+        with self.lock:
+            if self.encerrando:
+                raise RuntimeError("O pool de extração já foi encerrado.")
+            self.pendentes.append((pedido, fn, args, kwargs))
+            if self.vigia is None:
+                self.vigia = threading.Thread(target=self._vigiar, daemon=True)
+                self.vigia.start()
+            self._sinalizar()
+        return pedido
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self.lock:
+            self.encerrando = True
+            if cancel_futures:
+                for pedido, _, _, _ in self.pendentes:
+                    pedido.cancel()
+                self.pendentes.clear()
+            vigia = self.vigia
+            if vigia is not None:
+                self._sinalizar()
+        if vigia is None:
+            self.sinal_leitura.close()
+            self.sinal_escrita.close()
+        elif wait:
+            vigia.join()
+
+    def _sinalizar(self):
+        """Acorda a thread vigia (chamada com o lock adquirido)."""
+        if not self.sinalizado:
+            self.sinalizado = True
+            self.sinal_escrita.send_bytes(b"1")
+
+    def _iniciar_trabalhador(self):
+        conexao, conexao_processo = self.contexto.Pipe()
+        processo = self.contexto.Process(target=_laco_processo_isolado, args=(conexao_processo, self.initializer, self.initargs),
+                                         daemon=True)
+        processo.start()
+        conexao_processo.close()
+        trabalhador = {"processo": processo, "conexao": conexao, "tarefa": None}
+        self.trabalhadores.append(trabalhador)
+        return trabalhador
+
+    def _despachar(self):
+        """Envia as tarefas pendentes aos processos livres (iniciando processos até o limite)."""
+        while True:
+            with self.lock:
+                if not self.pendentes:
+                    return
+                trabalhador = next((t for t in self.trabalhadores if t["tarefa"] is None), None)
+                if trabalhador is None and len(self.trabalhadores) >= self.processos:
+                    return
+                pedido, fn, args, kwargs = self.pendentes.pop(0)
+            if not pedido.set_running_or_notify_cancel():
+                continue
+            if trabalhador is None:
+                trabalhador = self._iniciar_trabalhador()
+            try:
+                trabalhador["conexao"].send((fn, args, kwargs))
+            except Exception as e:
+                pedido.set_exception(e)
+                continue
+            trabalhador["tarefa"] = (pedido, time.monotonic())
+
+    def _substituir(self, trabalhador, erro):
+        """Encerra o processo de um trabalhador (com a tarefa em andamento) e o descarta; outro é iniciado quando necessário."""
+        trabalhador["processo"].kill()
+        trabalhador["processo"].join()
+        trabalhador["conexao"].close()
+        self.trabalhadores.remove(trabalhador)
+        pedido, _ = trabalhador["tarefa"]
+        pedido.set_exception(erro)
+
+    def _receber(self, trabalhador):
+        pedido, _ = trabalhador["tarefa"]
+        try:
+            sucesso, valor = trabalhador["conexao"].recv()
+        except (EOFError, OSError):
+            codigo = trabalhador["processo"].exitcode
+            self._substituir(trabalhador, RuntimeError(f"O processo de extração terminou inesperadamente (código {codigo})."))
+            return
+        trabalhador["tarefa"] = None
+        if sucesso:
+            pedido.set_result(valor)
+        else:
+            pedido.set_exception(valor)
+
+    def _verificar_limites(self, trabalhador):
+        _, inicio = trabalhador["tarefa"]
+        if self.tempo_limite and time.monotonic() - inicio > self.tempo_limite:
+            self._substituir(trabalhador, LimiteExtracaoExcedido(f"tempo limite de {self.tempo_limite:g} s excedido"))
+            return
+        if self.memoria_limite:
+            memoria = memoria_processo(trabalhador["processo"].pid)
+            if memoria is not None and memoria > self.memoria_limite:
+                self._substituir(trabalhador, LimiteExtracaoExcedido(
+                    f"memória limite de {self.memoria_limite / (1024 * 1024):.0f} MB excedida ({memoria / (1024 * 1024):.0f} MB em uso)"))
+
+    def _vigiar(self):
+        """Thread vigia: despacha as tarefas, recebe os resultados e encerra os processos que excedem os limites."""
+        while True:
+            self._despachar()
+            ocupados = [t for t in self.trabalhadores if t["tarefa"] is not None]
+            with self.lock:
+                if self.encerrando and not self.pendentes and not ocupados:
+                    break
+            prontos = multiprocessing.connection.wait(
+                [self.sinal_leitura] + [t["conexao"] for t in ocupados] + [t["processo"].sentinel for t in ocupados],
+                timeout=self.INTERVALO_VIGIA if ocupados else None)
+            if self.sinal_leitura in prontos:
+                with self.lock:
+                    while self.sinal_leitura.poll():
+                        self.sinal_leitura.recv_bytes()
+                    self.sinalizado = False
+            for trabalhador in ocupados:
+                if trabalhador["conexao"] in prontos or trabalhador["processo"].sentinel in prontos:
+                    self._receber(trabalhador)
+                else:
+                    self._verificar_limites(trabalhador)
+
+        for trabalhador in self.trabalhadores:
+            try:
+                trabalhador["conexao"].send(None)
+            except OSError:
+                pass
+        for trabalhador in self.trabalhadores:
+            trabalhador["processo"].join(timeout=5)
+            if trabalhador["processo"].is_alive():
+                trabalhador["processo"].kill()
+                trabalhador["processo"].join()
+            trabalhador["conexao"].close()
+        self.trabalhadores.clear()
+        self.sinal_leitura.close()
+        self.sinal_escrita.close()
+
+
+# --- Verificação Preliminar dos PDFs ---
+
+def verificar_pdf_preliminar(pdf_path):
+    """
+    Verificação rápida de um PDF antes da extração: tamanho, número de páginas e problemas
+    que impediriam a extração (arquivo que não é PDF, corrompido, protegido por senha, sem páginas
+    ou sem nenhuma 'UC:' no texto, ou seja, provavelmente não é uma fatura Celesc).
+    Executada em paralelo. Retorna (páginas, tamanho em bytes, problema ou None).
+    """
+    pdf_bytes = None
+    try:
+        if dividir_caminho_zip(pdf_path):
+            pdf_bytes = ler_pdf_bytes(pdf_path)
+            tamanho = len(pdf_bytes)
+            cabecalho = pdf_bytes[:1024]
+        else:
+            tamanho = os.path.getsize(pdf_path)
+            with open(pdf_path, 'rb') as f:
+                cabecalho = f.read(1024)
+    except (OSError, KeyError, zipfile.BadZipFile) as e:
+        return 0, 0, f"Não foi possível ler o arquivo: {e}"
+    if b"%PDF-" not in cabecalho:
+        return 0, tamanho, "O arquivo não é um PDF (cabeçalho '%PDF-' ausente)."
+
+    try:
+        with abrir_documento_fitz(pdf_path, pdf_bytes) as doc:
+            if doc.needs_pass:
+                return 0, tamanho, "PDF protegido por senha."
+            paginas = len(doc)
+            if paginas == 0:
+                return 0, tamanho, "PDF sem páginas."
+            # Procura a âncora 'UC:' página a página, parando na primeira ocorrência
+            tem_texto = False
+            for page in doc:
+                texto = page.get_text("text")
+                if UC_ANCORA_REGEX.search(texto):
+                    return paginas, tamanho, None
+                tem_texto = tem_texto or bool(texto.strip())
+    except Exception as e:
+        return 0, tamanho, f"PDF corrompido ou ilegível: {e}"
+
+    # Sem texto algum pode ser uma fatura digitalizada (tratada pelo OCR); com texto e sem 'UC:', não é uma fatura Celesc
+    if tem_texto:
+        return paginas, tamanho, "Nenhuma 'UC:' encontrada no PDF; provavelmente não é uma fatura Celesc."
+    return paginas, tamanho, None
+
+
+# --- Totais Rápidos (conferência prévia do lote) ---
+
+def totalizar_pdf_rapido(pdf_path):
+    """
+    Leitura rápida de um PDF para a conferência prévia do lote (sem extrair as faturas): páginas,
+    quantidade de UCs (blocos 'UC:'), hash do conteúdo e 'Valor Cobrado' da primeira página, verificado
+    pela sua duplicação na página (ver verificar_valor_cobrado_texto). Executada em paralelo.
+    Retorna (páginas, UCs, hash do conteúdo, verificação do 'Valor Cobrado', problema ou None).
+    """
+    try:
+        pdf_bytes = ler_pdf_bytes(pdf_path)
+    except (OSError, KeyError, zipfile.BadZipFile) as e:
+        return 0, 0, None, None, f"Não foi possível ler o arquivo: {e}"
+    if b"%PDF-" not in pdf_bytes[:1024]:
+        return 0, 0, None, None, "O arquivo não é um PDF (cabeçalho '%PDF-' ausente)."
+    conteudo_hash = hashlib.sha256(pdf_bytes).hexdigest()
+
+    try:
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            if doc.needs_pass:
+                return 0, 0, conteudo_hash, None, "PDF protegido por senha."
+            if len(doc) == 0:
+                return 0, 0, conteudo_hash, None, "PDF sem páginas."
+            ucs = 0
+            texto_primeira_pagina = ""
+            for page in doc:
+                texto = page.get_text("text")
+                if page.number == 0:
+                    texto_primeira_pagina = texto
+                ucs += len(UC_ANCORA_REGEX.findall(texto))
+            paginas = len(doc)
+    except Exception as e:
+        return 0, 0, conteudo_hash, None, f"PDF corrompido ou ilegível: {e}"
+    return paginas, ucs, conteudo_hash, verificar_valor_cobrado_texto(texto_primeira_pagina), None
+
+def calcular_totais_rapidos(entradas, processos, logger_func, executor=None):
+    """
+    Conferência prévia do lote em segundos: lê apenas o 'Valor Cobrado' da primeira página de cada PDF
+    (em paralelo) e conta páginas e UCs, sem extrair as faturas nem gerar o relatório.
+    Arquivos .zip são substituídos pelos PDFs que contêm; PDFs com o mesmo conteúdo são somados uma vez.
+    'executor' permite reaproveitar um pool já iniciado (não é encerrado aqui).
+    Retorna (lista por arquivo, totais do lote). O total verificado corresponde ao 'TOTAL conta' do relatório.
+    """
+    pdf_files, erros_zip = expandir_arquivos_zip(entradas, logger_func)
+    arquivos = [{"pdf": erro["Numero da Pagina"], "paginas": 0, "ucs": 0, "valor_cobrado": None,
+                 "verificado": False, "duplicado_de": None, "observacao": erro["Observação"]} for erro in erros_zip]
+
+    encerrar_executor = executor is None
+    if executor is None and processos > 1 and len(pdf_files) > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=min(processos, len(pdf_files)), mp_context=contexto_processos())
+    elif executor is None:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(4, len(pdf_files))))
+    try:
+        leituras = [executor.submit(totalizar_pdf_rapido, pdf_path) for pdf_path in pdf_files]
+        arquivos_por_hash = {}
+        for pdf_path, leitura in zip(pdf_files, leituras):
+            pdf_name = nome_pdf(pdf_path)
+            try:
+                paginas, ucs, conteudo_hash, verificacao, problema = leitura.result()
+            except Exception as e:
+                paginas, ucs, conteudo_hash, verificacao, problema = 0, 0, None, None, f"Falha na leitura do PDF: {e}"
+            arquivo = {"pdf": pdf_name, "paginas": paginas, "ucs": ucs, "valor_cobrado": None, "verificado": False,
+                       "duplicado_de": None, "observacao": ""}
+            arquivos.append(arquivo)
+            if problema:
+                arquivo["observacao"] = problema
+                logger_func(f"{pdf_name}: {problema}", "ERROR", "PDF_INVALIDO", pdf=pdf_name)
+                continue
+            if conteudo_hash in arquivos_por_hash:
+                arquivo["duplicado_de"] = arquivos_por_hash[conteudo_hash]
+                arquivo["observacao"] = f"Mesmo conteúdo de {arquivo['duplicado_de']}; não somado."
+                logger_func(f"{pdf_name}: {arquivo['observacao']}", "WARNING", "ARQUIVO_DUPLICADO", pdf=pdf_name)
+                continue
+            arquivos_por_hash[conteudo_hash] = pdf_name
+
+            valor_cobrado, _, liquido_total_verified, status_msgs = verificacao
+            arquivo.update({"valor_cobrado": valor_cobrado, "verificado": liquido_total_verified is not None})
+            if liquido_total_verified is None:
+                arquivo["observacao"] = status_msgs[-1] if status_msgs else "Valor Cobrado não verificado."
+            situacao = "verificado" if arquivo["verificado"] else f"NÃO verificado ({arquivo['observacao']})"
+            valor = f"R$ {centavos_para_reais(valor_cobrado):,.2f}" if valor_cobrado is not None else "não encontrado"
+            logger_func(f"{pdf_name}: {paginas} página(s), {ucs} UC(s), Valor Cobrado {valor} {situacao}.",
+                        "INFO" if arquivo["verificado"] else "WARNING", "TOTAL_RAPIDO_PDF", pdf=pdf_name)
+    finally:
+        if encerrar_executor:
+            executor.shutdown(wait=True)
+
+    somados = [arquivo for arquivo in arquivos if arquivo["verificado"]]
+    totais = {
+        "arquivos": len(arquivos),
+        "paginas": sum(arquivo["paginas"] for arquivo in arquivos),
+        "ucs": sum(arquivo["ucs"] for arquivo in arquivos if arquivo["duplicado_de"] is None),
+        "total_verificado": sum(arquivo["valor_cobrado"] for arquivo in somados),
+        "arquivos_verificados": len(somados),
+        "arquivos_nao_verificados": len(arquivos) - len(somados)
+    }
+    logger_func(f"Totais rápidos: {totais['arquivos']} arquivo(s), {totais['paginas']} página(s), {totais['ucs']} UC(s). "
+                f"Valor Cobrado verificado: R$ {centavos_para_reais(totais['total_verificado']):,.2f} "
+                f"({totais['arquivos_verificados']} arquivo(s); {totais['arquivos_nao_verificados']} não somado(s)).",
+                "SUCCESSO" if not totais["arquivos_nao_verificados"] else "WARNING", "TOTAIS_RAPIDOS")
+    return arquivos, totais
+
+
+# --- Lotes Colunares de Faturas (transferência dos processos de extração) ---
+
+class LoteFaturas:
+    """
+    Resultados de um PDF em formato colunar, com esquema fixo, enviados pelos processos de extração
+    ao processo principal. Os valores em centavos ficam em um único array de inteiros (uma linha por fatura)
+    e as colunas de texto são codificadas por dicionário (valores distintos + códigos int32), de modo
+    que serializar, concatenar e montar o DataFrame do relatório não cria um dicionário por fatura.
+    Os itens de erro (poucos) são mantidos como dicionários, com a sua posição nos resultados.
+    """
+
+    # Chaves de uma fatura extraída, na ordem de extract_fatura_values_from_block
+    COLUNAS = ("UC", "Centro de Custo", "Subseção", "ENERGIA (R$)", "COSIP (R$)", "Valor Bruto (R$)", "RETENÇÃO (R$)",
+               "LÍQUIDO (R$)", "Numero da Pagina", "Referência",
+               "Energia (1,2%)", "Retenção(1,2%)", "Energia (4,8%)", "Retenção(4,8%)")
+    COLUNAS_TEXTO = ("UC", "Centro de Custo", "Subseção", "Numero da Pagina", "Referência")
+    COLUNAS_CENTAVOS = ("ENERGIA (R$)", "COSIP (R$)", "Valor Bruto (R$)", "RETENÇÃO (R$)", "LÍQUIDO (R$)",
+                        "Energia (1,2%)", "Retenção(1,2%)", "Energia (4,8%)", "Retenção(4,8%)")
+
+    def __init__(self, centavos, codigos, valores, erros=()):
+        self.centavos = centavos # int32 (ou int64, se necessário), (faturas, len(COLUNAS_CENTAVOS))
+        self.codigos = codigos # int32, (faturas, len(COLUNAS_TEXTO))
+        self.valores = valores # Valores distintos de cada coluna de texto
+        self.erros = list(erros) # (posição nos resultados, item de erro)
+
+    @classmethod
+    def de_resultados(cls, results):
+        """
+        Converte os resultados de um PDF (faturas e itens de erro, ver process_pdf_file) em um lote.
+        Retorna None se alguma fatura não seguir o esquema (os resultados são então enviados como estão).
+        """
+        faturas, erros = [], []
+        for posicao, item in enumerate(results):
+            if not isinstance(item, dict):
+                return None
+            if "error" in item:
+                erros.append((posicao, item))
+            elif tuple(item) != cls.COLUNAS:
+                return None
+            else:
+                faturas.append(item)
+        try:
+            centavos = np.array(list(map(itemgetter(*cls.COLUNAS_CENTAVOS), faturas)))
+        except OverflowError:
+            return None
+        if not faturas:
+            centavos = np.empty((0, len(cls.COLUNAS_CENTAVOS)), dtype=np.int32)
+        elif centavos.dtype.kind != "i":
+            return None # Valores que não são centavos inteiros (ou grandes demais para int64)
+        elif np.abs(centavos).max() < 2 ** 31:
+            centavos = centavos.astype(np.int32) # Metade do tamanho na transferência; somas são feitas em int64
+        valores, codigos = [], []
+        for coluna in cls.COLUNAS_TEXTO:
+            indices = {}
+            codigos.append([indices.setdefault(fatura_data[coluna], len(indices)) for fatura_data in faturas])
+            valores.append(list(indices))
+        codigos = np.ascontiguousarray(np.array(codigos, dtype=np.int32).reshape(len(cls.COLUNAS_TEXTO), len(faturas)).T)
+        return cls(centavos, codigos, valores, erros)
+
+    @classmethod
+    def concatenar(cls, lotes):
+        """Junta vários lotes (sem os itens de erro) em um só, recodificando os dicionários das colunas de texto."""
+        indices = [{} for _ in cls.COLUNAS_TEXTO]
+        partes_codigos = []
+        for lote in lotes:
+            codigos = np.empty_like(lote.codigos)
+            for j in range(len(cls.COLUNAS_TEXTO)):
+                mapa = np.array([indices[j].setdefault(valor, len(indices[j])) for valor in lote.valores[j]], dtype=np.int32)
+                codigos[:, j] = mapa[lote.codigos[:, j]]
+            partes_codigos.append(codigos)
+        valores = [list(indices_coluna) for indices_coluna in indices]
+        centavos = np.concatenate([lote.centavos for lote in lotes]) if lotes else np.empty((0, len(cls.COLUNAS_CENTAVOS)), dtype=np.int64)
+        codigos = np.concatenate(partes_codigos) if lotes else np.empty((0, len(cls.COLUNAS_TEXTO)), dtype=np.int32)
+        return cls(centavos, codigos, valores)
+
+    def __len__(self):
+        return len(self.centavos)
+
+    def selecionar(self, linhas):
+        """Lote apenas com as faturas 'linhas' (índices), sem os itens de erro."""
+        return LoteFaturas(self.centavos[linhas], self.codigos[linhas], self.valores)
+
+    def coluna(self, coluna):
+        """Valores de uma coluna (array de objetos para as colunas de texto, int64 para as de centavos)."""
+        if coluna in self.COLUNAS_TEXTO:
+            j = self.COLUNAS_TEXTO.index(coluna)
+            valores = np.empty(len(self.valores[j]), dtype=object)
+            valores[:] = self.valores[j]
+            return valores[self.codigos[:, j]]
+        return self.centavos[:, self.COLUNAS_CENTAVOS.index(coluna)].astype(np.int64)
+
+    def fatura(self, i):
+        """Materializa a fatura 'i' como dicionário (mesmas chaves e tipos da extração)."""
+        textos = {coluna: self.valores[j][codigo] for j, (coluna, codigo) in enumerate(zip(self.COLUNAS_TEXTO, self.codigos[i].tolist()))}
+        centavos = dict(zip(self.COLUNAS_CENTAVOS, self.centavos[i].tolist()))
+        return {coluna: textos[coluna] if coluna in textos else centavos[coluna] for coluna in self.COLUNAS}
+
+    def percorrer(self):
+        """Percorre os resultados na ordem original: ("erro", item) ou ("fatura", índice da fatura no lote)."""
+        erros = iter(self.erros)
+        proximo_erro = next(erros, None)
+        i = 0
+        for posicao in range(len(self) + len(self.erros)):
+            if proximo_erro is not None and proximo_erro[0] == posicao:
+                yield "erro", proximo_erro[1]
+                proximo_erro = next(erros, None)
+            else:
+                yield "fatura", i
+                i += 1
+
+    def itens(self):
+        """Resultados na ordem original, como dicionários (ver process_pdf_file)."""
+        return [valor if tipo == "erro" else self.fatura(valor) for tipo, valor in self.percorrer()]
+
+    def chaves_identidade(self):
+        """Chaves de identidade das faturas (ver IndiceDuplicatas.chave_fatura), calculadas por coluna."""
+        ucs = [str(uc) for uc in self.valores[self.COLUNAS_TEXTO.index("UC")]]
+        colunas = [[ucs[codigo] for codigo in self.codigos[:, self.COLUNAS_TEXTO.index("UC")].tolist()]]
+        for campo in IndiceDuplicatas.CAMPOS_IDENTIDADE_FATURA:
+            if campo in self.COLUNAS_TEXTO:
+                valores = self.valores[self.COLUNAS_TEXTO.index(campo)]
+                colunas.append([valores[codigo] for codigo in self.codigos[:, self.COLUNAS_TEXTO.index(campo)].tolist()])
+            else:
+                colunas.append(self.centavos[:, self.COLUNAS_CENTAVOS.index(campo)].tolist())
+        return zip(*colunas)
+
+    def dataframe(self):
+        """DataFrame das faturas (colunas em COLUNAS), montado coluna a coluna."""
+        df = pd.DataFrame({coluna: self.coluna(coluna) for coluna in self.COLUNAS}, columns=list(self.COLUNAS))
+        return df.infer_objects()
+
+    def gravar_json(self, f):
+        """Grava o lote (sem os itens de erro) como um objeto JSON, coluna a coluna (ver de_json)."""
+        f.write('{"centavos": {')
+        for j, coluna in enumerate(self.COLUNAS_CENTAVOS):
+            f.write(f'{", " if j else ""}{json.dumps(coluna, ensure_ascii=False)}: {json.dumps(self.centavos[:, j].tolist())}')
+        f.write('}, "textos": {')
+        for j, coluna in enumerate(self.COLUNAS_TEXTO):
+            f.write(f'{", " if j else ""}{json.dumps(coluna, ensure_ascii=False)}: {{"valores": ')
+            f.write(json.dumps(self.valores[j], ensure_ascii=False, default=str))
+            f.write(f', "codigos": {json.dumps(self.codigos[:, j].tolist())}}}')
+        f.write('}}')
+
+    @classmethod
+    def de_json(cls, dados):
+        """Reconstrói um lote gravado por gravar_json."""
+        centavos = np.array([dados["centavos"][coluna] for coluna in cls.COLUNAS_CENTAVOS], dtype=np.int64)
+        codigos = np.array([dados["textos"][coluna]["codigos"] for coluna in cls.COLUNAS_TEXTO], dtype=np.int32)
+        valores = [dados["textos"][coluna]["valores"] for coluna in cls.COLUNAS_TEXTO]
+        return cls(np.ascontiguousarray(centavos.reshape(len(cls.COLUNAS_CENTAVOS), -1).T),
+                   np.ascontiguousarray(codigos.reshape(len(cls.COLUNAS_TEXTO), -1).T), valores)
+
+class TabelaFaturas:
+    """
+    Faturas aceitas de uma extração, na ordem: lotes colunares (LoteFaturas) recebidos dos processos de
+    extração e faturas avulsas (dicionários, ex: do OCR). Iterar materializa as faturas uma a uma, para as
+    etapas que tratam fatura a fatura; dataframe() concatena os lotes coluna a coluna.
+    """
+
+    def __init__(self):
+        self.segmentos = [] # LoteFaturas ou listas de faturas avulsas
+
+    def append(self, fatura_data):
+        if not self.segmentos or isinstance(self.segmentos[-1], LoteFaturas):
+            self.segmentos.append([])
+        self.segmentos[-1].append(fatura_data)
+
+    def adicionar_lote(self, lote):
+        if len(lote):
+            self.segmentos.append(lote)
+
+    def __len__(self):
+        return sum(len(segmento) for segmento in self.segmentos)
+
+    def __iter__(self):
+        for segmento in self.segmentos:
+            if isinstance(segmento, LoteFaturas):
+                for i in range(len(segmento)):
+                    yield segmento.fatura(i)
+            else:
+                yield from segmento
+
+    @classmethod
+    def de_faturas(cls, faturas):
+        """Nova tabela com as faturas de uma TabelaFaturas (sem copiar os lotes) ou de uma lista de faturas."""
+        tabela = cls()
+        if isinstance(faturas, TabelaFaturas):
+            tabela.segmentos = [segmento if isinstance(segmento, LoteFaturas) else list(segmento) for segmento in faturas.segmentos]
+        else:
+            for fatura_data in faturas:
+                tabela.append(fatura_data)
+        return tabela
+
+    def segmentos_concatenados(self):
+        """Percorre os segmentos, com os lotes consecutivos concatenados em um só (LoteFaturas.concatenar)."""
+        lotes = []
+        for segmento in self.segmentos:
+            if isinstance(segmento, LoteFaturas):
+                lotes.append(segmento)
+                continue
+            if lotes:
+                yield LoteFaturas.concatenar(lotes)
+                lotes = []
+            yield segmento
+        if lotes:
+            yield LoteFaturas.concatenar(lotes)
+
+    def dataframe(self):
+        """DataFrame de todas as faturas. Lotes consecutivos são concatenados sem criar um dicionário por fatura."""
+        partes = [segmento.dataframe() if isinstance(segmento, LoteFaturas) else pd.DataFrame(segmento)
+                  for segmento in self.segmentos_concatenados()]
+        if not partes:
+            return pd.DataFrame()
+        return partes[0] if len(partes) == 1 else pd.concat(partes, ignore_index=True)
+
+    def gravar_json(self, f):
+        """
+        Grava a tabela como uma lista JSON de segmentos (ver de_json): {"lote": ...} para os lotes,
+        gravados coluna a coluna, e {"faturas": [...]} para as faturas avulsas.
+        """
+        f.write('[')
+        for n, segmento in enumerate(self.segmentos_concatenados()):
+            f.write(', ' if n else '')
+            if isinstance(segmento, LoteFaturas):
+                f.write('{"lote": ')
+                segmento.gravar_json(f)
+                f.write('}')
+            else:
+                json.dump({"faturas": segmento}, f, ensure_ascii=False, default=str)
+        f.write(']')
+
+    @classmethod
+    def de_json(cls, segmentos):
+        """Reconstrói uma tabela gravada por gravar_json."""
+        tabela = cls()
+        for segmento in segmentos:
+            if "lote" in segmento:
+                tabela.adicionar_lote(LoteFaturas.de_json(segmento["lote"]))
+            else:
+                for fatura_data in segmento["faturas"]:
+                    tabela.append(fatura_data)
+        return tabela
+
+
+# --- Extração em Paralelo ---
+
+# Estimativa da memória ocupada pela extração de um PDF, em múltiplos do tamanho do arquivo
+FATOR_MEMORIA_EXTRACAO = 10
+
+def planejar_ordem_execucao(pdf_files, pdf_page_counts, pdf_sizes):
+    """
+    Define a ordem de despacho dos PDFs para a extração em paralelo: os de maior custo
+    (mais páginas e, em seguida, mais bytes) primeiro, para que um arquivo grande no fim
+    da lista não atrase o término do lote. Empates mantêm a ordem de seleção.
+    Retorna a lista de índices de 'pdf_files' na ordem de despacho.
+    """
+    return sorted(
+        range(len(pdf_files)),
+        key=lambda i: (-pdf_page_counts.get(pdf_files[i], 1), -pdf_sizes.get(pdf_files[i], 0), i)
+    )
+
+class ColetorPaginasSemTexto:
+    """
+    Substitui o ServicoOCR dentro dos processos de extração: apenas registra as páginas
+    sem texto, que são enviadas para o OCR pelo processo principal.
+    """
+
+    def submeter(self, pdf_path, pdf_bytes, page_num):
+        return page_num
+
+# Planilha base do processo de extração (definida uma vez por processo, no inicializador)
+_df_base_worker = None
+
+def _inicializar_worker_extracao(df_base):
+    global _df_base_worker
+    _df_base_worker = df_base
+
+def extracao_isolada(configuracoes):
+    """Indica se os PDFs devem ser extraídos em processos isolados, com limite de tempo ou de memória por PDF."""
+    return configuracoes["tempo_limite_pdf_s"] > 0 or configuracoes["memoria_limite_pdf_mb"] > 0
+
+def criar_executor_extracao(configuracoes, df_base):
+    """
+    Cria o pool de processos de extração, com a planilha base em cada processo. Com limites por PDF
+    configurados (ver extracao_isolada), cada PDF é vigiado e o seu processo é encerrado se exceder o limite.
+    """
+    processos = max(1, configuracoes["processos_extracao"])
+    if extracao_isolada(configuracoes):
+        return PoolExtracaoIsolada(processos, configuracoes["tempo_limite_pdf_s"] or None,
+                                   configuracoes["memoria_limite_pdf_mb"] * 1024 * 1024 or None,
+                                   initializer=_inicializar_worker_extracao, initargs=(df_base,))
+    return concurrent.futures.ProcessPoolExecutor(max_workers=processos, mp_context=contexto_processos(),
+                                                  initializer=_inicializar_worker_extracao, initargs=(df_base,))
+
+def _extrair_pdf_worker(pdf_path, pdf_bytes, coletar_paginas_sem_texto, nivel_log="INFO", tempo_limite_bloco=None,
+                        perfis_conhecidos=None):
+    """
+    Executada em um processo de extração: processa um PDF e verifica seu 'Valor Cobrado'.
+    As mensagens de log (já filtradas por nível) e os contadores de avisos são devolvidos
+    ao processo principal junto com os resultados, assim como os perfis de extração calibrados
+    ou escalonados a partir de 'perfis_conhecidos' ({impressão digital: perfil}).
+    Retorna (resultados (LoteFaturas, ou a lista de resultados se fora do esquema), verificação do Valor Cobrado,
+    (mensagens de log, contagens (ver RegistroLog.contagens)), páginas sem texto, perfis alterados).
+    """
+    registro = RegistroLog(nivel_minimo=nivel_log, coletar=True)
+    perfis_extracao = PerfisExtracao(conhecidos=perfis_conhecidos)
+    ocr_pendentes = []
+    results = process_pdf_file(pdf_path, _df_base_worker, registro, None,
+                               pdf_bytes=pdf_bytes,
+                               ocr_servico=ColetorPaginasSemTexto() if coletar_paginas_sem_texto else None,
+                               ocr_pendentes=ocr_pendentes,
+                               tempo_limite_bloco=tempo_limite_bloco,
+                               perfis_extracao=perfis_extracao)
+    resultado_verificacao = extract_and_verify_valor_cobrado(pdf_path, pdf_bytes)
+    # As faturas seguem em lote colunar (muito mais leve de serializar que um dicionário por fatura)
+    lote = LoteFaturas.de_resultados(results)
+    if lote is not None:
+        results = lote
+    return (results, resultado_verificacao, (registro.registros, *registro.contagens()), [page_num for _, page_num, _ in ocr_pendentes],
+            perfis_extracao.alterados)
+
+
+# --- OCR de Páginas Sem Texto ---
+
+def _ocr_pagina_pdf(pagina_pdf_bytes, idioma, dpi):
+    """
+    Executa o OCR (Tesseract via PyMuPDF) de um PDF de uma única página.
+    Executada em um processo separado do pool de OCR.
+    """
+    with fitz.open(stream=pagina_pdf_bytes, filetype="pdf") as doc:
+        page = doc[0]
+        textpage = page.get_textpage_ocr(language=idioma, dpi=dpi, full=True)
+        return page.get_text("text", textpage=textpage)
+
+class ServicoOCR:
+    """
+    Aplica OCR, de forma opcional, apenas nas páginas sem texto extraível (ex: faturas digitalizadas).
+
+    O OCR é executado em um pool limitado de processos, para que páginas lentas não travem
+    a extração das páginas com texto. Os resultados são guardados em cache (arquivo JSON),
+    indexados pelo hash das imagens da página, para que novas execuções não repitam o OCR.
+    """
+
+    def __init__(self, processos, idioma, dpi, cache_path, logger_func=None):
+        self.processos = max(1, processos)
+        self.idioma = idioma
+        self.dpi = dpi
+        self.cache_path = cache_path
+        self.logger_func = logger_func
+        self.executor = None # Criado apenas quando a primeira página for enviada
+        self.cache = {}
+        self.cache_alterado = False
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    self.cache = json.load(f)
+            except Exception as e:
+                if logger_func:
+                    logger_func(f"Não foi possível ler o cache de OCR ({cache_path}): {e}. O cache será recriado.", "WARNING")
+
+    def _hash_imagens_pagina(self, doc, page):
+        """
+        Calcula o hash das imagens da página (fluxos brutos, sem renderizar).
+        Retorna None se a página não contém imagens.
+        """
+        imagens = page.get_images(full=True)
+        if not imagens:
+            return None
+        sha256 = hashlib.sha256()
+        # Inclui o que altera o resultado do OCR: parâmetros, rotação e dimensões da página
+        sha256.update(f"{self.idioma}|{self.dpi}|{page.rotation}|{tuple(page.rect)}".encode('utf-8'))
+        for imagem in imagens:
+            sha256.update(doc.xref_stream_raw(imagem[0]) or b'')
+        return sha256.hexdigest()
+
+    def submeter(self, pdf_path, pdf_bytes, page_num):
+        """
+        Envia uma página para OCR. Retorna um Future com o texto da página,
+        ou None se a página não contém imagens para reconhecer.
+        """
+        with abrir_documento_fitz(pdf_path, pdf_bytes) as doc:
+            page = doc[page_num]
+            chave = self._hash_imagens_pagina(doc, page)
+            if chave is None:
+                return None
+
+            pedido = concurrent.futures.Future()
+            if chave in self.cache:
+                pedido.set_result(self.cache[chave])
+                return pedido
+
+            # Envia apenas a página (não o PDF inteiro) para o processo de OCR
+            with fitz.open() as pagina_doc:
+                pagina_doc.insert_pdf(doc, from_page=page_num, to_page=page_num)
+                pagina_pdf_bytes = pagina_doc.tobytes()
+
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.processos, mp_context=contexto_processos())
+        pedido = self.executor.submit(_ocr_pagina_pdf, pagina_pdf_bytes, self.idioma, self.dpi)
+        pedido.add_done_callback(lambda f: self._guardar_no_cache(chave, f))
+        return pedido
+
+    def _guardar_no_cache(self, chave, pedido):
+        if not pedido.cancelled() and pedido.exception() is None:
+            self.cache[chave] = pedido.result()
+            self.cache_alterado = True
+
+    def encerrar(self, aguardar=True):
+        """
+        Encerra o pool de OCR e grava o cache em disco, se houver novos resultados.
+        Com 'aguardar' False (cancelamento), as páginas em reconhecimento não são aguardadas.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=aguardar, cancel_futures=True)
+            self.executor = None
+        self.salvar_cache()
+
+    def salvar_cache(self):
+        """Grava o cache em disco, se houver novos resultados (o pool continua ativo)."""
+        if self.cache_alterado and self.cache_path:
+            try:
+                # Arquivo temporário + os.replace: uma interrupção não deixa um cache pela metade (ilegível na próxima execução)
+                with gravacao_atomica(self.cache_path, 'w', encoding='utf-8') as f:
+                    json.dump(dict(self.cache), f, ensure_ascii=False) # Cópia: o pool pode ainda estar concluindo páginas
+                self.cache_alterado = False
+            except Exception as e:
+                if self.logger_func:
+                    self.logger_func(f"Não foi possível gravar o cache de OCR ({self.cache_path}): {e}", "WARNING")
+
+
+# --- Detecção de Duplicatas ---
+
+def calcular_hash_arquivo(pdf_path, tamanho_bloco=1024 * 1024):
+    """Calcula o hash SHA-256 do conteúdo de um arquivo, lendo-o em blocos."""
+    sha256 = hashlib.sha256()
+    with abrir_pdf(pdf_path) as f:
+        for bloco in iter(lambda: f.read(tamanho_bloco), b''):
+            sha256.update(bloco)
+    return sha256.hexdigest()
+
+class IndiceDuplicatas:
+    """
+    Índice em memória (dicionários, consulta O(1)) para detectar arquivos PDF
+    repetidos (mesmo conteúdo) e faturas repetidas (mesma UC, valores e referência).
+    Faturas sem referência nunca são consideradas duplicadas: meses diferentes da mesma UC
+    podem ter os mesmos valores. Elas são contadas por PDF (ver informar_pdfs_sem_referencia).
+    """
+
+    # Campos que, junto com a UC, identificam uma fatura
+    CAMPOS_IDENTIDADE_FATURA = [
+        "Referência",
+        "ENERGIA (R$)",
+        "COSIP (R$)",
+        "RETENÇÃO (R$)",
+        "LÍQUIDO (R$)",
+        "Energia (1,2%)", "Retenção(1,2%)",
+        "Energia (4,8%)", "Retenção(4,8%)"
+    ]
+
+    def __init__(self, logger_func=None):
+        self.arquivos_por_hash = {}
+        self.faturas_por_chave = {}
+        self.sem_referencia_por_pdf = {} # PDF -> faturas sem referência (não verificadas)
+        self.pdfs_com_duplicatas = set() # PDFs com faturas duplicadas (ausentes de 'faturas_por_chave')
+        self.logger_func = logger_func
+
+    def registrar_arquivo(self, conteudo_hash, pdf_filename):
+        """
+        Registra o hash de um arquivo. Retorna o nome do arquivo original se o
+        conteúdo já tiver sido registrado, ou None se for um arquivo novo.
+        """
+        original = self.arquivos_por_hash.get(conteudo_hash)
+        if original is not None:
+            return original
+        self.arquivos_por_hash[conteudo_hash] = pdf_filename
+        return None
+
+    def chave_fatura(self, fatura_data):
+        """Monta a chave de identidade de uma fatura (UC + valores extraídos + referência)."""
+        return (str(fatura_data.get("UC", "")),) + tuple(
+            fatura_data.get(campo, "") for campo in self.CAMPOS_IDENTIDADE_FATURA
+        )
+
+    def registrar_fatura(self, fatura_data):
+        """
+        Registra uma fatura extraída. Retorna o 'Numero da Pagina' da ocorrência
+        original se a fatura já tiver sido registrada, ou None se for nova.
+        """
+        return self.registrar_chave(self.chave_fatura(fatura_data), fatura_data.get("Numero da Pagina", ""))
+
+    def registrar_chave(self, chave, numero_pagina):
+        """Como registrar_fatura, a partir da chave já montada (ex: LoteFaturas.chaves_identidade)."""
+        referencia = chave[1 + self.CAMPOS_IDENTIDADE_FATURA.index("Referência")]
+        if not isinstance(referencia, str) or not referencia.strip():
+            registrar_log(self.logger_func, "DEBUG", "SEM_REFERENCIA",
+                          "Referência não encontrada na fatura da UC {uc} em {pagina}. Verificação de fatura duplicada não realizada.",
+                          uc=chave[0], pagina=numero_pagina)
+            pdf = pdf_do_numero_pagina(numero_pagina)
+            self.sem_referencia_por_pdf[pdf] = self.sem_referencia_por_pdf.get(pdf, 0) + 1
+            return None
+        original = self.faturas_por_chave.get(chave)
+        if original is not None:
+            self.pdfs_com_duplicatas.add(pdf_do_numero_pagina(numero_pagina))
+            return original
+        self.faturas_por_chave[chave] = numero_pagina
+        return None
+
+    def informar_pdfs_sem_referencia(self):
+        """
+        Ao final da extração, registra um aviso para cada PDF em que nenhuma fatura tem referência: nesses PDFs
+        (provavelmente um layout em que a referência não é reconhecida) a verificação de fatura duplicada não foi feita.
+        """
+        if not self.sem_referencia_por_pdf:
+            return
+        com_referencia = {pdf_do_numero_pagina(numero_pagina) for numero_pagina in self.faturas_por_chave.values()}
+        for pdf, quantidade in self.sem_referencia_por_pdf.items():
+            if pdf not in com_referencia and pdf not in self.pdfs_com_duplicatas:
+                registrar_log(self.logger_func, "WARNING", "PDF_SEM_REFERENCIA",
+                              "Nenhuma das {quantidade} fatura(s) de {pdf} tem referência (layout não reconhecido?). "
+                              "A verificação de fatura duplicada não foi feita nesse PDF.",
+                              pdf=pdf, quantidade=quantidade)
+
+def pdf_do_numero_pagina(numero_pagina):
+    """Nome do PDF de um 'Numero da Pagina' ("arquivo.pdf (Pág. N)" ou apenas "arquivo.pdf")."""
+    match = NUMERO_PAGINA_REGEX.match(str(numero_pagina))
+    return match.group("pdf") if match else str(numero_pagina)
+
+def verificar_arquivo_duplicado_indice(indice_duplicatas, pdf_path, pdf_bytes, logger_func):
+    """Verifica se o mesmo conteúdo já foi selecionado (antes de extrair o texto). Retorna o item de erro ou None."""
+    pdf_name = nome_pdf(pdf_path)
+    try:
+        conteudo_hash = hashlib.sha256(pdf_bytes).hexdigest() if pdf_bytes is not None else calcular_hash_arquivo(pdf_path)
+        arquivo_original = indice_duplicatas.registrar_arquivo(conteudo_hash, pdf_name)
+    except (OSError, KeyError, zipfile.BadZipFile) as e:
+        logger_func(f"Não foi possível calcular o hash de {pdf_name}: {e}. Verificação de duplicidade ignorada.", "WARNING")
+        arquivo_original = None
+    if arquivo_original is None:
+        return None
+    dup_msg = f"Arquivo duplicado: {pdf_name} tem o mesmo conteúdo de {arquivo_original}. Arquivo ignorado."
+    logger_func(dup_msg, "WARNING")
+    return {"error": dup_msg, "Observação": dup_msg, "Numero da Pagina": pdf_name, "UC": "N/A"}
+
+def criar_item_fatura_duplicada(fatura_data, fatura_original):
+    """Cria o item de erro (para a aba 'Relatorio_Erros') de uma fatura duplicada."""
+    dup_msg = f"Fatura duplicada: UC {fatura_data['UC']} em {fatura_data['Numero da Pagina']} já consta em {fatura_original}. Fatura não somada."
+    duplicate_item = dict(fatura_data)
+    duplicate_item.update({"error": dup_msg, "Observação": dup_msg})
+    return duplicate_item
+
+
+# --- Revinculação de UCs (sem reprocessar os PDFs) ---
+
+def salvar_estado_execucao(estado_path, all_extracted_data, error_items, all_valor_cobrado_results):
+    """
+    Grava os resultados da execução em JSON, incluindo os valores extraídos dos blocos
+    cuja UC não foi encontrada na planilha base, para permitir a revinculação.
+    As faturas são gravadas por segmento (ver TabelaFaturas.gravar_json): os lotes da extração
+    vão coluna a coluna, sem criar um dicionário por fatura.
+    """
+    with gravacao_atomica(estado_path, 'w', encoding='utf-8') as f:
+        f.write(f'{{"data_execucao": {json.dumps(datetime.now().isoformat(timespec="seconds"))}, "segmentos": ')
+        TabelaFaturas.de_faturas(all_extracted_data).gravar_json(f)
+        f.write(', "erros": ')
+        json.dump(error_items, f, ensure_ascii=False, default=str)
+        f.write(', "valor_cobrado": ')
+        json.dump(all_valor_cobrado_results, f, ensure_ascii=False, default=str)
+        f.write('}')
+
+def carregar_estado_execucao(estado_path):
+    """
+    Lê o estado gravado por salvar_estado_execucao. As faturas ficam em estado["dados"] (TabelaFaturas);
+    estados gravados por versões anteriores (lista de faturas em "dados") continuam aceitos.
+    """
+    with open(estado_path, 'r', encoding='utf-8') as f:
+        estado = json.load(f)
+    if "segmentos" in estado:
+        estado["dados"] = TabelaFaturas.de_json(estado.pop("segmentos"))
+    return estado
+
+def revincular_ucs_pendentes(all_extracted_data, error_items, df_base, logger_func):
+    """
+    Refaz apenas a consulta à planilha base para os erros de 'UC não encontrada'
+    que guardaram os valores extraídos. As faturas agora encontradas passam dos erros para os dados.
+    Retorna (dados, erros restantes, quantidade de faturas revinculadas).
+    """
+    indice_duplicatas = IndiceDuplicatas(logger_func)
+    for fatura_data in all_extracted_data:
+        indice_duplicatas.registrar_fatura(fatura_data)
+
+    novos_dados = TabelaFaturas.de_faturas(all_extracted_data)
+    erros_restantes = []
+    revinculadas = 0
+
+    for item in error_items:
+        dados_extraidos = item.get("_dados_extraidos")
+        if not dados_extraidos:
+            erros_restantes.append(item)
+            continue
+
+        dados_base = resolve_uc_na_base(dados_extraidos["UC"], df_base)
+        if dados_base is None:
+            erros_restantes.append(item)
+            continue
+
+        fatura_data = dict(dados_extraidos)
+        fatura_data["Centro de Custo"], fatura_data["Subseção"] = dados_base
+
+        fatura_original = indice_duplicatas.registrar_fatura(fatura_data)
+        if fatura_original is not None:
+            duplicate_item = criar_item_fatura_duplicada(fatura_data, fatura_original)
+            logger_func(duplicate_item["error"], "WARNING")
+            erros_restantes.append(duplicate_item)
+            continue
+
+        novos_dados.append(fatura_data)
+        revinculadas += 1
+        logger_func(f"UC {fatura_data['UC']} ({fatura_data['Numero da Pagina']}) revinculada: Centro de Custo {fatura_data['Centro de Custo']}.", "INFO")
+
+    return novos_dados, erros_restantes, revinculadas
+
+
+# --- Reprocessamento dos Erros de um Relatório Anterior ---
+
+# 'Numero da Pagina' de uma página específica: "arquivo.pdf (Pág. N)"
+NUMERO_PAGINA_REGEX = re.compile(r"^(?P<pdf>.+) \(Pág\. (?P<pagina>\d+)\)$")
+
+# Erros que não são corrigidos reprocessando o PDF (mantidos como estão no novo relatório)
+PREFIXOS_ERROS_NAO_REPROCESSAVEIS = ("Arquivo duplicado:", "Fatura duplicada:")
+
+def _reais_para_centavos(valor):
+    """Converte um valor de moeda lido do Excel (em reais) para centavos inteiros."""
+    if isinstance(valor, str):
+        return parse_centavos(valor)
+    return int(round(float(valor) * 100))
+
+def _linhas_planilha(df, colunas_moeda):
+    """Converte as linhas de uma aba lida do Excel em dicionários (moeda em centavos), ignorando as linhas em branco."""
+    linhas = []
+    for registro in df.to_dict("records"):
+        linha = {coluna: valor for coluna, valor in registro.items() if not pd.isna(valor) and valor != ""}
+        if not linha:
+            continue
+        if isinstance(linha.get("UC"), (int, float)):
+            linha["UC"] = str(int(linha["UC"]))
+        for coluna in colunas_moeda:
+            if coluna in linha:
+                linha[coluna] = _reais_para_centavos(linha[coluna])
+        linhas.append(linha)
+    return linhas
+
+def ler_relatorio_anterior(relatorio_path):
+    """
+    Lê um relatório Excel gerado anteriormente, inclusive os arquivos de continuação ('... (2).xlsx', ...).
+    Retorna um dicionário com as faturas ('dados'), os erros ('erros'), as linhas da aba 'Controle' sem
+    a linha de totais ('controle', None se a aba não existir) e o 'TOTAL conta' ('total_conta', ou None).
+    Os valores de moeda são convertidos para centavos.
+    """
+    raiz, extensao = os.path.splitext(relatorio_path)
+    arquivos = [relatorio_path]
+    while os.path.exists(nome_parte(raiz, len(arquivos) + 1) + extensao):
+        arquivos.append(nome_parte(raiz, len(arquivos) + 1) + extensao)
+
+    anterior = {"dados": [], "erros": [], "controle": None, "total_conta": None}
+    for caminho in arquivos:
+        for nome_aba, df_aba in pd.read_excel(caminho, sheet_name=None, dtype=object).items():
+            if nome_aba == "Relatorio" or nome_aba.startswith("Relatorio ("):
+                for linha in _linhas_planilha(df_aba, COLUNAS_MOEDA_RELATORIO):
+                    if linha.get("UC") == "TOTAL conta:":
+                        anterior["total_conta"] = linha.get("LÍQUIDO (R$)", 0)
+                    elif linha.get("UC") != "Totais:":
+                        anterior["dados"].append(linha)
+            elif nome_aba == "Relatorio_Erros" or nome_aba.startswith("Relatorio_Erros ("):
+                for linha in _linhas_planilha(df_aba, COLUNAS_MOEDA_RELATORIO):
+                    linha["error"] = linha.get("Observação", "")
+                    anterior["erros"].append(linha)
+            elif nome_aba == "Controle":
+                anterior["controle"] = [linha for linha in _linhas_planilha(df_aba, COLUNAS_MOEDA_CONTROLE)
+                                        if linha.get("UC") != "Totais:"]
+    return anterior
+
+def planejar_reprocessamento(erros_anteriores):
+    """
+    Monta o plano de reprocessamento a partir dos erros de um relatório anterior.
+    Retorna (plano {nome do PDF: conjunto de páginas a partir de 0, ou None para o arquivo inteiro},
+    erros de cada nome do plano, erros mantidos (duplicidades e erros sem 'Numero da Pagina'),
+    nomes dos arquivos que não chegaram a ser extraídos).
+    """
+    plano = {}
+    erros_por_nome = {}
+    erros_mantidos = []
+    nao_extraidos = set()
+
+    for erro in erros_anteriores:
+        numero_pagina = str(erro.get("Numero da Pagina", "")).strip()
+        observacao = str(erro.get("Observação", ""))
+        if not numero_pagina or observacao.startswith(PREFIXOS_ERROS_NAO_REPROCESSAVEIS):
+            erros_mantidos.append(erro)
+            continue
+
+        match = NUMERO_PAGINA_REGEX.match(numero_pagina)
+        nome = match.group("pdf") if match else numero_pagina
+        erros_por_nome.setdefault(nome, []).append(erro)
+        if match is None:
+            plano[nome] = None
+            # Erros do arquivo inteiro com observação vêm da verificação preliminar ou de um ZIP inválido:
+            # o 'Valor Cobrado' desses arquivos não foi somado ao 'TOTAL conta'
+            if observacao:
+                nao_extraidos.add(nome)
+        elif plano.get(nome, set()) is not None:
+            plano.setdefault(nome, set()).add(int(match.group("pagina")) - 1)
+
+    return plano, erros_por_nome, erros_mantidos, nao_extraidos
+
+def _nome_no_plano(pdf_name, nomes):
+    """Nome (do plano) que corresponde a um PDF: o próprio PDF ou o ZIP que o contém. None se não houver."""
+    if pdf_name in nomes:
+        return pdf_name
+    zip_name = pdf_name.split(SEPARADOR_ZIP, 1)[0]
+    if zip_name != pdf_name and zip_name in nomes:
+        return zip_name
+    return None
+
+def _chave_linha_relatorio(fatura_data, com_local=True):
+    """Identidade de uma fatura pelas colunas da aba 'Relatorio' (UC, valores e, opcionalmente, a página)."""
+    chave = (str(fatura_data.get("UC", "")),) + tuple(fatura_data.get(coluna, 0) for coluna in COLUNAS_MOEDA_RELATORIO)
+    return chave + (str(fatura_data.get("Numero da Pagina", "")),) if com_local else chave
+
+def mesclar_reprocessamento(relatorio_anterior_path, anterior, erros_mantidos, dados_novos, erros_novos,
+                            valor_cobrado_novo, nao_extraidos, logger_func):
+    """
+    Acrescenta às faturas do relatório anterior as faturas recuperadas no reprocessamento.
+    Faturas que já constavam no relatório anterior (mesma página, UC e valores) são ignoradas; as que
+    constavam em outra página viram erro de fatura duplicada. O 'TOTAL conta' anterior é mantido e somado
+    ao 'Valor Cobrado' dos arquivos que não chegaram a ser extraídos antes.
+    Retorna (faturas, erros, resultados do 'Valor Cobrado', AgregadorControle para a aba 'Controle').
+    """
+    chaves_anteriores = {_chave_linha_relatorio(fatura) for fatura in anterior["dados"]}
+    paginas_por_valores = {_chave_linha_relatorio(fatura, com_local=False): fatura.get("Numero da Pagina", "")
+                           for fatura in anterior["dados"]}
+
+    recuperadas = []
+    ja_presentes = 0
+    error_items = list(erros_mantidos)
+    for fatura_data in dados_novos:
+        if _chave_linha_relatorio(fatura_data) in chaves_anteriores:
+            ja_presentes += 1
+            continue
+        fatura_original = paginas_por_valores.get(_chave_linha_relatorio(fatura_data, com_local=False))
+        if fatura_original is not None:
+            duplicate_item = criar_item_fatura_duplicada(fatura_data, fatura_original)
+            logger_func(duplicate_item["error"], "WARNING")
+            error_items.append(duplicate_item)
+            continue
+        recuperadas.append(fatura_data)
+    error_items.extend(erros_novos)
+
+    all_valor_cobrado_results = []
+    if anterior["total_conta"] is not None:
+        all_valor_cobrado_results.append({"pdf": os.path.basename(relatorio_anterior_path),
+                                          "valor_cobrado": anterior["total_conta"],
+                                          "liquido_total_verified": anterior["total_conta"]})
+    all_valor_cobrado_results.extend(resultado for resultado in valor_cobrado_novo
+                                     if _nome_no_plano(resultado["pdf"], nao_extraidos) is not None)
+
+    if anterior["controle"] is None:
+        logger_func("O relatório anterior não tem a aba 'Controle' (necessária para somar as faturas recuperadas); "
+                    "a aba 'Controle' não será gerada.", "WARNING")
+        agregador_controle = AgregadorControle()
+    else:
+        agregador_controle = AgregadorControle(anterior["controle"] + recuperadas)
+
+    logger_func(f"{len(recuperadas)} fatura(s) recuperada(s); {ja_presentes} já constava(m) no relatório anterior. "
+                f"{len(error_items)} erro(s) restante(s).", "SUCCESSO" if recuperadas else "INFO")
+    return anterior["dados"] + recuperadas, error_items, all_valor_cobrado_results, agregador_controle
+
+def reprocessar_erros_relatorio(relatorio_anterior_path, pdf_files, df_base, configuracoes, logger_func,
+                                progress_callback=None, ao_iniciar_extracao=None, ocr_cache_path=None,
+                                ocr_servico=None, executor_extracao=None, perfis_extracao=None):
+    """
+    Reprocessa apenas os arquivos e páginas listados na aba 'Relatorio_Erros' de um relatório anterior,
+    localizando-os entre os PDFs/ZIPs de 'pdf_files', e mescla as faturas recuperadas às do relatório anterior.
+    'ao_iniciar_extracao' é chamado com o total de páginas a reprocessar, antes da extração.
+    Retorna (faturas, erros, resultados do 'Valor Cobrado', AgregadorControle da aba 'Controle'), prontos para gerar_relatorio.
+    Levanta OSError/ValueError se o relatório anterior não puder ser lido.
+    """
+    anterior = ler_relatorio_anterior(relatorio_anterior_path)
+    logger_func(f"Relatório anterior {os.path.basename(relatorio_anterior_path)}: {len(anterior['dados'])} fatura(s) "
+                f"e {len(anterior['erros'])} erro(s).", "INFO")
+    plano, erros_por_nome, erros_mantidos, nao_extraidos = planejar_reprocessamento(anterior["erros"])
+
+    candidatos, erros_zip = expandir_arquivos_zip(pdf_files, logger_func)
+    selecionados = []
+    paginas_por_pdf = {}
+    encontrados = set()
+    for pdf_path in candidatos:
+        nome = _nome_no_plano(nome_pdf(pdf_path), plano)
+        if nome is None:
+            continue
+        encontrados.add(nome)
+        selecionados.append(pdf_path)
+        if plano[nome] is not None:
+            paginas_por_pdf[pdf_path] = plano[nome]
+    erros_zip = [erro for erro in erros_zip if erro["Numero da Pagina"] in plano]
+    encontrados.update(erro["Numero da Pagina"] for erro in erros_zip)
+
+    for nome in plano:
+        if nome not in encontrados:
+            logger_func(f"{nome} não está entre os arquivos selecionados; seus erros foram mantidos.", "WARNING", pdf=nome)
+            erros_mantidos.extend(erros_por_nome[nome])
+
+    dados_novos, erros_novos, valor_cobrado_novo = [], list(erros_zip), []
+    if selecionados:
+        logger_func(f"Reprocessando {len(selecionados) - len(paginas_por_pdf)} arquivo(s) inteiro(s) e "
+                    f"{sum(len(paginas) for paginas in paginas_por_pdf.values())} página(s) de {len(paginas_por_pdf)} arquivo(s).", "INFO")
+        pdfs_validos, pdf_page_counts, pdf_sizes, erros_preliminares = verificar_pdfs(
+            selecionados, configuracoes["processos_extracao"], logger_func, executor=executor_extracao)
+        for pdf_path, paginas in paginas_por_pdf.items():
+            if pdf_path in pdf_page_counts:
+                pdf_page_counts[pdf_path] = len(paginas)
+        if ao_iniciar_extracao:
+            ao_iniciar_extracao(sum(pdf_page_counts.values()))
+        dados_novos, erros_extracao, valor_cobrado_novo = extrair_faturas(
+            pdfs_validos, df_base, configuracoes, logger_func, progress_callback,
+            pdf_page_counts=pdf_page_counts, pdf_sizes=pdf_sizes, erros_preliminares=erros_preliminares,
+            ocr_cache_path=ocr_cache_path, ocr_servico=ocr_servico, executor_extracao=executor_extracao,
+            paginas_por_pdf=paginas_por_pdf, perfis_extracao=perfis_extracao)
+        erros_novos.extend(erros_extracao)
+    else:
+        logger_func("Nenhum arquivo a reprocessar entre os arquivos selecionados.", "WARNING")
+
+    return mesclar_reprocessamento(relatorio_anterior_path, anterior, erros_mantidos, dados_novos, erros_novos,
+                                   valor_cobrado_novo, nao_extraidos, logger_func)
+
+
+# --- Divisão do Relatório em Abas e Arquivos ---
+
+# Limite de linhas de uma planilha do Excel (incluindo o cabeçalho)
+LIMITE_LINHAS_EXCEL = 1048576
+# Linhas reservadas na última aba para o cabeçalho, a linha em branco, 'Totais:' e 'TOTAL conta:'
+LINHAS_RESERVADAS_RESUMO = 4
+
+def dividir_em_partes(df, linhas_por_parte):
+    """Divide um DataFrame em fatias consecutivas de no máximo 'linhas_por_parte' linhas."""
+    if df.empty:
+        return []
+    return [df.iloc[inicio:inicio + linhas_por_parte] for inicio in range(0, len(df), linhas_por_parte)]
+
+def nome_parte(nome_base, numero):
+    """Nome da parte N de uma aba ou arquivo: 'Relatorio', 'Relatorio (2)', 'Relatorio (3)', ..."""
+    return nome_base if numero == 1 else f"{nome_base} ({numero})"
+
+def montar_partes_relatorio(df_dados, linhas_resumo, colunas, linhas_por_aba):
+    """
+    Divide as faturas do 'Relatorio' em partes de no máximo 'linhas_por_aba' linhas.
+    As linhas de resumo ('Totais:' e 'TOTAL conta:'), já calculadas sobre todas as faturas,
+    são acrescentadas apenas ao final da última parte, após uma linha em branco.
+    """
+    partes = dividir_em_partes(df_dados, linhas_por_aba)
+    linhas_resumo = [linha for linha in linhas_resumo if not linha.empty]
+    if linhas_resumo:
+        ultima_parte = [partes.pop()] if partes else []
+        if ultima_parte:
+            ultima_parte.append(pd.DataFrame([{col: "" for col in colunas}]))
+        partes.append(pd.concat(ultima_parte + linhas_resumo, ignore_index=True))
+    return partes
+
+def distribuir_partes_em_arquivos(output_file_path, partes, abas_por_arquivo):
+    """
+    Distribui as partes do 'Relatorio' entre o arquivo principal e arquivos de continuação
+    ('... (2).xlsx', ...), com no máximo 'abas_por_arquivo' abas cada (0 = sem limite).
+    Retorna uma lista de (caminho do arquivo, [(nome da aba, DataFrame), ...]); o arquivo principal é sempre o primeiro.
+    """
+    abas = [(nome_parte("Relatorio", numero), parte) for numero, parte in enumerate(partes, start=1)]
+    if abas_por_arquivo <= 0 or len(abas) <= abas_por_arquivo:
+        return [(output_file_path, abas)]
+    raiz, extensao = os.path.splitext(output_file_path)
+    return [(nome_parte(raiz, numero) + extensao, abas[inicio:inicio + abas_por_arquivo])
+            for numero, inicio in enumerate(range(0, len(abas), abas_por_arquivo), start=1)]
+
+
+# --- Pipeline de Relatório (sem interface gráfica) ---
+
+# Artefatos (arquivos TXT e Excel) gravados simultaneamente por gerar_relatorio
+ARTEFATOS_SIMULTANEOS = 4
+
+# Colunas da aba 'Relatorio'
+COLUNAS_RELATORIO = [
+    "UC", "Centro de Custo", "Subseção",
+    "ENERGIA (R$)",
+    "COSIP (R$)",
+    "Valor Bruto (R$)",
+    "RETENÇÃO (R$)",
+    "LÍQUIDO (R$)",
+    "Numero da Pagina"
+]
+# Colunas da aba de Erros
+COLUNAS_ERROS = COLUNAS_RELATORIO + ["Observação"]
+# Colunas de moeda das abas 'Relatorio' e 'Relatorio_Erros'
+COLUNAS_MOEDA_RELATORIO = [
+    "ENERGIA (R$)",
+    "COSIP (R$)",
+    "Valor Bruto (R$)",
+    "RETENÇÃO (R$)",
+    "LÍQUIDO (R$)"
+]
+# Colunas de moeda da aba 'Controle'
+COLUNAS_MOEDA_CONTROLE = [
+    "COSIP (R$)",
+    "Energia (1,2%)", "Retenção(1,2%)",
+    "Energia (4,8%)", "Retenção(4,8%)"
+]
+
+def diretorio_base():
+    """Pasta do programa (do executável, quando empacotado com PyInstaller), onde fica a pasta 'base'."""
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+def carregar_planilha_base(base_sheet_path):
+    """
+    Lê a planilha base de UCs e normaliza a coluna 'UC'.
+    Levanta FileNotFoundError se o arquivo não existe e ValueError se faltam colunas obrigatórias.
+    """
+    if not os.path.exists(base_sheet_path):
+        raise FileNotFoundError(f"Arquivo base não encontrado em {base_sheet_path}")
+
+    df_base = pd.read_excel(base_sheet_path, engine='openpyxl', dtype={'UC': str, 'Cod de Reg': str, 'Nome': str})
+    required_cols = ['UC', 'Cod de Reg', 'Nome']
+    if not all(col in df_base.columns for col in required_cols):
+        missing_cols = [col for col in required_cols if col not in df_base.columns]
+        raise ValueError(f"Colunas faltando na planilha base: {', '.join(missing_cols)}. Necessárias: {', '.join(required_cols)}")
+
+    df_base.dropna(subset=['UC'], inplace=True)
+    df_base['UC'] = df_base['UC'].astype(str).str.strip()
+    return df_base
+
+def verificar_pdfs(pdf_files, processos, logger_func, enquanto_verifica=None, executor=None):
+    """
+    Verifica os PDFs em paralelo (ver verificar_pdf_preliminar). 'enquanto_verifica', se informado,
+    é executado durante a verificação (ex: carregar a planilha base); se retornar False, a verificação é cancelada.
+    'executor' permite reaproveitar um pool já iniciado (não é encerrado aqui).
+    Arquivos .zip são substituídos pelos PDFs que contêm.
+    Retorna (PDFs válidos, páginas por PDF, tamanho por PDF, itens de erro dos PDFs com problema),
+    ou None se cancelada.
+    """
+    pdf_files, erros_preliminares = expandir_arquivos_zip(pdf_files, logger_func)
+    if not pdf_files:
+        if enquanto_verifica is not None and enquanto_verifica() is False:
+            return None
+        return [], {}, {}, erros_preliminares
+
+    encerrar_executor = executor is None
+    if executor is None and processos > 1 and len(pdf_files) > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=min(processos, len(pdf_files)), mp_context=contexto_processos())
+    elif executor is None:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(4, len(pdf_files)))
+    try:
+        verificacoes = [executor.submit(verificar_pdf_preliminar, pdf_path) for pdf_path in pdf_files]
+
+        if enquanto_verifica is not None and enquanto_verifica() is False:
+            for verificacao in verificacoes:
+                verificacao.cancel()
+            return None
+
+        pdf_page_counts = {}
+        pdf_sizes = {}
+        pdfs_validos = []
+        for pdf_path, verificacao in zip(pdf_files, verificacoes):
+            pdf_name = nome_pdf(pdf_path)
+            try:
+                paginas, tamanho, problema = verificacao.result()
+            except Exception as e:
+                paginas, tamanho, problema = 0, 0, f"Falha na verificação do PDF: {e}"
+            if problema:
+                logger_func(f"{pdf_name}: {problema} O arquivo não será processado.", "ERROR", "PDF_INVALIDO", pdf=pdf_name)
+                erros_preliminares.append({"error": f"{pdf_name}: {problema}", "Observação": problema, "Numero da Pagina": pdf_name, "UC": "N/A"})
+                continue
+            pdf_page_counts[pdf_path] = paginas
+            pdf_sizes[pdf_path] = tamanho
+            pdfs_validos.append(pdf_path)
+    finally:
+        if encerrar_executor:
+            executor.shutdown(wait=True)
+
+    if erros_preliminares:
+        logger_func(f"{len(erros_preliminares)} PDF(s) com problema excluído(s) do processamento.", "WARNING")
+    return pdfs_validos, pdf_page_counts, pdf_sizes, erros_preliminares
+
+def repassar_registros_log(logger_func, registros, contadores, ocorrencias=None, nivel_maximo=0):
+    """Repassa ao logger as mensagens e as contagens (ver RegistroLog.contagens) devolvidas por um processo de extração."""
+    emitir = getattr(logger_func, "emitir", None)
+    for message, level, codigo, campos in registros:
+        if emitir is not None:
+            emitir(message, level, codigo, campos)
+        else:
+            logger_func(message, level)
+    somar_contadores = getattr(logger_func, "somar_contadores", None)
+    if somar_contadores is not None:
+        somar_contadores(contadores, ocorrencias, nivel_maximo)
+
+def registrar_valor_cobrado(pdf_path, resultado_verificacao, logger_func):
+    """Registra no log as mensagens da verificação do 'Valor Cobrado' e monta o resultado do PDF."""
+    pdf_name = nome_pdf(pdf_path)
+    cobrado_val, cobrado_str, liquido_total_verified, status_msgs = resultado_verificacao
+
+    for msg in status_msgs:
+        if "Aviso" in msg:
+            logger_func(f"[{pdf_name}] {msg}", "WARNING", "VALOR_COBRADO", pdf=pdf_name)
+        elif "Erro" in msg:
+            logger_func(f"[{pdf_name}] {msg}", "ERROR", "VALOR_COBRADO", pdf=pdf_name)
+        else:
+            logger_func(f"[{pdf_name}] {msg}", "INFO", "VALOR_COBRADO", pdf=pdf_name)
+
+    return {"pdf": pdf_name, "valor_cobrado": cobrado_val, "liquido_total_verified": liquido_total_verified}
+
+def extrair_faturas(pdf_files, df_base, configuracoes, logger_func, progress_callback=None,
+                    pdf_page_counts=None, pdf_sizes=None, erros_preliminares=None,
+                    ocr_cache_path=None, ocr_servico=None, executor_extracao=None, paginas_por_pdf=None,
+                    agregador_controle=None, manter_faturas=True, parcial=None, perfis_extracao=None,
+                    status_arquivo_func=None, cancelamento=None):
+    """
+    Extrai as faturas de uma lista de PDFs (em sequência ou em paralelo, conforme 'processos_extracao'),
+    desviando PDFs e faturas duplicados para a lista de erros e aplicando OCR nas páginas sem texto.
+
+    'logger_func' é chamado como logger_func(mensagem, nível, código, **campos) (ex: um RegistroLog).
+    'ocr_servico' e 'executor_extracao' permitem reaproveitar pools já iniciados; o executor deve ter
+    sido criado com _inicializar_worker_extracao e a mesma planilha base. Se não informados, são criados
+    (e encerrados) aqui. 'paginas_por_pdf' ({caminho: conjunto de páginas a partir de 0}) restringe a
+    extração a essas páginas (a extração é então feita em estágios, sem processos paralelos).
+    Cada fatura aceita é somada em 'agregador_controle' (AgregadorControle), se informado; com
+    'manter_faturas' False as faturas não são guardadas (a lista retornada fica vazia), de modo que a
+    memória não cresce com a quantidade de faturas quando apenas a aba 'Controle' é necessária.
+    'parcial' (ParcialFragmento), se informado, recebe os resultados de cada PDF antes da verificação de
+    faturas duplicadas, para a posterior mesclagem dos fragmentos de uma execução em várias máquinas.
+    'perfis_extracao' (PerfisExtracao) guarda o perfil de extração de texto de cada gerador de PDF; os
+    perfis calibrados ou escalonados são gravados ao final. Se não informado, os perfis valem só nesta execução.
+    'status_arquivo_func', se informado, acompanha cada PDF: é chamado como status_arquivo_func(pdf, estado,
+    faturas aceitas, itens de erro), com estado "processando" no início e "concluido", "falhou" (erro no
+    arquivo inteiro) ou "duplicado" ao final; é chamado de novo ("concluido") quando o OCR acrescenta resultados.
+    'cancelamento' (threading.Event), se informado, interrompe a extração quando sinalizado: a extração em
+    estágios para entre uma página e a seguinte e a paralela não envia novos PDFs nem aguarda os em execução.
+    Os resultados obtidos até então são retornados normalmente e cada PDF (ou página enviada ao OCR) não
+    concluído entra na lista de erros como "não processado" (estado "nao_processado").
+    Retorna (faturas extraídas (TabelaFaturas), itens de erro, resultados da verificação do 'Valor Cobrado'),
+    na ordem dos PDFs.
+    """
+    pdf_page_counts = pdf_page_counts or {}
+    pdf_sizes = pdf_sizes or {}
+    all_extracted_data = TabelaFaturas()
+    error_items = list(erros_preliminares or [])
+    all_valor_cobrado_results = []
+    indice_duplicatas = IndiceDuplicatas(logger_func)
+    contagem_por_pdf = {} # PDF -> [faturas aceitas, itens de erro], para 'status_arquivo_func'
+    pdfs_concluidos = set() # PDFs cuja extração chegou ao fim (os demais são "não processados" no cancelamento)
+    paginas_interrompidas = {} # PDF interrompido no meio pelo cancelamento -> páginas já extraídas
+
+    def cancelado():
+        return cancelamento is not None and cancelamento.is_set()
+
+    def avancar_progresso(paginas):
+        if progress_callback:
+            progress_callback(paginas)
+
+    def notificar_status(pdf_path, estado):
+        if status_arquivo_func:
+            faturas, erros = contagem_por_pdf.get(pdf_path, (0, 0))
+            status_arquivo_func(pdf_path, estado, faturas, erros)
+
+    def contar(pdf_path, faturas, erros):
+        contagem = contagem_por_pdf.setdefault(pdf_path, [0, 0])
+        contagem[0] += faturas
+        contagem[1] += erros
+
+    def registrar_nao_processado(pdf_path, page_num=None, observacao="não processado"):
+        """Registra na lista de erros um PDF (ou uma página enviada ao OCR) não concluído por causa do cancelamento."""
+        pdf_name = nome_pdf(pdf_path)
+        local = pdf_name if page_num is None else f"{pdf_name} (Pág. {page_num + 1})"
+        msg = f"{local}: não processado (extração cancelada pelo usuário)."
+        error_items.append({"error": msg, "Observação": observacao, "Numero da Pagina": local, "UC": "N/A"})
+        contar(pdf_path, 0, 1)
+
+    def registrar_resultados(pdf_path, results, ocr=False):
+        """Separa dados e erros, desviando faturas duplicadas para a lista de erros."""
+        if isinstance(results, LoteFaturas):
+            registrar_lote(pdf_path, results, ocr)
+            return
+        if parcial is not None:
+            parcial.registrar_resultados(pdf_path, results, ocr)
+        erros_antes = len(error_items)
+        for item in results:
+            if isinstance(item, dict):
+                if "error" in item:
+                    error_items.append(item)
+                else:
+                    # Verifica se a mesma fatura já foi extraída (ex: PDFs sobrepostos)
+                    fatura_original = indice_duplicatas.registrar_fatura(item)
+                    if fatura_original is not None:
+                        duplicate_item = criar_item_fatura_duplicada(item, fatura_original)
+                        logger_func(duplicate_item["error"], "WARNING")
+                        error_items.append(duplicate_item)
+                    else:
+                        if agregador_controle is not None:
+                            agregador_controle.adicionar(item)
+                        if manter_faturas:
+                            all_extracted_data.append(item)
+                        contar(pdf_path, 1, 0)
+        contar(pdf_path, 0, len(error_items) - erros_antes)
+
+    def registrar_lote(pdf_path, lote, ocr=False):
+        """Como registrar_resultados, para um LoteFaturas: as faturas aceitas são guardadas e somadas por lote."""
+        if parcial is not None:
+            parcial.registrar_resultados(pdf_path, lote.itens(), ocr)
+        chaves = lote.chaves_identidade()
+        paginas = lote.coluna("Numero da Pagina")
+        aceitas = []
+        for tipo, valor in lote.percorrer():
+            if tipo == "erro":
+                error_items.append(valor)
+                continue
+            fatura_original = indice_duplicatas.registrar_chave(next(chaves), paginas[valor])
+            if fatura_original is not None:
+                duplicate_item = criar_item_fatura_duplicada(lote.fatura(valor), fatura_original)
+                logger_func(duplicate_item["error"], "WARNING")
+                error_items.append(duplicate_item)
+            else:
+                aceitas.append(valor)
+        contar(pdf_path, len(aceitas), len(lote) + len(lote.erros) - len(aceitas))
+        if len(aceitas) < len(lote):
+            lote = lote.selecionar(aceitas)
+        if agregador_controle is not None:
+            agregador_controle.adicionar_lote(lote)
+        if manter_faturas:
+            all_extracted_data.adicionar_lote(lote)
+
+    # OCR opcional das páginas sem texto (executado em paralelo, resolvido ao final)
+    encerrar_ocr = False
+    if ocr_servico is None and configuracoes["ocr_ativo"]:
+        ocr_servico = ServicoOCR(configuracoes["ocr_processos"],
+                                 configuracoes["ocr_idioma"],
+                                 configuracoes["ocr_dpi"],
+                                 ocr_cache_path,
+                                 logger_func)
+        encerrar_ocr = True
+    ocr_pendentes = []
+
+    def verificar_arquivo_duplicado(pdf_path, pdf_bytes):
+        return verificar_arquivo_duplicado_indice(indice_duplicatas, pdf_path, pdf_bytes, logger_func)
+
+    if perfis_extracao is None:
+        perfis_extracao = PerfisExtracao()
+
+    # Tempo máximo de análise de cada bloco de fatura (0 = sem limite)
+    tempo_limite_bloco = configuracoes["tempo_limite_bloco_ms"] / 1000 or None
+
+    processos = max(1, configuracoes["processos_extracao"])
+    isolar = extracao_isolada(configuracoes)
+    if (processos > 1 and len(pdf_files) > 1 or isolar) and pdf_files and not paginas_por_pdf:
+        # --- Extração em paralelo, com despacho dos maiores PDFs primeiro ---
+        ordem = planejar_ordem_execucao(pdf_files, pdf_page_counts, pdf_sizes)
+        orcamento_memoria = configuracoes["memoria_extracao_mb"] * 1024 * 1024
+        if isolar:
+            limites = [f"{configuracoes['tempo_limite_pdf_s']} s" if configuracoes["tempo_limite_pdf_s"] else "",
+                       f"{configuracoes['memoria_limite_pdf_mb']} MB" if configuracoes["memoria_limite_pdf_mb"] else ""]
+            logger_func(f"Extração em {processos} processo(s) isolado(s), com limite de {' e '.join(filter(None, limites))} por PDF.", "INFO")
+        else:
+            logger_func(f"Extração em paralelo com {processos} processos (maiores PDFs primeiro).", "INFO")
+
+        # Resultados por posição na seleção, para que o relatório final mantenha a ordem de seleção
+        resultados_por_indice = {}
+        proximo_indice = 0 # Próximo PDF (na ordem de seleção) a ser consolidado
+        em_execucao = {} # Future -> (índice, bytes do PDF, memória estimada)
+        memoria_em_uso = 0
+
+        def consolidar_prontos(todos=False):
+            """
+            Consolida, na ordem de seleção, os resultados já disponíveis (saída determinística).
+            Com 'todos' (cancelamento), consolida também os que aguardavam um PDF anterior não concluído.
+            """
+            nonlocal proximo_indice
+            while proximo_indice in resultados_por_indice or todos and resultados_por_indice:
+                if proximo_indice not in resultados_por_indice:
+                    proximo_indice = min(resultados_por_indice)
+                pdf_path, pdf_bytes, results, resultado_verificacao, paginas_sem_texto, estado = resultados_por_indice.pop(proximo_indice)
+                proximo_indice += 1
+                registrar_resultados(pdf_path, results)
+                pdfs_concluidos.add(pdf_path)
+                notificar_status(pdf_path, estado)
+                if resultado_verificacao is not None:
+                    all_valor_cobrado_results.append(registrar_valor_cobrado(pdf_path, resultado_verificacao, logger_func))
+                    if parcial is not None:
+                        parcial.registrar_valor_cobrado(pdf_path, all_valor_cobrado_results[-1])
+                for page_num in paginas_sem_texto:
+                    if cancelado():
+                        registrar_nao_processado(pdf_path, page_num, "não processado (OCR pendente)")
+                        continue
+                    pedido = ocr_servico.submeter(pdf_path, pdf_bytes, page_num)
+                    if pedido is not None:
+                        ocr_pendentes.append((pdf_path, page_num, pedido))
+
+        def coletar_concluidos(aguardar):
+            nonlocal memoria_em_uso
+            if not em_execucao:
+                return
+            # Com 'cancelamento', a espera é fracionada para que o pedido seja atendido prontamente
+            espera = (0.1 if cancelamento is not None else None) if aguardar else 0
+            concluidos, _ = concurrent.futures.wait(
+                list(em_execucao), timeout=espera,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for pedido in concluidos:
+                indice, pdf_bytes, memoria_estimada = em_execucao.pop(pedido)
+                memoria_em_uso -= memoria_estimada
+                pdf_path = pdf_files[indice]
+                estado = "concluido"
+                try:
+                    results, resultado_verificacao, logs, paginas_sem_texto, perfis_alterados = pedido.result()
+                except LimiteExtracaoExcedido as e:
+                    # O processo do PDF foi encerrado; os demais PDFs seguem normalmente
+                    limite_msg = f"{nome_pdf(pdf_path)}: {e}. A extração do arquivo foi interrompida."
+                    logger_func(limite_msg, "ERROR", "PDF_LIMITE_EXCEDIDO", pdf=nome_pdf(pdf_path))
+                    results = [{"error": limite_msg, "Observação": limite_msg, "Numero da Pagina": nome_pdf(pdf_path), "UC": "N/A"}]
+                    resultado_verificacao, logs, paginas_sem_texto, perfis_alterados = None, ([], {}), [], {}
+                    estado = "falhou"
+                except Exception as e:
+                    critical_error_msg = f"Erro crítico ao processar {nome_pdf(pdf_path)}: {e}"
+                    logger_func(critical_error_msg, "CRITICAL_ERROR")
+                    results = [{"error": critical_error_msg, "Numero da Pagina": nome_pdf(pdf_path), "UC": "N/A"}]
+                    resultado_verificacao, logs, paginas_sem_texto, perfis_alterados = None, ([], {}), [], {}
+                    estado = "falhou"
+                repassar_registros_log(logger_func, *logs)
+                perfis_extracao.mesclar(perfis_alterados)
+                # Os bytes só são mantidos se ainda forem necessários para o OCR
+                resultados_por_indice[indice] = (pdf_path, pdf_bytes if paginas_sem_texto else None, results, resultado_verificacao, paginas_sem_texto,
+                                                 estado)
+                avancar_progresso(pdf_page_counts.get(pdf_path, 1))
+            consolidar_prontos()
+
+        prefetch = PrefetchPDF([pdf_files[i] for i in ordem],
+                               configuracoes["prefetch_profundidade"],
+                               configuracoes["prefetch_memoria_mb"] * 1024 * 1024,
+                               logger_func)
+
+        executor = executor_extracao
+        if executor is None:
+            executor = criar_executor_extracao(configuracoes, df_base)
+        try:
+            for indice, (pdf_path, pdf_bytes) in zip(ordem, prefetch):
+                if cancelado():
+                    break
+                duplicate_item = verificar_arquivo_duplicado(pdf_path, pdf_bytes)
+                if duplicate_item is not None:
+                    resultados_por_indice[indice] = (pdf_path, None, [duplicate_item], None, [], "duplicado")
+                    avancar_progresso(pdf_page_counts.get(pdf_path, 1))
+                    consolidar_prontos()
+                    continue
+
+                # Respeita o limite de processos e o orçamento de memória (ao menos um PDF sempre executa)
+                memoria_estimada = pdf_sizes.get(pdf_path, 0) * FATOR_MEMORIA_EXTRACAO
+                coletar_concluidos(aguardar=False)
+                while em_execucao and not cancelado() and (len(em_execucao) >= processos or memoria_em_uso + memoria_estimada > orcamento_memoria):
+                    coletar_concluidos(aguardar=True)
+                if cancelado():
+                    break
+
+                logger_func(f"Processando PDF: {nome_pdf(pdf_path)}", "INFO")
+                notificar_status(pdf_path, "processando")
+                pedido = executor.submit(_extrair_pdf_worker, pdf_path, pdf_bytes, ocr_servico is not None,
+                                         configuracoes["nivel_log"], tempo_limite_bloco, perfis_extracao.perfis)
+                em_execucao[pedido] = (indice, pdf_bytes, memoria_estimada)
+                memoria_em_uso += memoria_estimada
+
+            while em_execucao and not cancelado():
+                coletar_concluidos(aguardar=True)
+            if cancelado():
+                # Os PDFs em execução não são aguardados; os já concluídos entram no relatório parcial
+                coletar_concluidos(aguardar=False)
+                for pedido in em_execucao:
+                    pedido.cancel()
+                consolidar_prontos(todos=True)
+        finally:
+            prefetch.cancelar()
+            if executor_extracao is None:
+                executor.shutdown(wait=not cancelado(), cancel_futures=True)
+    else:
+        # Estágios em threads ligados por filas limitadas; aqui fica o estágio final (acumular)
+        faturas_no_pdf = 0 # Resultados do PDF atual (os eventos de um PDF chegam em sequência)
+        paginas_no_pdf = 0
+        pdf_atual = None
+        for evento in executar_estagios_extracao(pdf_files, df_base, configuracoes, logger_func,
+                                                 verificar_arquivo_duplicado, ocr_servico, ocr_pendentes, paginas_por_pdf,
+                                                 perfis_extracao, cancelamento=cancelamento):
+            tipo, pdf_path = evento[0], evento[1]
+            if tipo == "duplicado":
+                registrar_resultados(pdf_path, [evento[2]])
+                avancar_progresso(pdf_page_counts.get(pdf_path, 1))
+                pdfs_concluidos.add(pdf_path)
+                notificar_status(pdf_path, "duplicado")
+                continue
+            if pdf_path != pdf_atual:
+                pdf_atual = pdf_path
+                notificar_status(pdf_path, "processando")
+            if tipo == "faturas":
+                results = evento[3]
+                faturas_no_pdf += len(results)
+                paginas_no_pdf += 1
+                registrar_resultados(pdf_path, results)
+                avancar_progresso(1)
+            elif tipo == "fim_pdf":
+                _, _, erro_item, paginas_restantes, paginas_enviadas_ocr, verificacao = evento
+                if erro_item is not None:
+                    registrar_resultados(pdf_path, [erro_item])
+                    avancar_progresso(paginas_restantes)
+                elif not faturas_no_pdf and not paginas_enviadas_ocr:
+                    registrar_log(logger_func, "WARNING", "PDF_SEM_FATURAS",
+                                  "Nenhum dado de fatura (com UC identificável) ou erro relevante encontrado em {pdf} após processar todas as páginas com texto extraível.",
+                                  pdf=nome_pdf(pdf_path))
+                all_valor_cobrado_results.append(registrar_valor_cobrado(pdf_path, verificacao, logger_func))
+                if parcial is not None:
+                    parcial.registrar_valor_cobrado(pdf_path, all_valor_cobrado_results[-1])
+                pdfs_concluidos.add(pdf_path)
+                notificar_status(pdf_path, "falhou" if erro_item is not None else "concluido")
+                faturas_no_pdf = 0
+                paginas_no_pdf = 0
+                pdf_atual = None
+        if pdf_atual is not None and paginas_no_pdf:
+            paginas_interrompidas[pdf_atual] = paginas_no_pdf
+
+    if ocr_servico is not None:
+        if ocr_pendentes:
+            logger_func(f"Aguardando OCR de {len(ocr_pendentes)} página(s) sem texto extraível...", "INFO")
+        for pdf_path, page_num, pedido in ocr_pendentes:
+            pdf_name = nome_pdf(pdf_path)
+            if cancelado() and not pedido.done():
+                pedido.cancel()
+                registrar_nao_processado(pdf_path, page_num, "não processado (OCR pendente)")
+                notificar_status(pdf_path, "concluido")
+                continue
+            try:
+                page_text = pedido.result()
+            except Exception as e:
+                ocr_msg = f"Falha no OCR da página {page_num + 1} de {pdf_name}: {e}"
+                logger_func(ocr_msg, "ERROR")
+                registrar_resultados(pdf_path, [{"error": ocr_msg, "Observação": ocr_msg, "Numero da Pagina": f"{pdf_name} (Pág. {page_num + 1})", "UC": "N/A"}],
+                                     ocr=True)
+                notificar_status(pdf_path, "concluido")
+                continue
+            if not page_text or not page_text.strip():
+                logger_func(f"OCR não reconheceu texto na página {page_num + 1} de {pdf_name}.", "WARNING")
+                continue
+            logger_func(f"OCR concluído para a página {page_num + 1} de {pdf_name}.", "INFO")
+            registrar_resultados(pdf_path, extract_faturas_from_page_text(page_text, page_num, df_base, pdf_name, logger_func,
+                                                                          tempo_limite_bloco), ocr=True)
+            notificar_status(pdf_path, "concluido")
+        if encerrar_ocr:
+            ocr_servico.encerrar(aguardar=not cancelado())
+        else:
+            ocr_servico.salvar_cache()
+    perfis_extracao.salvar()
+
+    if cancelado():
+        nao_processados = [pdf_path for pdf_path in pdf_files if pdf_path not in pdfs_concluidos]
+        for pdf_path in nao_processados:
+            if pdf_path in paginas_interrompidas:
+                registrar_nao_processado(pdf_path, observacao=(
+                    f"não processado por completo: extração interrompida após {paginas_interrompidas[pdf_path]} página(s), "
+                    f"cujas faturas constam do relatório"))
+            else:
+                registrar_nao_processado(pdf_path)
+            notificar_status(pdf_path, "nao_processado")
+        registrar_log(logger_func, "WARNING", "EXTRACAO_CANCELADA",
+                      "Extração cancelada pelo usuário: {concluidos} de {total} PDF(s) concluído(s); {nao_processados} não processado(s).",
+                      concluidos=len(pdf_files) - len(nao_processados), total=len(pdf_files), nao_processados=len(nao_processados))
+
+    indice_duplicatas.informar_pdfs_sem_referencia()
+    return all_extracted_data, error_items, all_valor_cobrado_results
+
+def caminho_relatorio(output_dir, nome_arquivo=None):
+    """Caminho do relatório Excel na pasta de saída (padrão: 'DD.MM.AAAA Repasse-Celesc.xlsx')."""
+    if not nome_arquivo:
+        nome_arquivo = f"{datetime.today().strftime('%d.%m.%Y')} Repasse-Celesc.xlsx"
+    return os.path.join(output_dir, nome_arquivo)
+
+@contextmanager
+def gravacao_atomica(caminho, modo='wb', encoding=None):
+    """
+    Abre um arquivo temporário ('caminho' + '.tmp') para escrita e, ao final sem erros, o renomeia para
+    'caminho' (os.replace); em caso de erro, o temporário é removido. Uma falha durante a gravação
+    nunca deixa um arquivo de saída pela metade (o anterior, se existir, é mantido).
+    """
+    temp_path = caminho + ".tmp"
+    try:
+        with open(temp_path, modo, encoding=encoding) as f:
+            yield f
+        os.replace(temp_path, caminho)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+def formatar_aba_relatorio(worksheet, df_parte):
+    """Formata uma aba 'Relatorio': cabeçalho congelado, moeda, destaque de valores zerados e largura das colunas."""
+    worksheet.freeze_panes = 'A2' # Congela a linha de cabeçalho
+    yellow_fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
+
+    # Alinhar à direita a coluna 'Numero da Pagina'
+    try:
+        col_index = COLUNAS_RELATORIO.index("Numero da Pagina") + 1
+        col_letter = get_column_letter(col_index)
+        for row in range(2, worksheet.max_row + 1):
+            cell = worksheet[f"{col_letter}{row}"]
+            cell.alignment = Alignment(horizontal="right")
+    except (ValueError, IndexError):
+        pass # Ignora se a coluna não for encontrada
+
+    # Formata colunas de moeda e aplica destaque condicional
+    for col_name_df in COLUNAS_MOEDA_RELATORIO:
+        if col_name_df in df_parte.columns:
+            excel_col_idx = COLUNAS_RELATORIO.index(col_name_df) + 1
+            col_letter = get_column_letter(excel_col_idx)
+
+            for row_idx_in_final_df in range(df_parte.shape[0]):
+                row_excel_num = row_idx_in_final_df + 2
+                cell = worksheet[f'{col_letter}{row_excel_num}']
+                if isinstance(cell.value, (int, float)):
+                    cell.number_format = 'R$ #,##0.00'
+                    if cell.value == 0 and col_name_df in ["LÍQUIDO (R$)", "COSIP (R$)"]:
+                        cell.fill = yellow_fill
+
+    # Ajusta largura das colunas
+    for col_idx_df, col_name_df in enumerate(COLUNAS_RELATORIO):
+        excel_col_idx = col_idx_df + 1
+        column_letter_val = get_column_letter(excel_col_idx)
+        max_len = len(str(worksheet[f'{column_letter_val}1'].value))
+
+        for cell in worksheet[column_letter_val]:
+            if cell.value:
+                cell_str_val = str(cell.value)
+                if col_name_df in COLUNAS_MOEDA_RELATORIO and isinstance(cell.value, (int, float)):
+                    cell_str_val = f"R$ {cell.value:,.2f}"
+                max_len = max(max_len, len(cell_str_val))
+
+        adjusted_width = (max_len + 2) if max_len > 0 else 12
+        if col_name_df == "UC":
+             adjusted_width = max(adjusted_width, 15)
+        worksheet.column_dimensions[column_letter_val].width = adjusted_width
+
+def destacar_totais_liquido(worksheet, logger_func):
+    """Destaca em amarelo o LÍQUIDO da linha 'Totais:' quando os valores da conta não conferem."""
+    yellow_fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
+    totais_row_index_in_sheet = -1
+    for r_idx in range(worksheet.max_row, 1, -1):
+        if worksheet[f'A{r_idx}'].value == "Totais:":
+            totais_row_index_in_sheet = r_idx
+            break
+
+    if totais_row_index_in_sheet != -1:
+        col_letter_highlight = get_column_letter(COLUNAS_RELATORIO.index("LÍQUIDO (R$)") + 1)
+        worksheet[f'{col_letter_highlight}{totais_row_index_in_sheet}'].fill = yellow_fill
+        logger_func(f"Célula {col_letter_highlight}{totais_row_index_in_sheet} ({worksheet.title}, Totais, LÍQUIDO) destacada em amarelo.", "INFO")
+    else:
+        logger_func("AVISO: Não foi possível localizar a linha 'Totais' para destacar o valor.", "WARNING")
+
+def gerar_arquivos_txt(df_controle, txt_output_dir, logger_func):
+    """Gera os arquivos TXT de rateio (Cosip, Energia 1,2% e 4,8%) a partir da aba 'Controle' (sem a linha de totais)."""
+    os.makedirs(txt_output_dir, exist_ok=True)
+    logger_func(f"Pasta para arquivos TXT criada em: {txt_output_dir}", "INFO")
+
+    # Mapeamento de nome de arquivo para coluna de dados
+    txt_map = {
+        "Rateio Cosip.txt": "COSIP (R$)",
+        "Rateio Energia 1.2.txt": "Energia (1,2%)",
+        "Rateio Energia 4.8.txt": "Energia (4,8%)"
+    }
+
+    # Itera sobre o mapa para gerar cada arquivo TXT
+    for filename, data_column in txt_map.items():
+        txt_file_path = os.path.join(txt_output_dir, filename)
+        lines_to_write = []
+
+        # Itera sobre as linhas do DataFrame 'Controle' (antes de adicionar totais)
+        for index, row in df_controle.iterrows():
+            centro_custo = row['Centro de Custo']
+            value = row[data_column]
+
+            # Processa apenas se o valor não for nulo e for diferente de zero
+            if pd.notna(value) and value != 0:
+                # Formatação do valor numérico (centavos -> "1234,56")
+                formatted_value = formatar_centavos_txt(value)
+
+                if pd.notna(centro_custo) and str(centro_custo).strip():
+                    lines_to_write.append(f"{centro_custo}#SEP#{formatted_value}")
+
+        # Escreve as linhas no arquivo
+        if lines_to_write:
+            with gravacao_atomica(txt_file_path, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines_to_write))
+            logger_func(f"Arquivo '{filename}' gerado com {len(lines_to_write)} linhas.", "SUCCESSO")
+        else:
+            logger_func(f"Nenhum dado válido para gerar o arquivo '{filename}'.", "INFO")
+
+class AgregadorControle:
+    """
+    Somas da aba 'Controle' mantidas de forma incremental: para cada (Centro de Custo, Subseção),
+    o conjunto de UCs e as somas de COSIP e de Energia/Retenção 1,2% e 4,8%.
+    As faturas são somadas à medida que são extraídas, com memória proporcional à quantidade
+    de centros de custo (e não de faturas). Mantém também os totais das colunas de moeda do
+    'Relatorio', para a conferência com o 'TOTAL conta' quando a aba 'Relatorio' não é gerada.
+    """
+
+    COLUNAS_SOMA = ['COSIP (R$)', 'Energia (1,2%)', 'Retenção(1,2%)', 'Energia (4,8%)', 'Retenção(4,8%)']
+    COLUNAS = ['UC', 'Centro de Custo', 'Subseção'] + COLUNAS_SOMA
+    LINHAS_POR_SOMA = 50000 # Faturas em lotes (ver adicionar_lote) acumuladas antes de serem somadas
+
+    def __init__(self, faturas=()):
+        self.grupos = {} # (Centro de Custo, Subseção) -> (conjunto de UCs, {coluna: soma})
+        self.totais = dict.fromkeys(COLUNAS_MOEDA_RELATORIO, 0)
+        self.faturas = 0
+        self.lotes_pendentes = []
+        self.linhas_pendentes = 0
+        for fatura_data in faturas:
+            self.adicionar(fatura_data)
+
+    def adicionar(self, fatura_data):
+        """
+        Soma uma fatura ou uma linha já agrupada da aba 'Controle' (com as UCs separadas por quebra de linha).
+        Faturas sem Centro de Custo ou Subseção são ignoradas.
+        """
+        centro_custo, subsecao = fatura_data.get('Centro de Custo'), fatura_data.get('Subseção')
+        if pd.isna(centro_custo) or pd.isna(subsecao):
+            return
+        grupo = self.grupos.get((centro_custo, subsecao))
+        if grupo is None:
+            grupo = self.grupos[(centro_custo, subsecao)] = (set(), dict.fromkeys(self.COLUNAS_SOMA, 0))
+        ucs, somas = grupo
+        ucs.update(str(fatura_data.get('UC')).split('\n'))
+        for coluna in self.COLUNAS_SOMA:
+            somas[coluna] += fatura_data.get(coluna) or 0
+        for coluna in COLUNAS_MOEDA_RELATORIO:
+            self.totais[coluna] += fatura_data.get(coluna) or 0
+        self.faturas += 1
+
+    def adicionar_lote(self, lote):
+        """
+        Soma as faturas de um LoteFaturas. Os lotes são acumulados e somados juntos, coluna a coluna,
+        a cada LINHAS_POR_SOMA faturas (ou em somar_pendentes), sem materializar as faturas.
+        """
+        if len(lote):
+            self.lotes_pendentes.append(lote)
+            self.linhas_pendentes += len(lote)
+            if self.linhas_pendentes >= self.LINHAS_POR_SOMA:
+                self.somar_pendentes()
+
+    def somar_pendentes(self):
+        """Soma os lotes acumulados por adicionar_lote (chamado antes de consultar 'totais', 'faturas' ou 'grupos')."""
+        if not self.lotes_pendentes:
+            return
+        lote = LoteFaturas.concatenar(self.lotes_pendentes)
+        self.lotes_pendentes, self.linhas_pendentes = [], 0
+        j_uc, j_cc, j_sub = (LoteFaturas.COLUNAS_TEXTO.index(coluna) for coluna in ("UC", "Centro de Custo", "Subseção"))
+        valores_uc, valores_cc, valores_sub = lote.valores[j_uc], lote.valores[j_cc], lote.valores[j_sub]
+
+        # Ordena as faturas por (Centro de Custo, Subseção) e soma cada grupo de uma vez
+        pares = lote.codigos[:, j_cc].astype(np.int64) * len(valores_sub) + lote.codigos[:, j_sub]
+        ordem = np.argsort(pares, kind="stable")
+        pares = pares[ordem]
+        inicios = np.flatnonzero(np.r_[True, pares[1:] != pares[:-1]])
+        somas = np.add.reduceat(lote.centavos[ordem].astype(np.int64), inicios, axis=0).tolist()
+        ucs_ordenadas = lote.codigos[ordem, j_uc]
+        fins = np.r_[inicios[1:], len(pares)].tolist()
+        for g, (inicio, fim) in enumerate(zip(inicios.tolist(), fins)):
+            par = int(pares[inicio])
+            centro_custo, subsecao = valores_cc[par // len(valores_sub)], valores_sub[par % len(valores_sub)]
+            if pd.isna(centro_custo) or pd.isna(subsecao):
+                continue
+            grupo = self.grupos.get((centro_custo, subsecao))
+            if grupo is None:
+                grupo = self.grupos[(centro_custo, subsecao)] = (set(), dict.fromkeys(self.COLUNAS_SOMA, 0))
+            ucs, somas_grupo = grupo
+            ucs.update(str(valores_uc[codigo]) for codigo in np.unique(ucs_ordenadas[inicio:fim]).tolist())
+            somas_linha = dict(zip(LoteFaturas.COLUNAS_CENTAVOS, somas[g]))
+            for coluna in self.COLUNAS_SOMA:
+                somas_grupo[coluna] += somas_linha[coluna]
+            for coluna in COLUNAS_MOEDA_RELATORIO:
+                self.totais[coluna] += somas_linha[coluna]
+            self.faturas += fim - inicio
+
+    def dataframe(self):
+        """Linhas da aba 'Controle' (sem a linha de totais), ordenadas por Centro de Custo e Subseção."""
+        self.somar_pendentes()
+        try:
+            chaves = sorted(self.grupos)
+        except TypeError: # Centros de custo de tipos diferentes (ex: texto e número)
+            chaves = sorted(self.grupos, key=lambda chave: (str(chave[0]), str(chave[1])))
+        linhas = []
+        for centro_custo, subsecao in chaves:
+            ucs, somas = self.grupos[(centro_custo, subsecao)]
+            linha = {'UC': '\n'.join(sorted(ucs)), 'Centro de Custo': centro_custo, 'Subseção': subsecao}
+            linha.update(somas)
+            linhas.append(linha)
+        return pd.DataFrame(linhas, columns=self.COLUNAS)
+
+def adicionar_totais_controle(df_controle):
+    """Acrescenta à aba 'Controle' uma linha em branco e a linha 'Totais:'."""
+    linha_em_branco = pd.DataFrame([ {col: '' for col in df_controle.columns} ])
+    linha_totais = pd.DataFrame([{
+        'UC': 'Totais:',
+        'Centro de Custo': '',
+        'Subseção': '',
+        'COSIP (R$)': df_controle['COSIP (R$)'].sum(),
+        'Energia (1,2%)': df_controle['Energia (1,2%)'].sum(),
+        'Retenção(1,2%)': df_controle['Retenção(1,2%)'].sum(),
+        'Energia (4,8%)': df_controle['Energia (4,8%)'].sum(),
+        'Retenção(4,8%)': df_controle['Retenção(4,8%)'].sum()
+    }])
+    return pd.concat([df_controle, linha_em_branco, linha_totais], ignore_index=True)
+
+def gravar_aba_controle(writer, df_controle):
+    """Grava e formata a aba 'Controle' (moeda, quebra de linha das UCs e largura das colunas)."""
+    converter_colunas_centavos_para_reais(df_controle, COLUNAS_MOEDA_CONTROLE).to_excel(writer, index=False, sheet_name='Controle')
+    worksheet_controle = writer.sheets['Controle']
+    worksheet_controle.freeze_panes = 'A2'
+
+    # Formatar colunas para a aba 'Controle'
+    for col_idx, col_name in enumerate(df_controle.columns):
+        col_letter = get_column_letter(col_idx + 1)
+        for row_num in range(2, worksheet_controle.max_row + 1):
+            cell = worksheet_controle[f'{col_letter}{row_num}']
+            if col_idx == 0: worksheet_controle.row_dimensions[row_num].height = 15
+            # Formata colunas de moeda
+            if col_name in COLUNAS_MOEDA_CONTROLE and isinstance(cell.value, (int, float)):
+                cell.number_format = 'R$ #,##0.00'
+            # Aplica quebra de linha na coluna UC
+            if col_name == 'UC' and cell.value and isinstance(cell.value, str) and '\n' in cell.value:
+                cell.alignment = Alignment(wrap_text=True, vertical='top')
+
+    # Ajustar largura das colunas para a aba 'Controle'
+    for col_idx, col_name in enumerate(df_controle.columns):
+        column_letter = get_column_letter(col_idx + 1)
+        max_len = len(str(worksheet_controle[f'{column_letter}1'].value))
+        for cell in worksheet_controle[column_letter]:
+            if cell.value:
+                cell_str = str(cell.value)
+                if col_name == 'UC':
+                    # Para a coluna UC, a largura é baseada na linha mais longa (UC mais longa)
+                    lines = cell_str.split('\n')
+                    current_max_line_len = max(len(line) for line in lines) if lines else 0
+                    max_len = max(max_len, current_max_line_len)
+                else:
+                    # Para outras colunas, usa o comprimento total da string
+                    if col_name in COLUNAS_MOEDA_CONTROLE and isinstance(cell.value, (int, float)):
+                        cell_str = f"R$ {cell.value:,.2f}"
+                    max_len = max(max_len, len(cell_str))
+        adjusted_width = (max_len + 2) if max_len > 0 else 12
+        worksheet_controle.column_dimensions[column_letter].width = adjusted_width
+
+def gravar_abas_erros(writer, df_errors):
+    """Grava a aba 'Relatorio_Erros' (dividida em 'Relatorio_Erros (2)', ... se exceder o limite de linhas)."""
+    for numero_aba, df_errors_parte in enumerate(dividir_em_partes(df_errors, LIMITE_LINHAS_EXCEL - 1), start=1):
+        nome_aba_erros = nome_parte('Relatorio_Erros', numero_aba)
+        converter_colunas_centavos_para_reais(df_errors_parte, COLUNAS_MOEDA_RELATORIO).to_excel(writer, index=False, sheet_name=nome_aba_erros)
+        worksheet_errors = writer.sheets[nome_aba_erros]
+        worksheet_errors.freeze_panes = 'A2' # Congela a linha de cabeçalho
+        for col_idx_df, col_name_df in enumerate(COLUNAS_ERROS):
+            excel_col_idx = col_idx_df + 1
+            column_letter_val = get_column_letter(excel_col_idx)
+            max_len = len(str(worksheet_errors[f'{column_letter_val}1'].value))
+            for cell in worksheet_errors[column_letter_val]:
+                 if cell.value:
+                    max_len = max(max_len, len(str(cell.value)))
+            adjusted_width = (max_len + 2) if max_len > 0 else 12
+            if col_name_df == "Observação":
+                adjusted_width = min(adjusted_width, 80) # Limita a largura da coluna de observação
+            worksheet_errors.column_dimensions[column_letter_val].width = adjusted_width
+
+def calcular_dados_relatorio(all_extracted_data, all_valor_cobrado_results, logger_func=None):
+    """
+    Monta os dados da aba 'Relatorio': as faturas (colunas COLUNAS_RELATORIO, moeda em centavos int64),
+    a linha 'Totais:' e a linha 'TOTAL conta:' (soma do 'Valor Cobrado' verificado de cada PDF).
+    'all_extracted_data' pode ser uma TabelaFaturas, uma lista de faturas ou um DataFrame.
+    Retorna (faturas, linha 'Totais:', linha 'TOTAL conta:'); as linhas de resumo ficam vazias sem faturas ou sem PDFs.
+    """
+    # --- Cria o DataFrame completo com todos os dados extraídos ---
+    if isinstance(all_extracted_data, TabelaFaturas):
+        df_full_data = all_extracted_data.dataframe() # Concatena os lotes coluna a coluna
+    elif isinstance(all_extracted_data, pd.DataFrame):
+        df_full_data = all_extracted_data
+    else:
+        df_full_data = pd.DataFrame(list(all_extracted_data))
+
+    # --- Prepara o DataFrame para a aba 'Relatorio' (apenas com as colunas originais) ---
+    df_extracted_data = pd.DataFrame()
+    if not df_full_data.empty:
+        df_extracted_data = df_full_data.reindex(columns=COLUNAS_RELATORIO)
+
+        # Formata colunas de moeda para cálculo
+        for col_name in COLUNAS_MOEDA_RELATORIO:
+            if col_name in df_extracted_data.columns:
+                df_extracted_data[col_name] = pd.to_numeric(df_extracted_data[col_name], errors='coerce').fillna(0).astype('int64')
+
+    # --- Create TOTAL row for extracted data ('Relatorio') ---
+    df_total_row = pd.DataFrame() # Initialize empty
+    if not df_extracted_data.empty:
+        total_row_data = {"UC": "Totais:"}
+        for col in COLUNAS_RELATORIO:
+            if col in COLUNAS_MOEDA_RELATORIO:
+                total_row_data[col] = df_extracted_data[col].sum()
+            elif col != "UC":
+                total_row_data[col] = ""
+        df_total_row = pd.DataFrame([total_row_data]).reindex(columns=COLUNAS_RELATORIO)
+
+    # --- Create Valor Cobrado summary row ---
+    df_cobrado_summary_row = pd.DataFrame() # Initialize empty
+    if all_valor_cobrado_results:
+        total_valor_cobrado_sum = sum(res.get("liquido_total_verified", 0) for res in all_valor_cobrado_results if res.get("liquido_total_verified") is not None)
+
+        cobrado_summary_row_data = {col: "" for col in COLUNAS_RELATORIO}
+        cobrado_summary_row_data["UC"] = "TOTAL conta:"
+        cobrado_summary_row_data["LÍQUIDO (R$)"] = total_valor_cobrado_sum
+        df_cobrado_summary_row = pd.DataFrame([cobrado_summary_row_data]).reindex(columns=COLUNAS_RELATORIO)
+        if logger_func:
+            logger_func(f"Soma total de 'Valor Cobrado Verificado': {centavos_para_reais(total_valor_cobrado_sum):.2f}", "INFO")
+
+    return df_extracted_data, df_total_row, df_cobrado_summary_row
+
+def gerar_relatorio(all_extracted_data, error_items, all_valor_cobrado_results, output_file_path,
+                    configuracoes, gerar_controle, gerar_txt, logger_func, agregador_controle=None,
+                    gerar_aba_relatorio=True, progresso_func=None):
+    """
+    Gera o relatório Excel (abas 'Relatorio', 'Controle' e 'Relatorio_Erros') e, opcionalmente,
+    os arquivos TXT de rateio. Não depende da interface gráfica.
+    'agregador_controle' (AgregadorControle já somado durante a extração) é usado para a aba 'Controle'
+    no lugar das faturas; sem ele, as faturas são somadas aqui. Com 'gerar_aba_relatorio' False,
+    a aba 'Relatorio' não é gravada e a conferência com o 'TOTAL conta' usa os totais do agregador.
+    'progresso_func', se informado, é chamado após a gravação de cada aba como
+    progresso_func(nome da aba, linhas da aba, linhas gravadas, total de linhas a gravar).
+    Os TXT e cada arquivo Excel são gravados em paralelo (os TXT ficam prontos logo, sem esperar o Excel
+    formatado), cada um por um arquivo temporário renomeado ao final (ver gravacao_atomica).
+    Retorna um dicionário com o resumo: arquivos gerados, quantidade de faturas e erros,
+    totais calculado e da conta (centavos) e se os valores divergem.
+    Erros ao gravar o Excel são propagados; um erro nos TXT é registrado em 'falha_txt'.
+    """
+    output_filename = os.path.basename(output_file_path)
+    falha_txt = None
+
+    linhas_gravadas = 0
+    lock_progresso = threading.Lock()
+
+    def aba_gravada(nome_aba, linhas_aba):
+        nonlocal linhas_gravadas
+        with lock_progresso:
+            linhas_gravadas += linhas_aba
+            logger_func(f"Aba '{nome_aba}' gravada: {linhas_aba} linha(s) ({linhas_gravadas} de {linhas_total}).", "INFO")
+            if progresso_func:
+                progresso_func(nome_aba, linhas_aba, linhas_gravadas, linhas_total)
+
+    def gravar_txt(df_controle):
+        """Retorna None ou a mensagem do erro na geração dos TXT."""
+        try:
+            logger_func("Iniciando geração de arquivos TXT...", "INFO")
+            # Cria a pasta de saída para os TXTs com base no nome do Excel
+            txt_folder_name = os.path.splitext(output_filename)[0]
+            gerar_arquivos_txt(df_controle, os.path.join(os.path.dirname(output_file_path), txt_folder_name), logger_func)
+        except Exception as e:
+            logger_func(f"Erro CRÍTICO ao gerar arquivos TXT: {e}", "ERRO_CRITICO")
+            return str(e)
+        return None
+
+    # Os artefatos (TXT e cada arquivo Excel) são independentes e gravados em paralelo a partir dos mesmos dados;
+    # ao sair do bloco, todos terminaram
+    pedido_txt = None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=ARTEFATOS_SIMULTANEOS, thread_name_prefix="artefato") as artefatos:
+        # --- PREPARAR DADOS PARA A ABA 'CONTROLE' (SE SOLICITADO) ---
+        df_controle = pd.DataFrame()
+        if agregador_controle is None and (gerar_controle or not gerar_aba_relatorio):
+            agregador_controle = AgregadorControle(all_extracted_data)
+        if agregador_controle is not None:
+            agregador_controle.somar_pendentes()
+        if gerar_controle:
+            logger_func("Preparando dados para a aba 'Controle'...", "INFO")
+            df_controle = agregador_controle.dataframe()
+            if not df_controle.empty:
+                if gerar_txt:
+                    # Os TXT ficam prontos sem esperar a gravação (mais lenta) do Excel formatado
+                    pedido_txt = artefatos.submit(gravar_txt, df_controle)
+
+                # Adiciona a linha de totais à aba 'Controle'
+                df_controle = adicionar_totais_controle(df_controle)
+            else:
+                logger_func("AVISO: Nenhum dado extraído para gerar a aba 'Controle'.", "WARNING")
+
+        df_extracted_data, df_total_row, df_cobrado_summary_row = calcular_dados_relatorio(
+            all_extracted_data if gerar_aba_relatorio else (), all_valor_cobrado_results, logger_func)
+
+        # --- Divide o relatório em abas/arquivos (os totais já consideram todas as faturas) ---
+        linhas_por_aba = min(configuracoes["linhas_por_aba"], LIMITE_LINHAS_EXCEL - LINHAS_RESERVADAS_RESUMO)
+        if linhas_por_aba < 1:
+            linhas_por_aba = CONFIGURACOES_PADRAO["linhas_por_aba"]
+        partes_relatorio = []
+        aba_totais = None # Sem aba 'Relatorio', não há linha 'Totais:'
+        if gerar_aba_relatorio:
+            partes_relatorio = montar_partes_relatorio(df_extracted_data, [df_total_row, df_cobrado_summary_row],
+                                                       COLUNAS_RELATORIO, linhas_por_aba)
+        arquivos_relatorio = distribuir_partes_em_arquivos(output_file_path, partes_relatorio, configuracoes["abas_por_arquivo"])
+        if gerar_aba_relatorio:
+            aba_totais = arquivos_relatorio[-1][1][-1][0] if partes_relatorio else "Relatorio" # Aba com a linha 'Totais:'
+        if len(partes_relatorio) > 1:
+            logger_func(f"Relatório com {len(df_extracted_data)} faturas dividido em {len(partes_relatorio)} abas 'Relatorio' "
+                        f"({linhas_por_aba} linhas por aba) em {len(arquivos_relatorio)} arquivo(s).", "INFO")
+
+        # --- Process df_errors ---
+        df_errors = pd.DataFrame()
+        if error_items:
+            df_errors = pd.DataFrame(error_items).reindex(columns=COLUNAS_ERROS)
+
+        # --- Comparação exata em centavos inteiros (Total Extraído vs Total da Fatura) ---
+        if gerar_aba_relatorio:
+            calculated_total_liquido = int(df_total_row['LÍQUIDO (R$)'].iloc[0]) if not df_total_row.empty else 0
+        else:
+            calculated_total_liquido = int(agregador_controle.totais["LÍQUIDO (R$)"])
+        account_total_liquido = int(df_cobrado_summary_row['LÍQUIDO (R$)'].iloc[0]) if not df_cobrado_summary_row.empty else 0
+        valores_divergentes = calculated_total_liquido != account_total_liquido
+        if valores_divergentes:
+            logger_func("Valores da conta não conferem! (Total Extraído vs Total da Fatura)", "WARNING")
+
+        # --- Save the Excel file ---
+        if not partes_relatorio and df_controle.empty and df_errors.empty:
+            logger_func("Nenhuma aba a gravar (sem 'Relatorio', 'Controle' ou erros); o Excel não foi gerado.", "WARNING")
+            arquivos_relatorio = []
+        linhas_total = sum(len(df_parte) for df_parte in partes_relatorio) + len(df_controle) + len(df_errors) if arquivos_relatorio else 0
+
+        def gravar_arquivo_excel(indice_arquivo, caminho_arquivo, abas_relatorio):
+            logger_func(f"Salvando relatório em: {caminho_arquivo}", "INFO")
+            with gravacao_atomica(caminho_arquivo) as arquivo, pd.ExcelWriter(arquivo, engine='openpyxl') as writer:
+                for nome_aba, df_parte in abas_relatorio:
+                    converter_colunas_centavos_para_reais(df_parte, COLUNAS_MOEDA_RELATORIO).to_excel(writer, index=False, sheet_name=nome_aba)
+                    worksheet = writer.sheets[nome_aba]
+                    formatar_aba_relatorio(worksheet, df_parte)
+
+                    # Destaca o LÍQUIDO da linha 'Totais:' (presente apenas na última aba) se os valores não conferirem
+                    if valores_divergentes and df_parte is partes_relatorio[-1]:
+                        destacar_totais_liquido(worksheet, logger_func)
+                    aba_gravada(nome_aba, len(df_parte))
+
+                # Os arquivos de continuação contêm apenas abas 'Relatorio'
+                if indice_arquivo > 0:
+                    return
+
+                # --- GRAVAR A ABA 'CONTROLE' (SE GERADA) ---
+                if not df_controle.empty:
+                    gravar_aba_controle(writer, df_controle)
+                    aba_gravada('Controle', len(df_controle))
+
+                if not df_errors.empty:
+                    gravar_abas_erros(writer, df_errors)
+                    aba_gravada('Relatorio_Erros', len(df_errors))
+
+        # Cada arquivo Excel é gravado por um trabalhador próprio; um erro é propagado após os demais terminarem
+        pedidos_excel = [artefatos.submit(gravar_arquivo_excel, indice_arquivo, caminho_arquivo, abas_relatorio)
+                         for indice_arquivo, (caminho_arquivo, abas_relatorio) in enumerate(arquivos_relatorio)]
+        for pedido in pedidos_excel:
+            pedido.result()
+        if pedido_txt is not None:
+            falha_txt = pedido_txt.result()
+
+    return {
+        "arquivo": output_file_path,
+        "arquivos": [caminho for caminho, _ in arquivos_relatorio],
+        "faturas": len(df_extracted_data) if gerar_aba_relatorio else agregador_controle.faturas,
+        "erros": len(df_errors),
+        "relatorio_vazio": not partes_relatorio if gerar_aba_relatorio else agregador_controle.faturas == 0,
+        "aba_totais": aba_totais,
+        "total_calculado": calculated_total_liquido,
+        "total_conta": account_total_liquido,
+        "valores_divergentes": valores_divergentes,
+        "falha_txt": falha_txt
+    }
+
+
+# --- API para Uso Embutido (ex: rotinas de ETL, sem interface gráfica) ---
+#
+# Exemplo:
+#     df_base = carregar_planilha_base("base/database.xlsx")
+#     resultado = ResultadoExtracao()
+#     for registro in extrair_registros(["C:/faturas", conteudo_pdf, open("fatura.pdf", "rb")], df_base):
+#         resultado.adicionar(registro) # ou tratar cada RegistroFatura, RegistroErro e RegistroPdf
+#     resultado.gravar("C:/saida/Relatorio.xlsx")
+
+# Atributos de RegistroFatura e as chaves correspondentes da fatura extraída (na ordem de LoteFaturas.COLUNAS)
+CAMPOS_REGISTRO_FATURA = (
+    ("uc", "UC"), ("centro_custo", "Centro de Custo"), ("subsecao", "Subseção"),
+    ("energia", "ENERGIA (R$)"), ("cosip", "COSIP (R$)"), ("valor_bruto", "Valor Bruto (R$)"),
+    ("retencao", "RETENÇÃO (R$)"), ("liquido", "LÍQUIDO (R$)"), ("numero_pagina", "Numero da Pagina"),
+    ("referencia", "Referência"),
+    ("energia_1_2", "Energia (1,2%)"), ("retencao_1_2", "Retenção(1,2%)"),
+    ("energia_4_8", "Energia (4,8%)"), ("retencao_4_8", "Retenção(4,8%)")
+)
+
+class RegistroFatura(namedtuple("RegistroFatura", ["pdf", "pagina"] + [campo for campo, _ in CAMPOS_REGISTRO_FATURA])):
+    """
+    Fatura extraída por extrair_registros. 'pagina' é o número da página (a partir de 1); os valores
+    monetários estão em centavos inteiros e 'numero_pagina' é a referência do relatório ('fatura.pdf (Pág. N)').
+    """
+    __slots__ = ()
+
+    @classmethod
+    def de_dicionario(cls, pdf, pagina, fatura_data):
+        return cls(pdf, pagina, *(fatura_data.get(chave) for _, chave in CAMPOS_REGISTRO_FATURA))
+
+    def dicionario(self):
+        """Fatura no formato usado pelas demais funções do módulo (chaves = colunas do relatório)."""
+        return {chave: getattr(self, campo) for campo, chave in CAMPOS_REGISTRO_FATURA}
+
+class RegistroErro(namedtuple("RegistroErro", ["pdf", "pagina", "mensagem", "item"])):
+    """
+    Problema apontado na aba 'Relatorio_Erros' (PDF ilegível ou duplicado, UC não encontrada, fatura repetida, ...).
+    'pagina' é None quando o erro se refere ao arquivo inteiro; 'item' é o item de erro completo (ver COLUNAS_ERROS).
+    """
+    __slots__ = ()
+
+    def dicionario(self):
+        return dict(self.item)
+
+class RegistroPdf(namedtuple("RegistroPdf", ["pdf", "valor_cobrado", "liquido_verificado"])):
+    """
+    Conclusão de um PDF: 'Valor Cobrado' da primeira página e, se verificado pela sua duplicação,
+    o valor (centavos) somado ao 'TOTAL conta' (None se não verificado).
+    """
+    __slots__ = ()
+
+    def dicionario(self):
+        """Resultado no formato de registrar_valor_cobrado."""
+        return {"pdf": self.pdf, "valor_cobrado": self.valor_cobrado, "liquido_total_verified": self.liquido_verificado}
+
+def _documentos_entrada(entradas, logger_func, erros_entrada):
+    """
+    Converte as entradas de extrair_registros, sob demanda, em (caminho ou nome do PDF, bytes ou None).
+    Caminhos (PDFs, ZIPs ou pastas) são lidos do disco pela extração; bytes e objetos de arquivo são
+    lidos aqui, um de cada vez. Os itens de erro dos ZIPs inválidos são colocados na fila 'erros_entrada'.
+    """
+    for numero, entrada in enumerate(entradas, start=1):
+        nome = None
+        if isinstance(entrada, tuple):
+            nome, entrada = entrada
+        if isinstance(entrada, (str, os.PathLike)):
+            pdf_files, erros = expandir_arquivos_zip(listar_entradas([os.fspath(entrada)]), logger_func)
+            for erro_item in erros:
+                erros_entrada.put(erro_item)
+            for pdf_path in pdf_files:
+                yield pdf_path, None
+            continue
+        if hasattr(entrada, "read"):
+            nome = nome or getattr(entrada, "name", None)
+            entrada = entrada.read()
+        yield os.path.basename(str(nome)) if nome else f"documento_{numero}.pdf", bytes(entrada)
+
+def extrair_registros(entradas, df_base, configuracoes=None, logger_func=None, ocr_cache_path=None, perfis_extracao=None):
+    """
+    Extrai as faturas e gera os registros à medida que as páginas são analisadas: RegistroFatura e
+    RegistroErro por página e, ao final de cada PDF, um RegistroPdf (verificação do 'Valor Cobrado').
+    PDFs e faturas duplicados geram RegistroErro, como no relatório.
+
+    'entradas' é um iterável de caminhos (PDFs, ZIPs ou pastas), bytes, objetos de arquivo ou pares
+    (nome, bytes ou objeto de arquivo). As entradas são consumidas sob demanda e a extração segue em
+    estágios ligados por filas limitadas (ver executar_estagios_extracao), de modo que a memória não
+    cresce com a quantidade de PDFs. As páginas enviadas ao OCR ('ocr_ativo') geram os seus registros
+    após o último PDF. 'configuracoes' pode trazer apenas as chaves a alterar em CONFIGURACOES_PADRAO;
+    sem 'logger_func', as mensagens são descartadas. Interromper a iteração encerra a extração.
+    """
+    configuracoes = dict(CONFIGURACOES_PADRAO, **(configuracoes or {}))
+    if logger_func is None:
+        logger_func = RegistroLog(nivel_minimo=configuracoes["nivel_log"])
+    if perfis_extracao is None:
+        perfis_extracao = PerfisExtracao()
+    tempo_limite_bloco = configuracoes["tempo_limite_bloco_ms"] / 1000 or None
+    indice_duplicatas = IndiceDuplicatas(logger_func)
+    erros_entrada = queue.Queue()
+    ocr_servico = None
+    if configuracoes["ocr_ativo"]:
+        ocr_servico = ServicoOCR(configuracoes["ocr_processos"],
+                                 configuracoes["ocr_idioma"],
+                                 configuracoes["ocr_dpi"],
+                                 ocr_cache_path,
+                                 logger_func)
+    ocr_pendentes = []
+
+    def registros(pdf_path, page_num, results):
+        """Converte os resultados de uma página em registros, desviando faturas duplicadas para RegistroErro."""
+        pdf_name = nome_pdf(pdf_path)
+        pagina = page_num + 1 if page_num is not None else None
+        for item in results:
+            if "error" not in item:
+                fatura_original = indice_duplicatas.registrar_fatura(item)
+                if fatura_original is None:
+                    yield RegistroFatura.de_dicionario(pdf_name, pagina, item)
+                    continue
+                item = criar_item_fatura_duplicada(item, fatura_original)
+                logger_func(item["error"], "WARNING")
+            yield RegistroErro(pdf_name, pagina, item["error"], item)
+
+    def erros_de_entrada():
+        while not erros_entrada.empty():
+            erro_item = erros_entrada.get()
+            yield RegistroErro(erro_item["Numero da Pagina"], None, erro_item["error"], erro_item)
+
+    eventos = executar_estagios_extracao(
+        [], df_base, configuracoes, logger_func,
+        lambda pdf_path, pdf_bytes: verificar_arquivo_duplicado_indice(indice_duplicatas, pdf_path, pdf_bytes, logger_func),
+        ocr_servico, ocr_pendentes, perfis_extracao=perfis_extracao,
+        documentos=_documentos_entrada(entradas, logger_func, erros_entrada))
+    try:
+        faturas_no_pdf = 0 # Resultados do PDF atual (os eventos de um PDF chegam em sequência)
+        for evento in eventos:
+            yield from erros_de_entrada()
+            tipo, pdf_path = evento[0], evento[1]
+            if tipo == "duplicado":
+                yield from registros(pdf_path, None, [evento[2]])
+            elif tipo == "faturas":
+                faturas_no_pdf += len(evento[3])
+                yield from registros(pdf_path, evento[2], evento[3])
+            elif tipo == "fim_pdf":
+                _, _, erro_item, _, paginas_enviadas_ocr, verificacao = evento
+                if erro_item is not None:
+                    yield from registros(pdf_path, None, [erro_item])
+                elif not faturas_no_pdf and not paginas_enviadas_ocr:
+                    registrar_log(logger_func, "WARNING", "PDF_SEM_FATURAS",
+                                  "Nenhum dado de fatura (com UC identificável) ou erro relevante encontrado em {pdf} após processar todas as páginas com texto extraível.",
+                                  pdf=nome_pdf(pdf_path))
+                resultado = registrar_valor_cobrado(pdf_path, verificacao, logger_func)
+                yield RegistroPdf(resultado["pdf"], resultado["valor_cobrado"], resultado["liquido_total_verified"])
+                faturas_no_pdf = 0
+        yield from erros_de_entrada()
+
+        for pdf_path, page_num, pedido in ocr_pendentes:
+            pdf_name = nome_pdf(pdf_path)
+            try:
+                page_text = pedido.result()
+            except Exception as e:
+                ocr_msg = f"Falha no OCR da página {page_num + 1} de {pdf_name}: {e}"
+                logger_func(ocr_msg, "ERROR")
+                yield from registros(pdf_path, page_num, [{"error": ocr_msg, "Observação": ocr_msg,
+                                                           "Numero da Pagina": f"{pdf_name} (Pág. {page_num + 1})", "UC": "N/A"}])
+                continue
+            if not page_text or not page_text.strip():
+                logger_func(f"OCR não reconheceu texto na página {page_num + 1} de {pdf_name}.", "WARNING")
+                continue
+            logger_func(f"OCR concluído para a página {page_num + 1} de {pdf_name}.", "INFO")
+            yield from registros(pdf_path, page_num, extract_faturas_from_page_text(page_text, page_num, df_base, pdf_name,
+                                                                                   logger_func, tempo_limite_bloco))
+        indice_duplicatas.informar_pdfs_sem_referencia()
+    finally:
+        eventos.close()
+        if ocr_servico is not None:
+            ocr_servico.encerrar()
+        perfis_extracao.salvar()
+
+def montar_dataframe_relatorio(faturas, resultados_valor_cobrado=(), logger_func=None):
+    """
+    DataFrame da aba 'Relatorio' (colunas COLUNAS_RELATORIO, moeda em centavos): as faturas seguidas,
+    após uma linha em branco, das linhas 'Totais:' e 'TOTAL conta:'. 'faturas' pode ser uma TabelaFaturas,
+    uma lista de faturas (dicionários) ou de RegistroFatura; 'resultados_valor_cobrado', de RegistroPdf ou
+    dos dicionários de registrar_valor_cobrado. Não divide o relatório em abas (ver gerar_relatorio).
+    """
+    if not isinstance(faturas, (TabelaFaturas, pd.DataFrame)):
+        faturas = [fatura.dicionario() if isinstance(fatura, RegistroFatura) else fatura for fatura in faturas]
+    resultados_valor_cobrado = [resultado.dicionario() if isinstance(resultado, RegistroPdf) else resultado
+                                for resultado in resultados_valor_cobrado]
+    df_extracted_data, df_total_row, df_cobrado_summary_row = calcular_dados_relatorio(faturas, resultados_valor_cobrado, logger_func)
+    partes = montar_partes_relatorio(df_extracted_data, [df_total_row, df_cobrado_summary_row], COLUNAS_RELATORIO,
+                                     max(1, len(df_extracted_data)))
+    return partes[0] if partes else pd.DataFrame(columns=COLUNAS_RELATORIO)
+
+def montar_dataframe_controle(faturas=(), agregador_controle=None, com_totais=True):
+    """
+    DataFrame da aba 'Controle' (moeda em centavos), somado de 'faturas' (dicionários ou RegistroFatura)
+    ou de um AgregadorControle já somado. Com 'com_totais', inclui a linha em branco e a linha 'Totais:'.
+    """
+    if agregador_controle is None:
+        agregador_controle = AgregadorControle(fatura.dicionario() if isinstance(fatura, RegistroFatura) else fatura
+                                               for fatura in faturas)
+    df_controle = agregador_controle.dataframe()
+    if com_totais and not df_controle.empty:
+        df_controle = adicionar_totais_controle(df_controle)
+    return df_controle
+
+class ResultadoExtracao:
+    """
+    Acumula os registros de extrair_registros para montar as abas e gravar o relatório.
+    As faturas são somadas para a aba 'Controle' à medida que chegam; com 'manter_faturas' False
+    elas não são guardadas (memória proporcional à quantidade de centros de custo, como no modo
+    'Somente Controle') e o 'Relatorio' não fica disponível.
+    """
+
+    def __init__(self, manter_faturas=True):
+        self.manter_faturas = manter_faturas
+        self.faturas = TabelaFaturas()
+        self.agregador_controle = AgregadorControle()
+        self.erros = []
+        self.valor_cobrado = []
+
+    def adicionar(self, registro):
+        if isinstance(registro, RegistroFatura):
+            fatura_data = registro.dicionario()
+            self.agregador_controle.adicionar(fatura_data)
+            if self.manter_faturas:
+                self.faturas.append(fatura_data)
+        elif isinstance(registro, RegistroErro):
+            self.erros.append(registro.dicionario())
+        elif isinstance(registro, RegistroPdf):
+            self.valor_cobrado.append(registro.dicionario())
+        else:
+            raise TypeError(f"Registro desconhecido: {registro!r}")
+
+    def consumir(self, registros):
+        """Acrescenta todos os registros (ex: extrair_registros(...)) e retorna o próprio resultado."""
+        for registro in registros:
+            self.adicionar(registro)
+        return self
+
+    def dataframe_relatorio(self, logger_func=None):
+        if not self.manter_faturas:
+            raise ValueError("As faturas não foram guardadas (manter_faturas=False); apenas a aba 'Controle' está disponível.")
+        return montar_dataframe_relatorio(self.faturas, self.valor_cobrado, logger_func)
+
+    def dataframe_controle(self, com_totais=True):
+        return montar_dataframe_controle(agregador_controle=self.agregador_controle, com_totais=com_totais)
+
+    def dataframe_erros(self):
+        return pd.DataFrame(self.erros).reindex(columns=COLUNAS_ERROS)
+
+    def gravar(self, output_file_path, configuracoes=None, gerar_controle=True, gerar_txt=False, logger_func=None,
+               progresso_func=None):
+        """Grava o relatório Excel (e, opcionalmente, os TXT) com gerar_relatorio. Retorna o resumo de gerar_relatorio."""
+        return gerar_relatorio(self.faturas, self.erros, self.valor_cobrado, output_file_path,
+                               dict(CONFIGURACOES_PADRAO, **(configuracoes or {})), gerar_controle, gerar_txt,
+                               logger_func or RegistroLog(), self.agregador_controle, self.manter_faturas, progresso_func)
+
+
+# --- Execução em Fragmentos (várias máquinas) ---
+
+VERSAO_PARCIAL = 1
+
+def listar_entradas(caminhos):
+    """Substitui cada pasta informada pelos PDFs e ZIPs que ela contém (ordenados pelo nome)."""
+    entradas = []
+    for caminho in caminhos:
+        if os.path.isdir(caminho):
+            entradas.extend(os.path.join(caminho, nome) for nome in sorted(os.listdir(caminho))
+                            if nome.lower().endswith((".pdf", ".zip")))
+        else:
+            entradas.append(caminho)
+    return entradas
+
+def fragmento_do_pdf(pdf_path, fragmentos, logger_func):
+    """
+    Fragmento (a partir de 0) de um PDF, pelo hash do seu conteúdo: arquivos com o mesmo conteúdo
+    caem sempre no mesmo fragmento, de modo que a detecção de arquivos duplicados continua exata.
+    """
+    try:
+        conteudo_hash = calcular_hash_arquivo(pdf_path)
+    except (OSError, KeyError, zipfile.BadZipFile) as e:
+        # O arquivo será apontado como inválido na verificação preliminar do fragmento
+        logger_func(f"Não foi possível calcular o hash de {nome_pdf(pdf_path)}: {e}. Fragmento definido pelo nome.", "WARNING")
+        conteudo_hash = hashlib.sha256(nome_pdf(pdf_path).encode("utf-8")).hexdigest()
+    return int(conteudo_hash[:16], 16) % fragmentos
+
+def assinatura_base(df_base):
+    """Hash do conteúdo da planilha base, para garantir que todos os fragmentos usaram a mesma base."""
+    return hashlib.sha256(df_base.to_csv(index=False).encode("utf-8")).hexdigest()
+
+class ParcialFragmento:
+    """
+    Resultados brutos de cada PDF de um fragmento (antes da verificação de faturas duplicadas),
+    preenchidos por extrair_faturas: faturas e erros da extração, do OCR e a verificação do 'Valor Cobrado'.
+    """
+
+    def __init__(self):
+        self.por_pdf = {} # caminho do PDF -> {"resultados": [...], "ocr": [...], "valor_cobrado": ... ou None}
+
+    def _pdf(self, pdf_path):
+        return self.por_pdf.setdefault(pdf_path, {"resultados": [], "ocr": [], "valor_cobrado": None})
+
+    def registrar_resultados(self, pdf_path, results, ocr=False):
+        self._pdf(pdf_path)["ocr" if ocr else "resultados"].extend(results)
+
+    def registrar_valor_cobrado(self, pdf_path, resultado):
+        self._pdf(pdf_path)["valor_cobrado"] = resultado
+
+def executar_fragmento(entradas, fragmento, fragmentos, df_base, configuracoes, logger_func, ocr_cache_path=None,
+                       perfis_extracao=None):
+    """
+    Processa o fragmento 'fragmento' (de 1 a 'fragmentos') das entradas (PDFs e ZIPs, na ordem de seleção).
+    Os PDFs são distribuídos entre os fragmentos pelo hash do conteúdo; todas as máquinas devem receber
+    as mesmas entradas, na mesma ordem, e a mesma planilha base.
+    Retorna o resultado parcial (dicionário serializável em JSON) para mesclar_fragmentos.
+    """
+    pdf_files, erros_zip = expandir_arquivos_zip(entradas, logger_func)
+    logger_func(f"Distribuindo {len(pdf_files)} PDF(s) entre {fragmentos} fragmento(s) pelo hash do conteúdo...", "INFO")
+    indices = {pdf_path: indice for indice, pdf_path in enumerate(pdf_files)
+               if fragmento_do_pdf(pdf_path, fragmentos, logger_func) == fragmento - 1}
+    meus_pdfs = list(indices)
+    logger_func(f"Fragmento {fragmento}/{fragmentos}: {len(meus_pdfs)} PDF(s).", "INFO")
+
+    pdfs_validos, pdf_page_counts, pdf_sizes, erros_preliminares = verificar_pdfs(
+        meus_pdfs, configuracoes["processos_extracao"], logger_func)
+    # Os PDFs do fragmento não são ZIPs: há um erro preliminar por PDF inválido, na ordem dos PDFs
+    validos = set(pdfs_validos)
+    erros_por_pdf = dict(zip([pdf_path for pdf_path in meus_pdfs if pdf_path not in validos], erros_preliminares))
+
+    parcial = ParcialFragmento()
+    logger_func(f"Iniciando processamento de {len(pdfs_validos)} PDFs ({sum(pdf_page_counts.values())} páginas totais estimadas)...", "INFO")
+    extrair_faturas(pdfs_validos, df_base, configuracoes, logger_func,
+                    pdf_page_counts=pdf_page_counts, pdf_sizes=pdf_sizes, ocr_cache_path=ocr_cache_path,
+                    manter_faturas=False, parcial=parcial, perfis_extracao=perfis_extracao)
+
+    pdfs = []
+    for pdf_path in meus_pdfs:
+        registro = parcial.por_pdf.get(pdf_path, {"resultados": [], "ocr": [], "valor_cobrado": None})
+        registro.update({"indice": indices[pdf_path], "pdf": nome_pdf(pdf_path), "erro_preliminar": erros_por_pdf.get(pdf_path)})
+        pdfs.append(registro)
+    return {
+        "versao": VERSAO_PARCIAL,
+        "data_execucao": datetime.now().isoformat(timespec='seconds'),
+        "fragmento": fragmento,
+        "fragmentos": fragmentos,
+        "entradas": hashlib.sha256("\n".join(nome_pdf(pdf_path) for pdf_path in pdf_files).encode("utf-8")).hexdigest(),
+        "total_pdfs": len(pdf_files),
+        "base": assinatura_base(df_base),
+        "erros_zip": erros_zip,
+        "pdfs": pdfs
+    }
+
+def caminho_parcial(output_dir, fragmento, fragmentos):
+    """Caminho do resultado parcial de um fragmento (ex: 'DD.MM.AAAA Repasse-Celesc.fragmento-2-de-4.json')."""
+    raiz = os.path.splitext(caminho_relatorio(output_dir))[0]
+    return f"{raiz}.fragmento-{fragmento}-de-{fragmentos}.json"
+
+def salvar_parcial(parcial_path, parcial):
+    """Grava o resultado parcial de um fragmento em JSON (por um arquivo temporário)."""
+    temp_path = parcial_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(parcial, f, ensure_ascii=False)
+    os.replace(temp_path, parcial_path)
+
+def carregar_parcial(parcial_path):
+    """Lê um resultado parcial gravado por salvar_parcial."""
+    with open(parcial_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def mesclar_fragmentos(parciais, logger_func):
+    """
+    Combina os resultados parciais de todos os fragmentos como uma execução única: os PDFs são
+    consolidados na ordem de seleção e as faturas duplicadas entre fragmentos vão para a lista de erros.
+    Levanta ValueError se os fragmentos não forem de uma mesma execução ou estiverem incompletos.
+    Retorna (faturas extraídas, itens de erro, resultados da verificação do 'Valor Cobrado').
+    """
+    if not parciais:
+        raise ValueError("Nenhum resultado parcial informado.")
+    primeiro = parciais[0]
+    for parcial in parciais:
+        if parcial.get("versao") != VERSAO_PARCIAL:
+            raise ValueError(f"Versão de resultado parcial não suportada: {parcial.get('versao')}.")
+        for campo, descricao in (("fragmentos", "quantidade de fragmentos"), ("entradas", "lista de PDFs"),
+                                 ("base", "planilha base")):
+            if parcial[campo] != primeiro[campo]:
+                raise ValueError(f"Os fragmentos {primeiro['fragmento']} e {parcial['fragmento']} têm {descricao} diferente(s).")
+    fragmentos = sorted(parcial["fragmento"] for parcial in parciais)
+    if fragmentos != list(range(1, primeiro["fragmentos"] + 1)):
+        raise ValueError(f"Fragmentos informados: {fragmentos}; são necessários todos os fragmentos de 1 a {primeiro['fragmentos']}, uma vez cada.")
+    pdfs = sorted((registro for parcial in parciais for registro in parcial["pdfs"]), key=lambda registro: registro["indice"])
+    if [registro["indice"] for registro in pdfs] != list(range(primeiro["total_pdfs"])):
+        raise ValueError("Os fragmentos não cobrem todos os PDFs da seleção.")
+
+    all_extracted_data = []
+    error_items = list(primeiro["erros_zip"]) + [registro["erro_preliminar"] for registro in pdfs if registro["erro_preliminar"]]
+    all_valor_cobrado_results = []
+    indice_duplicatas = IndiceDuplicatas(logger_func)
+    # Mesma ordem de uma execução única: os PDFs na ordem de seleção e, por último, as páginas com OCR
+    for etapa in ("resultados", "ocr"):
+        for registro in pdfs:
+            for item in registro[etapa]:
+                if "error" in item:
+                    error_items.append(item)
+                    continue
+                fatura_original = indice_duplicatas.registrar_fatura(item)
+                if fatura_original is not None:
+                    duplicate_item = criar_item_fatura_duplicada(item, fatura_original)
+                    logger_func(duplicate_item["error"], "WARNING")
+                    error_items.append(duplicate_item)
+                else:
+                    all_extracted_data.append(item)
+            if etapa == "resultados" and registro["valor_cobrado"] is not None:
+                all_valor_cobrado_results.append(registro["valor_cobrado"])
+    indice_duplicatas.informar_pdfs_sem_referencia()
+
+    logger_func(f"{len(parciais)} fragmento(s) mesclado(s): {len(pdfs)} PDF(s), {len(all_extracted_data)} fatura(s) e "
+                f"{len(error_items)} erro(s).", "SUCCESSO")
+    return all_extracted_data, error_items, all_valor_cobrado_results
+
+def executar_linha_de_comando_fragmentos(argumentos):
+    """
+    Execução em várias máquinas, sem interface gráfica:
+      relatorio.py --fragmento I/N --saida PASTA ENTRADAS...   processa o fragmento I de N e grava o resultado parcial
+      relatorio.py --mesclar PARCIAIS... --saida PASTA [--controle] [--txt] [--nome-arquivo NOME]
+    ENTRADAS são PDFs, ZIPs ou pastas (com os PDFs/ZIPs ordenados pelo nome). Retorna o código de saída.
+    """
+    parser = argparse.ArgumentParser(prog="relatorio.py", description="Relatório Celesc em fragmentos (várias máquinas).")
+    modo = parser.add_mutually_exclusive_group(required=True)
+    modo.add_argument("--fragmento", help="fragmento a processar, no formato I/N (ex: 2/4)")
+    modo.add_argument("--mesclar", nargs="+", metavar="PARCIAL", help="resultados parciais (.json) de todos os fragmentos")
+    parser.add_argument("--saida", required=True, help="pasta de saída")
+    parser.add_argument("--controle", action="store_true", help="gera a aba 'Controle' (na mesclagem)")
+    parser.add_argument("--txt", action="store_true", help="gera os arquivos TXT de rateio (na mesclagem)")
+    parser.add_argument("--nome-arquivo", help="nome do relatório Excel (na mesclagem)")
+    parser.add_argument("entradas", nargs="*", help="PDFs, ZIPs ou pastas (com --fragmento)")
+    args = parser.parse_args(argumentos)
+
+    basedir = diretorio_base()
+    destino = lambda message, level="INFO": print(f"[{level}] {message}", flush=True)
+    configuracoes = carregar_configuracoes(os.path.join(basedir, "base", "config.json"), destino)
+    registro = RegistroLog(destino, configuracoes["nivel_log"])
+    os.makedirs(args.saida, exist_ok=True)
+    try:
+        if args.fragmento:
+            match = re.fullmatch(r"(\d+)/(\d+)", args.fragmento)
+            if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+                parser.error("--fragmento deve estar no formato I/N, com 1 <= I <= N (ex: 2/4).")
+            if not args.entradas:
+                parser.error("informe os PDFs, ZIPs ou pastas a processar.")
+            fragmento, fragmentos = int(match.group(1)), int(match.group(2))
+            df_base = carregar_planilha_base(os.path.join(basedir, "base", "database.xlsx"))
+            if df_base.empty:
+                raise ValueError("Planilha base de UCs vazia.")
+            parcial = executar_fragmento(listar_entradas(args.entradas), fragmento, fragmentos, df_base, configuracoes,
+                                         registro, os.path.join(basedir, "base", "ocr_cache.json"),
+                                         PerfisExtracao(os.path.join(basedir, "base", "perfis_extracao.json"), registro))
+            registro.emitir_resumo()
+            parcial_path = caminho_parcial(args.saida, fragmento, fragmentos)
+            salvar_parcial(parcial_path, parcial)
+            registro(f"Resultado parcial do fragmento {fragmento}/{fragmentos} salvo em: {parcial_path}", "SUCCESSO")
+        else:
+            parciais = [carregar_parcial(parcial_path) for parcial_path in args.mesclar]
+            all_extracted_data, error_items, all_valor_cobrado_results = mesclar_fragmentos(parciais, registro)
+            resultado = gerar_relatorio(all_extracted_data, error_items, all_valor_cobrado_results,
+                                        caminho_relatorio(args.saida, args.nome_arquivo), configuracoes,
+                                        args.controle or args.txt, args.txt, registro)
+            registro(f"Relatório salvo em: {', '.join(resultado['arquivos'])}", "SUCCESSO")
+            if resultado["falha_txt"]:
+                return 1
+    except Exception as e:
+        registro(f"Erro CRÍTICO: {e}", "CRITICAL_ERROR")
+        return 1
+    finally:
+        registro.fechar()
+    return 0
+
+def executar_linha_de_comando_totais(argumentos):
+    """
+    Conferência prévia sem interface gráfica: 'relatorio.py --totais ENTRADAS...' soma o 'Valor Cobrado'
+    verificado da primeira página de cada PDF e conta páginas e UCs (ver calcular_totais_rapidos).
+    Retorna 0 se todos os arquivos foram somados, 1 caso contrário.
+    """
+    parser = argparse.ArgumentParser(prog="relatorio.py", description="Totais rápidos do lote (conferência prévia).")
+    parser.add_argument("--totais", action="store_true", required=True, help="calcula apenas os totais rápidos")
+    parser.add_argument("entradas", nargs="+", help="PDFs, ZIPs ou pastas")
+    args = parser.parse_args(argumentos)
+
+    destino = lambda message, level="INFO": print(f"[{level}] {message}", flush=True)
+    configuracoes = carregar_configuracoes(os.path.join(diretorio_base(), "base", "config.json"), destino)
+    registro = RegistroLog(destino, configuracoes["nivel_log"])
+    try:
+        _, totais = calcular_totais_rapidos(listar_entradas(args.entradas),
+                                            max(configuracoes["processos_extracao"], os.cpu_count() or 1), registro)
+        registro.emitir_resumo()
+    except Exception as e:
+        registro(f"Erro CRÍTICO: {e}", "CRITICAL_ERROR")
+        return 1
+    finally:
+        registro.fechar()
+    return 1 if totais["arquivos_nao_verificados"] else 0
+
+
+# --- Serviço Local (modo residente) ---
+
+class ServicoRelatorios:
+    """
+    Serviço HTTP local (apenas 127.0.0.1) que mantém bibliotecas, planilha base, pools de processos
+    e cache de OCR carregados entre execuções. Recebe trabalhos (PDFs e opções) em uma fila,
+    executados um de cada vez, e informa o estado e os arquivos gerados de cada trabalho.
+
+    Rotas:
+      POST /trabalhos          {"pdfs": [...], "pasta_saida": "...", "gerar_controle": bool, "gerar_txt": bool,
+                                "gerar_relatorio": bool, "nome_arquivo": "...", "reprocessar_erros_de": "..."}
+                               ('reprocessar_erros_de', opcional: relatório Excel anterior cujos erros são
+                               reprocessados com os 'pdfs', gerando um relatório consolidado)
+      GET  /trabalhos          lista dos trabalhos
+      GET  /trabalhos/<id>     estado e resultado de um trabalho
+      GET  /trabalhos/<id>/log mensagens de log do trabalho
+      GET  /estado             estado do serviço (planilha base, fila)
+    """
+
+    ESTADOS_FINAIS = ("concluido", "erro")
+    MAX_TRABALHOS_HISTORICO = 200 # Trabalhos finalizados mantidos para consulta
+
+    def __init__(self, basedir, configuracoes, porta, logger_func=None):
+        self.base_sheet_path = os.path.join(basedir, "base", "database.xlsx")
+        self.ocr_cache_path = os.path.join(basedir, "base", "ocr_cache.json")
+        self.configuracoes = configuracoes
+        self.porta = porta
+        self.logger_func = logger_func or (lambda message, level="INFO", *args, **kwargs: print(f"[{level}] {message}", flush=True))
+        self.perfis_extracao = PerfisExtracao(os.path.join(basedir, "base", "perfis_extracao.json"), self.logger_func)
+        self.df_base = None
+        self.base_mtime = None
+        self.trabalhos = {} # id -> dicionário com estado e resultado
+        self.logs_trabalhos = {} # id -> RegistroLog do trabalho
+        self.proximo_id = 1
+        self.lock = threading.Lock()
+        self.fila = queue.Queue()
+        self.executor_extracao = None # Pool de extração mantido entre trabalhos (recriado se a base mudar)
+        self.ocr_servico = None
+        self.servidor = None
+
+    def atualizar_base(self):
+        """Carrega a planilha base na primeira vez e sempre que o arquivo for alterado."""
+        mtime = os.path.getmtime(self.base_sheet_path) if os.path.exists(self.base_sheet_path) else None
+        if self.df_base is not None and mtime == self.base_mtime:
+            return
+        self.df_base = carregar_planilha_base(self.base_sheet_path)
+        self.base_mtime = mtime
+        self.logger_func(f"Planilha base carregada. {len(self.df_base)} UCs encontradas.", "INFO")
+        # Os processos de extração recebem a planilha base ao iniciar; um novo pool é criado com a base atualizada
+        if self.executor_extracao is not None:
+            self.executor_extracao.shutdown(wait=True)
+            self.executor_extracao = None
+
+    def _obter_executor_extracao(self):
+        if self.configuracoes["processos_extracao"] <= 1 and not extracao_isolada(self.configuracoes):
+            return None
+        if self.executor_extracao is None:
+            self.executor_extracao = criar_executor_extracao(self.configuracoes, self.df_base)
+        return self.executor_extracao
+
+    def submeter(self, pedido):
+        """Valida e enfileira um trabalho. Retorna o estado inicial do trabalho ou levanta ValueError."""
+        pdfs = pedido.get("pdfs")
+        pasta_saida = pedido.get("pasta_saida")
+        if not isinstance(pdfs, list) or not pdfs or not all(isinstance(p, str) for p in pdfs):
+            raise ValueError("'pdfs' deve ser uma lista não vazia de caminhos de arquivos PDF.")
+        if not isinstance(pasta_saida, str) or not os.path.isdir(pasta_saida):
+            raise ValueError("'pasta_saida' deve ser uma pasta existente.")
+        nome_arquivo = pedido.get("nome_arquivo")
+        if nome_arquivo is not None and (not isinstance(nome_arquivo, str) or os.path.basename(nome_arquivo) != nome_arquivo):
+            raise ValueError("'nome_arquivo' deve ser apenas o nome do arquivo, sem pastas.")
+        ausentes = [p for p in pdfs if not os.path.isfile(p)]
+        if ausentes:
+            raise ValueError(f"Arquivo(s) não encontrado(s): {', '.join(ausentes)}")
+        relatorio_anterior = pedido.get("reprocessar_erros_de")
+        if relatorio_anterior is not None and (not isinstance(relatorio_anterior, str) or not os.path.isfile(relatorio_anterior)):
+            raise ValueError("'reprocessar_erros_de' deve ser o caminho de um relatório Excel existente.")
+
+        gerar_txt = bool(pedido.get("gerar_txt", False))
+        gerar_aba_relatorio = bool(pedido.get("gerar_relatorio", True))
+        with self.lock:
+            # Descarta os trabalhos finalizados mais antigos
+            finalizados = [t["id"] for t in self.trabalhos.values() if t["estado"] in self.ESTADOS_FINAIS]
+            for antigo_id in finalizados[:max(0, len(finalizados) - self.MAX_TRABALHOS_HISTORICO)]:
+                del self.trabalhos[antigo_id]
+                self.logs_trabalhos.pop(antigo_id, None)
+            trabalho_id = str(self.proximo_id)
+            self.proximo_id += 1
+            trabalho = {
+                "id": trabalho_id,
+                "estado": "na_fila",
+                "pdfs": [os.path.abspath(p) for p in pdfs],
+                "pasta_saida": os.path.abspath(pasta_saida),
+                "nome_arquivo": nome_arquivo,
+                # TXT e a execução sem a aba 'Relatorio' exigem a aba 'Controle'
+                "gerar_controle": bool(pedido.get("gerar_controle", False)) or gerar_txt or not gerar_aba_relatorio,
+                "gerar_txt": gerar_txt,
+                "gerar_relatorio": gerar_aba_relatorio,
+                "reprocessar_erros_de": os.path.abspath(relatorio_anterior) if relatorio_anterior else None,
+                "recebido_em": datetime.now().isoformat(timespec='seconds'),
+                "iniciado_em": None,
+                "concluido_em": None,
+                "resultado": None,
+                "mensagem": None
+            }
+            self.trabalhos[trabalho_id] = trabalho
+        self.fila.put(trabalho_id)
+        return self.estado_trabalho(trabalho_id)
+
+    def estado_trabalho(self, trabalho_id):
+        """Cópia do estado de um trabalho (ou None), com a posição na fila se ainda não iniciado."""
+        with self.lock:
+            trabalho = self.trabalhos.get(trabalho_id)
+            if trabalho is None:
+                return None
+            estado = dict(trabalho)
+            if trabalho["estado"] == "na_fila":
+                estado["posicao_fila"] = sum(1 for t in self.trabalhos.values() if t["estado"] == "na_fila" and int(t["id"]) < int(trabalho_id)) + 1
+            return estado
+
+    def log_trabalho(self, trabalho_id):
+        with self.lock:
+            registro = self.logs_trabalhos.get(trabalho_id)
+        if registro is None:
+            return None
+        return [{"level": level, "code": codigo, "message": message} for message, level, codigo, _ in list(registro.registros)]
+
+    def _executar_fila(self):
+        while True:
+            trabalho_id = self.fila.get()
+            if trabalho_id is None:
+                break
+            self._executar_trabalho(trabalho_id)
+
+    def _executar_trabalho(self, trabalho_id):
+        with self.lock:
+            trabalho = self.trabalhos[trabalho_id]
+            trabalho["estado"] = "processando"
+            trabalho["iniciado_em"] = datetime.now().isoformat(timespec='seconds')
+
+        output_file_path = caminho_relatorio(trabalho["pasta_saida"], trabalho["nome_arquivo"])
+        jsonl_path = os.path.splitext(output_file_path)[0] + ".log.jsonl" if self.configuracoes["log_estruturado"] else None
+        destino = lambda message, level="INFO": self.logger_func(f"[trabalho {trabalho_id}] {message}", level)
+        registro = RegistroLog(destino, self.configuracoes["nivel_log"], jsonl_path, coletar=True)
+        with self.lock:
+            self.logs_trabalhos[trabalho_id] = registro
+
+        try:
+            self.atualizar_base()
+            if self.df_base.empty:
+                raise ValueError("Planilha base de UCs vazia.")
+
+            if self.configuracoes["ocr_ativo"] and self.ocr_servico is None:
+                self.ocr_servico = ServicoOCR(self.configuracoes["ocr_processos"], self.configuracoes["ocr_idioma"],
+                                              self.configuracoes["ocr_dpi"], self.ocr_cache_path, self.logger_func)
+
+            agregador_controle = AgregadorControle()
+            gerar_aba_relatorio = trabalho["gerar_relatorio"]
+            if trabalho["reprocessar_erros_de"]:
+                gerar_aba_relatorio = True # O relatório consolidado parte das faturas do relatório anterior
+                all_extracted_data, error_items, all_valor_cobrado_results, agregador_controle = reprocessar_erros_relatorio(
+                    trabalho["reprocessar_erros_de"], trabalho["pdfs"], self.df_base, self.configuracoes, registro,
+                    ocr_servico=self.ocr_servico, executor_extracao=self._obter_executor_extracao(),
+                    perfis_extracao=self.perfis_extracao)
+            else:
+                pdfs_validos, pdf_page_counts, pdf_sizes, erros_preliminares = verificar_pdfs(
+                    trabalho["pdfs"], self.configuracoes["processos_extracao"], registro,
+                    executor=self._obter_executor_extracao())
+
+                registro(f"Iniciando processamento de {len(pdfs_validos)} PDFs ({sum(pdf_page_counts.values())} páginas totais estimadas)...", "INFO")
+                all_extracted_data, error_items, all_valor_cobrado_results = extrair_faturas(
+                    pdfs_validos, self.df_base, self.configuracoes, registro,
+                    pdf_page_counts=pdf_page_counts, pdf_sizes=pdf_sizes, erros_preliminares=erros_preliminares,
+                    ocr_servico=self.ocr_servico, executor_extracao=self._obter_executor_extracao(),
+                    perfis_extracao=self.perfis_extracao, agregador_controle=agregador_controle, manter_faturas=gerar_aba_relatorio)
+            registro.emitir_resumo()
+
+            resultado = gerar_relatorio(all_extracted_data, error_items, all_valor_cobrado_results, output_file_path,
+                                        self.configuracoes, trabalho["gerar_controle"], trabalho["gerar_txt"], registro,
+                                        agregador_controle, gerar_aba_relatorio)
+            estado_final, mensagem = "concluido", None
+        except Exception as e:
+            registro(f"Erro CRÍTICO no trabalho {trabalho_id}: {e}", "CRITICAL_ERROR")
+            resultado, estado_final, mensagem = None, "erro", str(e)
+        finally:
+            registro.fechar()
+
+        with self.lock:
+            trabalho["estado"] = estado_final
+            trabalho["resultado"] = resultado
+            trabalho["mensagem"] = mensagem
+            trabalho["concluido_em"] = datetime.now().isoformat(timespec='seconds')
+
+    def estado_servico(self):
+        with self.lock:
+            contagem = {}
+            for trabalho in self.trabalhos.values():
+                contagem[trabalho["estado"]] = contagem.get(trabalho["estado"], 0) + 1
+        return {
+            "planilha_base": self.base_sheet_path,
+            "ucs_na_base": None if self.df_base is None else len(self.df_base),
+            "trabalhos": contagem
+        }
+
+    def iniciar(self):
+        """Carrega a planilha base, inicia a fila de trabalhos e atende requisições até ser interrompido (Ctrl+C)."""
+        self.atualizar_base()
+        threading.Thread(target=self._executar_fila, daemon=True).start()
+        self.servidor = http.server.ThreadingHTTPServer(("127.0.0.1", self.porta), _ManipuladorServico)
+        self.servidor.servico = self
+        self.logger_func(f"Serviço de relatórios aguardando trabalhos em http://127.0.0.1:{self.porta}/trabalhos", "INFO")
+        try:
+            self.servidor.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.encerrar()
+
+    def encerrar(self):
+        """Encerra o servidor e os pools de processos, gravando o cache de OCR."""
+        if self.servidor is not None:
+            self.servidor.server_close()
+            self.servidor = None
+        self.fila.put(None)
+        if self.executor_extracao is not None:
+            self.executor_extracao.shutdown(wait=True, cancel_futures=True)
+            self.executor_extracao = None
+        if self.ocr_servico is not None:
+            self.ocr_servico.encerrar()
+            self.ocr_servico = None
+
+class _ManipuladorServico(http.server.BaseHTTPRequestHandler):
+    """Rotas HTTP do ServicoRelatorios (respostas em JSON)."""
+
+    def _responder(self, status, dados):
+        corpo = json.dumps(dados, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _host_permitido(self):
+        """
+        Aceita apenas requisições endereçadas a 127.0.0.1:<porta> (protege contra DNS rebinding:
+        uma página que resolve o próprio domínio para 127.0.0.1 envia outro 'Host'). Responde 403 se não.
+        """
+        if self.headers.get("Host") == f"127.0.0.1:{self.server.server_address[1]}":
+            return True
+        self._responder(403, {"erro": "Host não permitido."})
+        return False
+
+    def do_GET(self):
+        if not self._host_permitido():
+            return
+        servico = self.server.servico
+        partes = [p for p in self.path.split("?")[0].split("/") if p]
+        if partes == ["estado"]:
+            self._responder(200, servico.estado_servico())
+        elif partes == ["trabalhos"]:
+            with servico.lock:
+                ids = list(servico.trabalhos)
+            self._responder(200, [servico.estado_trabalho(trabalho_id) for trabalho_id in ids])
+        elif len(partes) == 2 and partes[0] == "trabalhos":
+            estado = servico.estado_trabalho(partes[1])
+            self._responder(200, estado) if estado else self._responder(404, {"erro": "Trabalho não encontrado."})
+        elif len(partes) == 3 and partes[0] == "trabalhos" and partes[2] == "log":
+            log = servico.log_trabalho(partes[1])
+            self._responder(200, log) if log is not None else self._responder(404, {"erro": "Log não encontrado."})
+        else:
+            self._responder(404, {"erro": "Rota não encontrada."})
+
+    def do_POST(self):
+        if not self._host_permitido():
+            return
+        servico = self.server.servico
+        if [p for p in self.path.split("?")[0].split("/") if p] != ["trabalhos"]:
+            self._responder(404, {"erro": "Rota não encontrada."})
+            return
+        # Exigir JSON faz o navegador enviar um preflight CORS (que o serviço não aceita) antes de um POST de outra origem
+        if self.headers.get_content_type() != "application/json":
+            self._responder(415, {"erro": "O corpo da requisição deve ter 'Content-Type: application/json'."})
+            return
+        try:
+            tamanho = int(self.headers.get("Content-Length", 0))
+            pedido = json.loads(self.rfile.read(tamanho).decode('utf-8') or "{}")
+            if not isinstance(pedido, dict):
+                raise ValueError("O corpo da requisição deve ser um objeto JSON.")
+            self._responder(202, servico.submeter(pedido))
+        except (ValueError, json.JSONDecodeError) as e:
+            self._responder(400, {"erro": str(e)})
+
+    def log_message(self, format, *args):
+        pass # As requisições não são registradas; os trabalhos têm log próprio
+
+
+# --- Classe da Interface Gráfica ---
+
+# Colunas da tabela 'Arquivos' (situação de cada PDF do lote)
+COLUNAS_TABELA_ARQUIVOS = ("Arquivo", "Situação", "Páginas", "Faturas", "Erros", "Tempo (s)")
+ESTADOS_ARQUIVO = {
+    "pendente": "Pendente", "processando": "Processando", "concluido": "Concluído",
+    "falhou": "Falhou", "duplicado": "Duplicado", "invalido": "Inválido", "nao_processado": "Não processado"
+}
+# Intervalo mínimo entre as atualizações da tabela 'Arquivos' (as mudanças são aplicadas em lotes)
+INTERVALO_TABELA_ARQUIVOS_MS = 250
+
+class AppCelescReporter:
+    def __init__(self, root_window):
+        self.root = root_window
+        self.root.title("Gerador de Relatório Celesc - ver 1.2.1a")
+        self.center_window(700, 650)
+        self.root.resizable(False, False)
+
+        basedir = diretorio_base()
 
         self.base_sheet_path = os.path.join(basedir, "base", "database.xlsx")
 
@@ -349,16 +4754,13 @@ class AppCelescReporter:
 
         self.df_base = None
         self.pdf_files = []
+        self.pdf_page_counts = {}
+        self.pdf_sizes = {}
         self.total_pages_to_process = 0
         self.processed_pages_count = 0
         self.output_dir = os.path.join(os.path.expanduser("~"), "Desktop")
 
         self.current_severity = 0
-        self.SEVERITY_MAP = {
-            "INFO": 0, "DEBUG": 0, "SUCCESSO": 0,
-            "AVISO": 1,
-            "ERRO": 2, "ERRO_CRITICO!": 2
-        }
 
         self.has_specific_warnings = False # Flag para avisos específicos (para o resumo final)
         self.account_values_mismatched = False # Nova flag para a verificação de valores
@@ -386,8 +4788,10 @@ class AppCelescReporter:
         self.base_status_label = ttk.Label(base_frame, text="Status: Não carregada")
         self.base_status_label.pack(fill=tk.X)
 
-        # --- Seção Log em Tempo Real ---
-        log_frame = ttk.LabelFrame(main_frame, text="Log de Processamento", padding="10")
+        # --- Seção Log em Tempo Real (aba 'Log' ao lado da aba 'Arquivos') ---
+        self.saida_notebook = ttk.Notebook(main_frame)
+        log_frame = ttk.Frame(self.saida_notebook, padding="10")
+        self.saida_notebook.add(log_frame, text="Log de Processamento")
 
         self.log_text = scrolledtext.ScrolledText(log_frame, wrap=tk.WORD, height=10, state=tk.DISABLED)
         self.log_text.pack(fill=tk.BOTH, expand=True)
@@ -397,6 +4801,18 @@ class AppCelescReporter:
         self.log_text.tag_config("ERRO_CRITICO", foreground="red", font=('TkDefaultFont', 9, 'bold'))
         self.log_text.tag_config("SUCCESSO", foreground="green")
         self.log_text.tag_config("DEBUG", foreground="gray")
+        # Mensagens de log ainda não inseridas no widget (vindas de qualquer thread; ver _escrever_log)
+        self.log_pendentes = []
+        self.log_lock = threading.Lock()
+        self.log_agendado = False
+
+        self.config_path = os.path.join(basedir, "base", "config.json")
+        self.registro_log = RegistroLog(self._escrever_log)
+        self.configuracoes = carregar_configuracoes(self.config_path, self.log_message)
+        self.registro_log = RegistroLog(self._escrever_log, self.configuracoes["nivel_log"])
+        self.ocr_cache_path = os.path.join(basedir, "base", "ocr_cache.json")
+        self.perfis_extracao_path = os.path.join(basedir, "base", "perfis_extracao.json")
+        self.estado_execucao_path = os.path.join(basedir, "base", "ultima_execucao.json")
 
         self.load_base_sheet() # Carrega a planilha base ao iniciar
 
@@ -437,7 +4853,8 @@ class AppCelescReporter:
         separator_canvas_1.create_line(0, 0, 0, 15, fill="gray")
         separator_canvas_1.pack(side=tk.LEFT, padx=(5, 5))
 
-        self.relatorio_checkbox = ttk.Checkbutton(params_frame, text="Gerar Relatorio", variable=self.gerar_relatorio_var, state=tk.DISABLED)
+        self.relatorio_checkbox = ttk.Checkbutton(params_frame, text="Gerar Relatorio", variable=self.gerar_relatorio_var,
+                                                  command=self.on_toggle_gerar_relatorio)
         self.relatorio_checkbox.pack(side=tk.LEFT, padx=5, pady=2)
 
         # --- 3. Pasta de Saída do Relatório ---
@@ -448,8 +4865,28 @@ class AppCelescReporter:
         self.output_label = ttk.Label(output_frame, text=f"Padrão: {self.output_dir}")
         self.output_label.pack(side=tk.LEFT, fill=tk.X, expand=True)
 
-        # --- 4. Log de Processamento ---
-        log_frame.pack(fill=tk.BOTH, expand=True, pady=5)
+        # --- 4. Log de Processamento e situação de cada arquivo ---
+        arquivos_frame = ttk.Frame(self.saida_notebook, padding="10")
+        self.saida_notebook.add(arquivos_frame, text="Arquivos")
+        self.arquivos_tree = ttk.Treeview(arquivos_frame, columns=COLUNAS_TABELA_ARQUIVOS, show="headings", height=8)
+        for coluna, largura in zip(COLUNAS_TABELA_ARQUIVOS, (250, 90, 55, 55, 45, 70)):
+            self.arquivos_tree.heading(coluna, text=coluna)
+            self.arquivos_tree.column(coluna, width=largura, stretch=(coluna == "Arquivo"),
+                                      anchor=tk.W if coluna in ("Arquivo", "Situação") else tk.E)
+        self.arquivos_tree.tag_configure("falhou", foreground="red")
+        self.arquivos_tree.tag_configure("com_erros", foreground="orange")
+        self.arquivos_tree.tag_configure("concluido", foreground="green")
+        arquivos_scroll = ttk.Scrollbar(arquivos_frame, orient=tk.VERTICAL, command=self.arquivos_tree.yview)
+        self.arquivos_tree.configure(yscrollcommand=arquivos_scroll.set)
+        arquivos_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.arquivos_tree.pack(fill=tk.BOTH, expand=True)
+        self.linhas_arquivos = {} # PDF -> item da tabela
+        self.inicio_arquivos = {} # PDF -> início da extração (time.monotonic)
+        self.status_pendentes = {} # PDF -> valores ainda não aplicados à tabela
+        self.tabela_pendente = None # Linhas que substituem a tabela, ainda não aplicadas (ver _preencher_tabela_arquivos)
+        self.status_lock = threading.Lock()
+        self.status_agendado = False
+        self.saida_notebook.pack(fill=tk.BOTH, expand=True, pady=5)
 
         # --- 5. Action Frame ---
         action_frame = ttk.Frame(main_frame, padding="10")
@@ -459,8 +4896,28 @@ class AppCelescReporter:
                                             style="Default.Horizontal.TProgressbar")
         self.progress_bar.pack(pady=5, fill=tk.X)
 
-        self.process_button = ttk.Button(action_frame, text="Iniciar Processamento de Relatório", command=self.start_processing)
-        self.process_button.pack(pady=5)
+        processamento_frame = ttk.Frame(action_frame)
+        processamento_frame.pack(pady=5)
+        self.process_button = ttk.Button(processamento_frame, text="Iniciar Processamento de Relatório", command=self.start_processing)
+        self.process_button.pack(side=tk.LEFT)
+
+        # Interrompe a extração entre páginas e gera um relatório parcial com o que já foi extraído
+        self.cancelamento = threading.Event()
+        self.cancel_button = ttk.Button(processamento_frame, text="Cancelar", command=self.cancel_processing, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=(10, 0))
+
+        # Revincula os erros de 'UC não encontrada' da última execução (após atualizar a planilha base)
+        self.relink_button = ttk.Button(action_frame, text="Revincular UCs não encontradas", command=self.start_relink,
+                                        state=tk.NORMAL if os.path.exists(self.estado_execucao_path) else tk.DISABLED)
+        self.relink_button.pack(pady=(0, 5))
+
+        # Reprocessa apenas os arquivos e páginas da aba 'Relatorio_Erros' de um relatório anterior
+        self.retry_button = ttk.Button(action_frame, text="Reprocessar erros de um relatório anterior", command=self.start_retry)
+        self.retry_button.pack(pady=(0, 5))
+
+        # Conferência prévia: soma o 'Valor Cobrado' da primeira página de cada PDF, sem gerar o relatório
+        self.totais_button = ttk.Button(action_frame, text="Totais rápidos (conferência prévia)", command=self.start_quick_totals)
+        self.totais_button.pack(pady=(0, 5))
 
         self.status_label = ttk.Label(action_frame, text="Aguardando configuração...")
         self.status_label.pack(fill=tk.X, pady=5)
@@ -477,29 +4934,77 @@ class AppCelescReporter:
             self.log_message(f"Erro ao aplicar estilo '{style_name}' à barra de progresso: {e}. Usando estilo padrão.", "WARNING")
             self.progress_bar.config(style="Default.Horizontal.TProgressbar")
 
-    def log_message(self, message, level="INFO"):
-        """Insere uma mensagem no widget de log, configura tags para colorir e atualiza a severidade."""
-        display_message = f"[{level}] {message}\n"
-        tag = level.upper()
+    def log_message(self, message, level="INFO", codigo=None, **campos):
+        """Registra uma mensagem: filtra pelo nível configurado, exibe no widget e grava no log estruturado."""
+        self.registro_log(message, level, codigo, **campos)
+
+    def _iniciar_registro_log(self):
+        """Cria o registro de log da execução, com o log estruturado (JSONL) na pasta de saída, se configurado."""
+        jsonl_path = None
+        if self.configuracoes["log_estruturado"] and self.output_dir:
+            today_str = datetime.today().strftime("%d.%m.%Y")
+            jsonl_path = os.path.join(self.output_dir, f"{today_str} Repasse-Celesc.log.jsonl")
+        try:
+            self.registro_log = RegistroLog(self._escrever_log, self.configuracoes["nivel_log"], jsonl_path)
+        except OSError as e:
+            self.registro_log = RegistroLog(self._escrever_log, self.configuracoes["nivel_log"])
+            self.log_message(f"Não foi possível criar o log estruturado em {jsonl_path}: {e}", "WARNING")
+
+    def _encerrar_registro_log(self):
+        """Fecha o log estruturado da execução; as mensagens seguintes vão apenas para o widget."""
+        self.registro_log.fechar()
+        self.registro_log = RegistroLog(self._escrever_log, self.configuracoes["nivel_log"])
+
+    def _escrever_log(self, message, level="INFO"):
+        """
+        Destino do registro de log; pode ser chamado de qualquer thread. Como o Tk não é thread-safe, as
+        mensagens são acumuladas e inseridas no widget pela thread da interface (_aplicar_log).
+        """
+        with self.log_lock:
+            self.log_pendentes.append((message, level))
+            if self.log_agendado:
+                return
+            self.log_agendado = True
+        self.root.after(0, self._aplicar_log)
+
+    def _aplicar_log(self):
+        """Insere no widget de log (na thread da interface) as mensagens acumuladas, colorindo-as e atualizando a severidade."""
+        with self.log_lock:
+            pendentes, self.log_pendentes = self.log_pendentes, []
+            self.log_agendado = False
+        if not pendentes:
+            return
 
         self.log_text.config(state=tk.NORMAL)
-        self.log_text.insert(tk.END, display_message, tag)
+        for message, level in pendentes:
+            self.log_text.insert(tk.END, f"[{level}] {message}\n", level.upper())
         self.log_text.config(state=tk.DISABLED)
         self.log_text.see(tk.END)
 
-        new_severity = self.SEVERITY_MAP.get(level, 0)
+        self._atualizar_severidade()
+
+    def _atualizar_severidade(self):
+        """
+        Atualiza a severidade (cor da barra) e a flag de avisos específicos a partir das contagens do
+        registro de log, que incluem as mensagens filtradas pelo nível configurado (ex: 'nivel_log' = ERROR).
+        """
+        registro = self.registro_log
+        if registro.ocorrencias.get("LIQUIDO_NAO_ENCONTRADO"):
+            self.has_specific_warnings = True
+
+        if registro.nivel_maximo >= NIVEIS_LOG["ERROR"]:
+            new_severity = 2
+        elif registro.nivel_maximo >= NIVEIS_LOG["WARNING"]:
+            new_severity = 1
+        else:
+            new_severity = 0
         if new_severity > self.current_severity:
             self.current_severity = new_severity
-            if self.current_severity == 0:
-                self.set_progress_bar_style("Success.Horizontal.TProgressbar")
-            elif self.current_severity == 1:
+            if self.current_severity == 1:
                 self.set_progress_bar_style("Warning.Horizontal.TProgressbar")
             else:
                 self.set_progress_bar_style("Error.Horizontal.TProgressbar")
 
-        if level == "WARNING" and message.startswith("Valor Líquido da fatura (Valor Total da Fatura) não encontrado ou zerado para UC"):
-            self.has_specific_warnings = True
-
     def update_progress(self, pages_processed):
         """Atualiza a barra de progresso (valor) e o status label."""
         self.processed_pages_count += pages_processed
@@ -513,6 +5018,65 @@ class AppCelescReporter:
         if pages_processed > 0 or current_progress == total_steps:
             self.root.after(0, lambda: self.status_label.config(text=f"Processando página {current_progress}/{total_steps}..."))
 
+    def _preencher_tabela_arquivos(self, linhas):
+        """
+        Substitui o conteúdo da tabela 'Arquivos' pelas linhas (PDF, estado, páginas, erros) informadas.
+        Pode ser chamado de qualquer thread: a substituição entra na mesma fila de _status_arquivo,
+        de modo que as atualizações enviadas depois dela nunca são descartadas.
+        """
+        with self.status_lock:
+            self.tabela_pendente = list(linhas)
+            self.status_pendentes = {}
+            self.inicio_arquivos = {}
+            if self.status_agendado:
+                return
+            self.status_agendado = True
+        self.root.after(0, self._aplicar_status_arquivos)
+
+    def _status_arquivo(self, pdf_path, estado, faturas, erros):
+        """
+        Recebe a situação de um PDF (ver extrair_faturas) da thread de processamento. As atualizações
+        são acumuladas e aplicadas à tabela em lotes, no máximo a cada INTERVALO_TABELA_ARQUIVOS_MS.
+        """
+        agora = time.monotonic()
+        paginas = self.pdf_page_counts.get(pdf_path, "")
+        if estado in ("falhou", "nao_processado") or (estado in ("concluido", "duplicado") and erros):
+            tag = "falhou" if estado == "falhou" else "com_erros"
+        else:
+            tag = "concluido" if estado == "concluido" else ""
+        with self.status_lock:
+            if estado == "processando":
+                self.inicio_arquivos[pdf_path] = agora
+                tempo = ""
+            else:
+                inicio = self.inicio_arquivos.get(pdf_path)
+                tempo = f"{agora - inicio:.1f}" if inicio is not None else ""
+            self.status_pendentes[pdf_path] = ((nome_pdf(pdf_path), ESTADOS_ARQUIVO[estado], paginas, faturas, erros, tempo), tag)
+            if self.status_agendado:
+                return
+            self.status_agendado = True
+        self.root.after(INTERVALO_TABELA_ARQUIVOS_MS, self._aplicar_status_arquivos)
+
+    def _aplicar_status_arquivos(self):
+        """Aplica à tabela, na thread da interface, a substituição e as atualizações acumuladas (na ordem em que chegaram)."""
+        with self.status_lock:
+            linhas, self.tabela_pendente = self.tabela_pendente, None
+            pendentes, self.status_pendentes = self.status_pendentes, {}
+            self.status_agendado = False
+        if linhas is not None:
+            self.arquivos_tree.delete(*self.arquivos_tree.get_children())
+            self.linhas_arquivos = {}
+            for pdf_path, estado, paginas, erros in linhas:
+                self.linhas_arquivos[pdf_path] = self.arquivos_tree.insert(
+                    "", tk.END, values=(nome_pdf(pdf_path), ESTADOS_ARQUIVO[estado], paginas if paginas is not None else "", "", erros or "", ""),
+                    tags=("falhou",) if estado == "invalido" else ())
+        for pdf_path, (valores, tag) in pendentes.items():
+            item = self.linhas_arquivos.get(pdf_path)
+            if item is None:
+                self.linhas_arquivos[pdf_path] = self.arquivos_tree.insert("", tk.END, values=valores, tags=(tag,) if tag else ())
+            else:
+                self.arquivos_tree.item(item, values=valores, tags=(tag,) if tag else ())
+
     def center_window(self, width, height):
         screen_width = self.root.winfo_screenwidth()
         screen_height = self.root.winfo_screenheight()
@@ -521,43 +5085,42 @@ class AppCelescReporter:
         self.root.geometry(f'{width}x{height}+{int(x)}+{int(y)}')
 
     def load_base_sheet(self):
-        """Carrega a planilha base de UCs e atualiza o status na interface."""
-        self.log_message("Tentando carregar planilha base...", "INFO")
-        try:
-            if not os.path.exists(self.base_sheet_path):
-                msg = f"Status: ERRO - Arquivo base não encontrado em {self.base_sheet_path}"
-                self.base_status_label.config(text=msg, foreground="red")
-                self.log_message(msg, "ERROR")
-                self.df_base = None
-                return
+        """Carrega a planilha base de UCs e atualiza o status na interface (apenas na thread da interface)."""
+        self._atualizar_status_base(*self._carregar_planilha_base())
 
-            self.df_base = pd.read_excel(self.base_sheet_path, engine='openpyxl', dtype={'UC': str, 'Cod de Reg': str, 'Nome': str})
-            required_cols = ['UC', 'Cod de Reg', 'Nome']
-            if not all(col in self.df_base.columns for col in required_cols):
-                missing_cols = [col for col in required_cols if col not in self.df_base.columns]
-                msg = f"Status: ERRO - Colunas faltando na planilha base: {', '.join(missing_cols)}. Necessárias: {', '.join(required_cols)}"
-                self.base_status_label.config(text=msg, foreground="red")
-                self.log_message(msg, "ERROR")
-                self.df_base = None
-                return
+    def _carregar_base_em_segundo_plano(self):
+        """Como load_base_sheet, para as threads de processamento: o status é atualizado pela thread da interface."""
+        msg, cor = self._carregar_planilha_base()
+        self.root.after(0, lambda: self._atualizar_status_base(msg, cor))
 
-            self.df_base.dropna(subset=['UC'], inplace=True)
-            self.df_base['UC'] = self.df_base['UC'].astype(str).str.strip()
+    def _carregar_planilha_base(self):
+        """
+        Carrega a planilha base de UCs em self.df_base e registra o resultado no log, sem acessar os widgets.
+        Retorna (mensagem, cor) para o status da planilha base (ver _atualizar_status_base).
+        """
+        self.log_message("Tentando carregar planilha base...", "INFO")
+        try:
+            self.df_base = carregar_planilha_base(self.base_sheet_path)
 
             num_ucs = len(self.df_base)
             if num_ucs == 0:
                 msg = "Status: Planilha base carregada, mas sem UCs válidas após limpeza."
-                self.base_status_label.config(text=msg, foreground="orange")
                 self.log_message(msg, "WARNING")
-            else:
-                msg = f"Status: Planilha base carregada. {num_ucs} UCs encontradas."
-                self.base_status_label.config(text=msg, foreground="green")
-                self.log_message(msg, "INFO")
+                return msg, "orange"
+            msg = f"Status: Planilha base carregada. {num_ucs} UCs encontradas."
+            self.log_message(msg, "INFO")
+            return msg, "green"
+        except (FileNotFoundError, ValueError) as e:
+            msg = f"Status: ERRO - {e}"
+            self.log_message(msg, "ERROR")
         except Exception as e:
             msg = f"Status: ERRO ao carregar planilha base - {e}"
-            self.base_status_label.config(text=msg, foreground="red")
             self.log_message(msg, "CRITICAL_ERROR")
-            self.df_base = None
+        self.df_base = None
+        return msg, "red"
+
+    def _atualizar_status_base(self, msg, cor):
+        self.base_status_label.config(text=msg, foreground=cor)
 
     def open_base_sheet_folder(self):
         """Abre o diretório onde a planilha base está localizada."""
@@ -583,12 +5146,13 @@ class AppCelescReporter:
         """Permite ao usuário selecionar múltiplos arquivos PDF."""
         files = filedialog.askopenfilenames(
             title="Selecione os arquivos PDF da Celesc",
-            filetypes=(("Arquivos PDF", "*.pdf"), ("Todos os arquivos", "*.*"))
+            filetypes=(("Arquivos PDF ou ZIP", "*.pdf *.zip"), ("Arquivos PDF", "*.pdf"), ("Arquivos ZIP", "*.zip"), ("Todos os arquivos", "*.*"))
         )
         if files:
             self.pdf_files = list(files)
             self.pdf_label.config(text=f"{len(self.pdf_files)} PDF(s) selecionado(s)")
             self.log_message(f"{len(self.pdf_files)} PDF(s) selecionado(s).", "INFO")
+            self._preencher_tabela_arquivos([(pdf_path, "pendente", None, 0) for pdf_path in self.pdf_files])
         else:
             self.pdf_label.config(text="Nenhum PDF selecionado")
             self.log_message("Nenhum PDF selecionado.", "INFO")
@@ -600,10 +5164,21 @@ class AppCelescReporter:
         Se 'Gerar TXT' for marcado, 'Gerar Controle' é marcado e desativado.
         Se 'Gerar TXT' for desmarcado, 'Gerar Controle' é reativado.
         """
-        if self.gerar_txt_var.get():  # Se o checkbox 'Gerar TXT' está agora marcado
+        self._atualizar_controle_check()
+
+    def on_toggle_gerar_relatorio(self):
+        """
+        Sem a aba 'Relatorio', apenas a aba 'Controle' é gerada: 'Gerar Controle' é marcado e desativado.
+        Nesse modo as faturas são somadas durante a extração, sem guardar cada uma em memória.
+        """
+        self._atualizar_controle_check()
+
+    def _atualizar_controle_check(self):
+        """'Gerar Controle' fica marcado e desativado se 'Gerar TXT' estiver marcado ou 'Gerar Relatorio' desmarcado."""
+        if self.gerar_txt_var.get() or not self.gerar_relatorio_var.get():
             self.gerar_controle_var.set(True)  # Marca o 'Gerar Controle'
             self.controle_check.config(state=tk.DISABLED)  # Desativa a interação
-        else:  # Se o checkbox 'Gerar TXT' foi desmarcado
+        else:
             self.controle_check.config(state=tk.NORMAL)  # Reativa a interação
 
     def select_output_dir(self):
@@ -626,19 +5201,6 @@ class AppCelescReporter:
 
         self.log_message("Iniciando processo de verificação...", "INFO")
 
-        self.load_base_sheet()
-
-        if self.df_base is None or self.df_base.empty:
-            msg = "Planilha base de UCs não carregada, inválida ou vazia. Verifique o arquivo 'base/database.xlsx'."
-            self.log_message(msg, "ERROR")
-            messagebox.showerror("Erro de Configuração", msg)
-            self.set_progress_bar_style("Error.Horizontal.TProgressbar")
-            self.progress_bar["value"] = 1
-            self.progress_bar["maximum"] = 1
-            self.status_label.config(text="Erro de configuração: Planilha base.")
-            self.process_button.config(state=tk.NORMAL)
-            return
-
         if not self.pdf_files:
             msg = "Nenhum arquivo PDF foi selecionado para processamento."
             self.log_message(msg, "ERROR")
@@ -661,456 +5223,438 @@ class AppCelescReporter:
             self.process_button.config(state=tk.NORMAL)
             return
 
-        self.total_pages_to_process = 0
-        self.log_message("Contando total de páginas nos PDFs...", "INFO")
-        temp_total_pages = 0
-        for pdf_path in self.pdf_files:
-            try:
-                with fitz.open(pdf_path) as pdf: # Usando fitz para contagem mais confiável
-                    temp_total_pages += len(pdf)
-            except Exception as e:
-                self.log_message(f"AVISO: Não foi possível contar páginas em {os.path.basename(pdf_path)}: {e}. Assumindo 1 página para o progresso.", "WARNING")
-                temp_total_pages += 1
-        self.total_pages_to_process = max(1, temp_total_pages)
-        self.log_message(f"Total de páginas a processar: {self.total_pages_to_process}", "INFO")
-
-        self.processed_pages_count = 0
-        self.status_label.config(text=f"Preparando para processar {self.total_pages_to_process} páginas...")
         self.process_button.config(state=tk.DISABLED)
+        self.relink_button.config(state=tk.DISABLED)
+        self.retry_button.config(state=tk.DISABLED)
+        self.totais_button.config(state=tk.DISABLED)
+        self.cancelamento = threading.Event()
+        self.cancel_button.config(state=tk.NORMAL)
         self.progress_bar["value"] = 0
-        self.progress_bar["maximum"] = self.total_pages_to_process
+        self.progress_bar["maximum"] = 1
         self.set_progress_bar_style("Success.Horizontal.TProgressbar")
+        self.status_label.config(text=f"Verificando {len(self.pdf_files)} PDF(s)...")
 
         self.root.update_idletasks()
 
-        processing_thread = threading.Thread(target=self._actual_processing_task)
+        # A planilha base e a verificação preliminar dos PDFs são feitas fora da thread da interface
+        # (as variáveis Tk são lidas aqui, na thread da interface)
+        processing_thread = threading.Thread(target=self._preparar_e_processar,
+                                             args=(list(self.pdf_files), self.gerar_relatorio_var.get()))
         processing_thread.start()
 
-    def _actual_processing_task(self):
-        """Contém o loop principal de processamento de PDF, executa em uma thread separada."""
-        all_extracted_data = []
-        error_items = []
-        erros_encontrados_no_processamento = False
+    def cancel_processing(self):
+        """
+        Pede a interrupção da extração em andamento. A thread de processamento para entre uma página e a
+        seguinte, sem aguardar os PDFs em execução, e o relatório parcial é gerado normalmente, com os
+        arquivos não processados listados na aba 'Relatorio_Erros'.
+        """
+        self.cancelamento.set()
+        self.cancel_button.config(state=tk.DISABLED)
+        self.log_message("Cancelamento solicitado: a extração será interrompida e um relatório parcial será gerado.", "WARNING")
+        self.status_label.config(text="Cancelando processamento...")
+
+    def _falha_configuracao(self, msg, status):
+        """Exibe um erro de configuração detectado na preparação e libera a interface."""
+        self.cancel_button.config(state=tk.DISABLED)
+        messagebox.showerror("Erro de Configuração", msg)
+        self.set_progress_bar_style("Error.Horizontal.TProgressbar")
+        self.progress_bar["value"] = 1
+        self.progress_bar["maximum"] = 1
+        self.status_label.config(text=status)
+        self.process_button.config(state=tk.NORMAL)
+        self.retry_button.config(state=tk.NORMAL)
+        self.totais_button.config(state=tk.NORMAL)
+        if os.path.exists(self.estado_execucao_path):
+            self.relink_button.config(state=tk.NORMAL)
+
+    def _preparar_e_processar(self, pdf_files, gerar_aba_relatorio=True):
+        """
+        Executa em uma thread separada: carrega a planilha base enquanto os PDFs são verificados em paralelo
+        (páginas, tamanho e problemas como senha, arquivo corrompido ou PDF que não é fatura Celesc).
+        PDFs com problema são relatados imediatamente e excluídos da extração.
+        'gerar_aba_relatorio' ('Gerar Relatorio', lido na thread da interface) é repassado a _actual_processing_task.
+        """
+        self._iniciar_registro_log()
+        self.log_message(f"Verificando {len(pdf_files)} PDF(s) e carregando a planilha base...", "INFO")
+
+        def carregar_base():
+            self._carregar_base_em_segundo_plano()
+            return self.df_base is not None and not self.df_base.empty
+
+        verificacao = verificar_pdfs(pdf_files, self.configuracoes["processos_extracao"], self.registro_log, carregar_base)
+        if verificacao is None:
+            msg = "Planilha base de UCs não carregada, inválida ou vazia. Verifique o arquivo 'base/database.xlsx'."
+            self.log_message(msg, "ERROR")
+            self._encerrar_registro_log()
+            self.root.after(0, lambda: self._falha_configuracao(msg, "Erro de configuração: Planilha base."))
+            return
+        pdfs_validos, self.pdf_page_counts, self.pdf_sizes, erros_preliminares = verificacao
+
+        # A tabela passa a listar os PDFs verificados (inclusive os de dentro dos ZIPs) e os rejeitados
+        linhas_tabela = [(pdf_path, "pendente", self.pdf_page_counts.get(pdf_path), 0) for pdf_path in pdfs_validos]
+        linhas_tabela += [(erro_item["Numero da Pagina"], "invalido", None, 1) for erro_item in erros_preliminares]
+        self._preencher_tabela_arquivos(linhas_tabela)
 
+        self.total_pages_to_process = max(1, sum(self.pdf_page_counts.values()))
+        self.log_message(f"Total de páginas a processar: {self.total_pages_to_process}", "INFO")
+        self.processed_pages_count = 0
+
+        self._actual_processing_task(pdfs_validos, erros_preliminares, gerar_aba_relatorio)
+
+    def _actual_processing_task(self, pdf_files, erros_preliminares=None, gerar_aba_relatorio=True):
+        """
+        Contém o loop principal de processamento de PDF, executa em uma thread separada.
+        Com 'gerar_aba_relatorio' False, as faturas são apenas somadas na aba 'Controle' (não ficam em memória).
+        """
         self.root.after(0, lambda: self.progress_bar.config(value=0, maximum=self.total_pages_to_process))
         self.root.after(0, lambda: self.status_label.config(text=f"Iniciando processamento de {self.total_pages_to_process} páginas..."))
+        self.root.after(0, lambda: self.set_progress_bar_style("Success.Horizontal.TProgressbar"))
+
+        self.log_message(f"Iniciando processamento de {len(pdf_files)} PDFs ({self.total_pages_to_process} páginas totais estimadas)...", "INFO")
+
+        agregador_controle = AgregadorControle()
+        all_extracted_data, error_items, all_valor_cobrado_results = extrair_faturas(
+            pdf_files, self.df_base, self.configuracoes, self.registro_log, self.update_progress,
+            pdf_page_counts=self.pdf_page_counts, pdf_sizes=self.pdf_sizes,
+            erros_preliminares=erros_preliminares, ocr_cache_path=self.ocr_cache_path,
+            agregador_controle=agregador_controle, manter_faturas=gerar_aba_relatorio,
+            perfis_extracao=PerfisExtracao(self.perfis_extracao_path, self.registro_log),
+            status_arquivo_func=self._status_arquivo, cancelamento=self.cancelamento)
+        erros_encontrados_no_processamento = bool(error_items)
+        cancelado = self.cancelamento.is_set()
+        self.root.after(0, lambda: self.cancel_button.config(state=tk.DISABLED))
+
+        self.registro_log.emitir_resumo()
+
+        # Guarda os resultados (inclusive UCs não encontradas) para a revinculação posterior
+        if gerar_aba_relatorio:
+            try:
+                salvar_estado_execucao(self.estado_execucao_path, all_extracted_data, error_items, all_valor_cobrado_results)
+            except Exception as e:
+                self.log_message(f"Não foi possível gravar o estado da execução para revinculação: {e}", "WARNING")
+        else:
+            self.log_message("Execução sem a aba 'Relatorio': os resultados não foram guardados para a revinculação de UCs.", "INFO")
+
+        self.root.after(0, lambda: self.progress_bar.config(value=self.total_pages_to_process))
+        if cancelado:
+            self.root.after(0, lambda: self.status_label.config(text="Processamento cancelado! Gerando relatório parcial..."))
+        else:
+            self.root.after(0, lambda: self.status_label.config(text=f"Processamento concluído! Gerando relatório..."))
+
+        self.root.after(100, lambda: self._processing_complete(all_extracted_data, error_items, erros_encontrados_no_processamento, all_valor_cobrado_results,
+                                                               agregador_controle, gerar_aba_relatorio, cancelado))
+
+
+    def start_relink(self):
+        """
+        Revincula os erros de 'UC não encontrada' da última execução, consultando novamente
+        a planilha base, sem reprocessar os PDFs. Gera um novo relatório com o resultado.
+        """
+        self.log_text.config(state=tk.NORMAL)
+        self.log_text.delete('1.0', tk.END)
+        self.log_text.config(state=tk.DISABLED)
+
+        self.current_severity = 0
+        self.has_specific_warnings = False # Reset flag
+        self.account_values_mismatched = False # Reset flag
+
+        self.log_message("Iniciando revinculação de UCs da última execução...", "INFO")
+
+        self.load_base_sheet()
+
+        if self.df_base is None or self.df_base.empty:
+            msg = "Planilha base de UCs não carregada, inválida ou vazia. Verifique o arquivo 'base/database.xlsx'."
+            self.log_message(msg, "ERROR")
+            messagebox.showerror("Erro de Configuração", msg)
+            self.status_label.config(text="Erro de configuração: Planilha base.")
+            return
+
+        if not self.output_dir or not os.path.isdir(self.output_dir):
+            msg = "Pasta de saída inválida ou não definida."
+            self.log_message(msg, "ERROR")
+            messagebox.showerror("Erro de Configuração", msg)
+            self.status_label.config(text="Erro de configuração: Pasta de saída inválida.")
+            return
+
+        self._iniciar_registro_log()
+
+        try:
+            estado = carregar_estado_execucao(self.estado_execucao_path)
+        except Exception as e:
+            msg = f"Não foi possível ler os resultados da última execução ({self.estado_execucao_path}): {e}"
+            self.log_message(msg, "ERROR")
+            self._encerrar_registro_log()
+            messagebox.showerror("Erro na Revinculação", msg)
+            self.status_label.config(text="Erro na revinculação.")
+            return
+
+        self.log_message(f"Resultados da execução de {estado.get('data_execucao', '?')} carregados: {len(estado['dados'])} fatura(s) e {len(estado['erros'])} erro(s).", "INFO")
+
+        all_extracted_data, error_items, revinculadas = revincular_ucs_pendentes(estado["dados"], estado["erros"], self.df_base, self.registro_log)
+        self.log_message(f"{revinculadas} fatura(s) revinculada(s). {len(error_items)} erro(s) restante(s).", "SUCCESSO" if revinculadas else "INFO")
+
+        try:
+            salvar_estado_execucao(self.estado_execucao_path, all_extracted_data, error_items, estado["valor_cobrado"])
+        except Exception as e:
+            self.log_message(f"Não foi possível gravar o estado da execução para revinculação: {e}", "WARNING")
+
+        self.process_button.config(state=tk.DISABLED)
+        self.relink_button.config(state=tk.DISABLED)
+        self.retry_button.config(state=tk.DISABLED)
+        self.totais_button.config(state=tk.DISABLED)
+        self.progress_bar["value"] = 1
+        self.progress_bar["maximum"] = 1
+        self.status_label.config(text="Revinculação concluída! Gerando relatório...")
+        self.root.update_idletasks()
+
+        self._processing_complete(all_extracted_data, error_items, bool(error_items), estado["valor_cobrado"])
+
+    def start_retry(self):
+        """
+        Reprocessa apenas os arquivos e páginas listados na aba 'Relatorio_Erros' de um relatório anterior
+        (procurados entre os PDFs/ZIPs selecionados) e gera um novo relatório consolidado.
+        """
+        self.log_text.config(state=tk.NORMAL)
+        self.log_text.delete('1.0', tk.END)
+        self.log_text.config(state=tk.DISABLED)
+
+        self.current_severity = 0
+        self.has_specific_warnings = False # Reset flag
+        self.account_values_mismatched = False # Reset flag
+
+        if not self.pdf_files:
+            msg = "Selecione os PDFs (ou ZIPs) do lote original para que os arquivos com erro sejam localizados."
+            self.log_message(msg, "ERROR")
+            messagebox.showerror("Erro de Configuração", msg)
+            self.status_label.config(text="Erro de configuração: PDFs não selecionados.")
+            return
+
+        if not self.output_dir or not os.path.isdir(self.output_dir):
+            msg = "Pasta de saída inválida ou não definida."
+            self.log_message(msg, "ERROR")
+            messagebox.showerror("Erro de Configuração", msg)
+            self.status_label.config(text="Erro de configuração: Pasta de saída inválida.")
+            return
+
+        relatorio_anterior_path = filedialog.askopenfilename(
+            title="Selecione o relatório anterior",
+            initialdir=self.output_dir,
+            filetypes=(("Relatório Excel", "*.xlsx"), ("Todos os arquivos", "*.*")))
+        if not relatorio_anterior_path:
+            return
+
+        self.process_button.config(state=tk.DISABLED)
+        self.relink_button.config(state=tk.DISABLED)
+        self.retry_button.config(state=tk.DISABLED)
+        self.totais_button.config(state=tk.DISABLED)
+        self.progress_bar["value"] = 0
+        self.progress_bar["maximum"] = 1
         self.set_progress_bar_style("Success.Horizontal.TProgressbar")
+        self.status_label.config(text="Lendo o relatório anterior...")
+        self.root.update_idletasks()
 
-        self.log_message(f"Iniciando processamento de {len(self.pdf_files)} PDFs ({self.total_pages_to_process} páginas totais estimadas)...", "INFO")
+        retry_thread = threading.Thread(target=self._reprocessar_erros, args=(relatorio_anterior_path, list(self.pdf_files)))
+        retry_thread.start()
 
-        for pdf_path in self.pdf_files:
-            pdf_name = os.path.basename(pdf_path)
-            self.log_message(f"Processando PDF: {pdf_name}", "INFO")
+    def _reprocessar_erros(self, relatorio_anterior_path, pdf_files):
+        """Executa em uma thread separada o reprocessamento dos erros de um relatório anterior."""
+        self._iniciar_registro_log()
+        self.log_message(f"Iniciando reprocessamento dos erros de {os.path.basename(relatorio_anterior_path)}...", "INFO")
 
-            results_from_pdf = process_pdf_file(pdf_path, self.df_base, self.log_message, self.update_progress)
+        self._carregar_base_em_segundo_plano()
+        if self.df_base is None or self.df_base.empty:
+            msg = "Planilha base de UCs não carregada, inválida ou vazia. Verifique o arquivo 'base/database.xlsx'."
+            self.log_message(msg, "ERROR")
+            self._encerrar_registro_log()
+            self.root.after(0, lambda: self._falha_configuracao(msg, "Erro de configuração: Planilha base."))
+            return
 
-            for item in results_from_pdf:
-                if isinstance(item, dict):
-                    if "error" in item:
-                        erros_encontrados_no_processamento = True
-                        error_items.append(item)
-                    else:
-                        all_extracted_data.append(item)
-        
-        if error_items:
-            erros_encontrados_no_processamento = True
-
-        # --- Nova etapa: Extrair e verificar 'Valor Cobrado' para cada PDF ---
-        all_valor_cobrado_results = []
-        self.log_message("\n--- Iniciando verificação de 'Valor Cobrado' ---", "INFO")
-        for pdf_path in self.pdf_files:
-            pdf_name = os.path.basename(pdf_path)
-            cobrado_val, cobrado_str, liquido_total_verified, status_msgs = self.extract_and_verify_valor_cobrado(pdf_path)
-
-            for msg in status_msgs:
-                if "Aviso" in msg:
-                    self.log_message(f"[{pdf_name}] {msg}", "WARNING")
-                elif "Erro" in msg:
-                    self.log_message(f"[{pdf_name}] {msg}", "ERROR")
-                else:
-                    self.log_message(f"[{pdf_name}] {msg}", "INFO")
+        def ao_iniciar_extracao(total_paginas):
+            self.total_pages_to_process = max(1, total_paginas)
+            self.processed_pages_count = 0
+            self.log_message(f"Total de páginas a reprocessar: {total_paginas}", "INFO")
+            self.root.after(0, lambda: self.progress_bar.config(value=0, maximum=self.total_pages_to_process))
+            self.root.after(0, lambda: self.status_label.config(text=f"Reprocessando {total_paginas} páginas..."))
 
-            all_valor_cobrado_results.append({"pdf": pdf_name, "valor_cobrado": cobrado_val, "liquido_total_verified": liquido_total_verified})
-        self.log_message("--- Verificação de 'Valor Cobrado' concluída ---", "INFO")
+        try:
+            all_extracted_data, error_items, all_valor_cobrado_results, agregador_controle = reprocessar_erros_relatorio(
+                relatorio_anterior_path, pdf_files, self.df_base, self.configuracoes, self.registro_log,
+                self.update_progress, ao_iniciar_extracao, ocr_cache_path=self.ocr_cache_path,
+                perfis_extracao=PerfisExtracao(self.perfis_extracao_path, self.registro_log))
+        except Exception as e:
+            msg = f"Não foi possível reprocessar os erros de {os.path.basename(relatorio_anterior_path)}: {e}"
+            self.log_message(msg, "ERROR")
+            self._encerrar_registro_log()
+            self.root.after(0, lambda: self._falha_configuracao(msg, "Erro no reprocessamento."))
+            return
 
-        self.root.after(0, lambda: self.progress_bar.config(value=self.total_pages_to_process))
-        self.root.after(0, lambda: self.status_label.config(text=f"Processamento concluído! Gerando relatório..."))
-
-        self.root.after(100, lambda: self._processing_complete(all_extracted_data, error_items, erros_encontrados_no_processamento, all_valor_cobrado_results))
-
-
-    def _processing_complete(self, all_extracted_data, error_items, erros_encontrados_no_processamento, all_valor_cobrado_results):
-        """Finaliza o processamento, cria o relatório Excel e atualiza a GUI."""
-
-        # Colunas para a aba 'Relatorio' (sem as novas colunas)
-        final_columns_order_data = [
-            "UC", "Centro de Custo", "Subseção",
-            "ENERGIA (R$)",
-            "COSIP (R$)",
-            "Valor Bruto (R$)",
-            "RETENÇÃO (R$)",
-            "LÍQUIDO (R$)",
-            "Numero da Pagina"
-        ]
-        # Colunas para a aba de Erros
-        final_columns_order_errors = [
-            "UC", "Centro de Custo", "Subseção",
-            "ENERGIA (R$)",
-            "COSIP (R$)",
-            "Valor Bruto (R$)",
-            "RETENÇÃO (R$)",
-            "LÍQUIDO (R$)",
-            "Numero da Pagina",
-            "Observação"
-        ]
-
-        # Nomes das colunas de moeda para formatação no Excel (apenas para 'Relatorio')
-        currency_cols_names_for_excel_fmt = [
-            "ENERGIA (R$)",
-            "COSIP (R$)",
-            "Valor Bruto (R$)",
-            "RETENÇÃO (R$)",
-            "LÍQUIDO (R$)"
-        ]
-
-        # --- Cria o DataFrame completo com todos os dados extraídos ---
-        df_full_data = pd.DataFrame(all_extracted_data)
+        self.registro_log.emitir_resumo()
 
-        # --- Geração do nome do arquivo com data ---
+        # Guarda os resultados (inclusive UCs não encontradas) para a revinculação posterior
         try:
-            today_str = datetime.today().strftime("%d.%m.%Y")
-            output_filename = f"{today_str} Repasse-Celesc.xlsx"
-            output_file_path = os.path.join(self.output_dir, output_filename)
-            self.log_message(f"Nome do arquivo de saída gerado: {output_filename}", "INFO")
+            salvar_estado_execucao(self.estado_execucao_path, all_extracted_data, error_items, all_valor_cobrado_results)
         except Exception as e:
-            self.log_message(f"Erro ao gerar nome do arquivo de saída: {e}. Usando nome padrão.", "WARNING")
-            output_file_path = os.path.join(self.output_dir, "Relatorio_Celesc.xlsx")
+            self.log_message(f"Não foi possível gravar o estado da execução para revinculação: {e}", "WARNING")
 
-        # --- PREPARAR DADOS PARA A ABA 'CONTROLE' (SE SOLICITADO) ---
-        df_controle = pd.DataFrame()
-        if self.gerar_controle_var.get():
-            self.log_message("Preparando dados para a aba 'Controle'...", "INFO")
-            if not df_full_data.empty and not df_full_data[df_full_data['UC'].notna()].empty:
-                # Novas colunas e dicionário de agregação para a aba 'Controle'
-                new_controle_cols = [
-                    "Energia (1,2%)", "Retenção(1,2%)",
-                    "Energia (4,8%)", "Retenção(4,8%)"
-                ]
-                
-                # Garante que as novas colunas existam no dataframe antes de agrupar
-                for col in new_controle_cols:
-                    if col not in df_full_data.columns:
-                        df_full_data[col] = 0.0
-                
-                # Dicionário de agregação para agrupar por Centro de Custo e Subseção
-                controle_agg_dict = {
-                    'UC': lambda x: '\n'.join(sorted(x.astype(str).unique())), # Concatena UCs
-                    'COSIP (R$)': 'sum'
-                }
-                # Adiciona as outras colunas numéricas para soma
-                for col in new_controle_cols:
-                    controle_agg_dict[col] = 'sum'
-
-                # Agrupa por Centro de Custo e Subseção, somando valores e concatenando UCs
-                df_controle = df_full_data.groupby(['Centro de Custo', 'Subseção'], as_index=False).agg(controle_agg_dict)
-                
-                # Reordena as colunas para o formato final especificado
-                final_controle_order = [
-                    'UC', 'Centro de Custo', 'Subseção',
-                    'COSIP (R$)',
-                    'Energia (1,2%)', 'Retenção(1,2%)',
-                    'Energia (4,8%)', 'Retenção(4,8%)'
-                ]
-                
-                # Filtra para garantir que apenas colunas existentes sejam usadas
-                df_controle = df_controle.reindex(columns=final_controle_order)
+        self.root.after(0, lambda: self.progress_bar.config(value=self.progress_bar["maximum"]))
+        self.root.after(0, lambda: self.status_label.config(text="Reprocessamento concluído! Gerando relatório..."))
+        self.root.after(100, lambda: self._processing_complete(all_extracted_data, error_items, bool(error_items),
+                                                               all_valor_cobrado_results, agregador_controle))
 
-                # Adiciona a linha de totais à aba 'Controle'
-                if not df_controle.empty:
-                    # --- INÍCIO DA MODIFICAÇÃO: Geração dos arquivos TXT ---
-                    if self.gerar_txt_var.get():
-                        try:
-                            self.log_message("Iniciando geração de arquivos TXT...", "INFO")
-                            # Cria a pasta de saída para os TXTs com base no nome do Excel
-                            txt_folder_name = os.path.splitext(output_filename)[0]
-                            txt_output_dir = os.path.join(self.output_dir, txt_folder_name)
-                            os.makedirs(txt_output_dir, exist_ok=True)
-                            self.log_message(f"Pasta para arquivos TXT criada em: {txt_output_dir}", "INFO")
-                    
-                            # Mapeamento de nome de arquivo para coluna de dados
-                            txt_map = {
-                                "Rateio Cosip.txt": "COSIP (R$)",
-                                "Rateio Energia 1.2.txt": "Energia (1,2%)",
-                                "Rateio Energia 4.8.txt": "Energia (4,8%)"
-                            }
-                    
-                            # Itera sobre o mapa para gerar cada arquivo TXT
-                            for filename, data_column in txt_map.items():
-                                txt_file_path = os.path.join(txt_output_dir, filename)
-                                lines_to_write = []
-                    
-                                # Itera sobre as linhas do DataFrame 'Controle' (antes de adicionar totais)
-                                for index, row in df_controle.iterrows():
-                                    centro_custo = row['Centro de Custo']
-                                    value = row[data_column]
-                    
-                                    # Processa apenas se o valor não for nulo e for maior que zero
-                                    if pd.notna(value) and abs(value) > 1e-9:
-                                        # Formatação do valor numérico
-                                        formatted_value = f"{value:.2f}".replace('.', ',')
-                                        if formatted_value.endswith(",00"):
-                                            formatted_value = formatted_value[:-3]
-                                        
-                                        if pd.notna(centro_custo) and str(centro_custo).strip():
-                                            lines_to_write.append(f"{centro_custo}#SEP#{formatted_value}")
-                                
-                                # Escreve as linhas no arquivo
-                                if lines_to_write:
-                                    with open(txt_file_path, 'w', encoding='utf-8') as f:
-                                        f.write('\n'.join(lines_to_write))
-                                    self.log_message(f"Arquivo '{filename}' gerado com {len(lines_to_write)} linhas.", "SUCCESSO")
-                                else:
-                                    self.log_message(f"Nenhum dado válido para gerar o arquivo '{filename}'.", "INFO")
-                        
-                        except Exception as e:
-                            self.log_message(f"Erro CRÍTICO ao gerar arquivos TXT: {e}", "ERRO_CRITICO")
-                            messagebox.showerror("Erro na Geração de TXT", f"Ocorreu um erro ao gerar os arquivos TXT: {e}")
-                    # --- FIM DA MODIFICAÇÃO ---
-
-                    # Calcula as somas das colunas
-                    soma_cosip = df_controle['COSIP (R$)'].sum()
-                    soma_d = df_controle['Energia (1,2%)'].sum()
-                    soma_e = df_controle['Retenção(1,2%)'].sum()
-                    soma_f = df_controle['Energia (4,8%)'].sum()
-                    soma_g = df_controle['Retenção(4,8%)'].sum()
-
-                    # Cria a linha em branco e a linha de totais
-                    linha_em_branco = pd.DataFrame([ {col: '' for col in df_controle.columns} ])
-                    linha_totais = pd.DataFrame([{
-                        'UC': 'Totais:',
-                        'Centro de Custo': '',
-                        'Subseção': '',
-                        'COSIP (R$)': soma_cosip,
-                        'Energia (1,2%)': soma_d,
-                        'Retenção(1,2%)': soma_e,
-                        'Energia (4,8%)': soma_f,
-                        'Retenção(4,8%)': soma_g
-                    }])
-
-                    # Concatena o DataFrame original com as novas linhas
-                    df_controle = pd.concat([df_controle, linha_em_branco, linha_totais], ignore_index=True)
+    def start_quick_totals(self):
+        """
+        Conferência prévia do lote: soma o 'Valor Cobrado' (verificado) da primeira página de cada PDF
+        selecionado e conta páginas e UCs, em paralelo, sem extrair as faturas nem gerar o relatório.
+        """
+        self.log_text.config(state=tk.NORMAL)
+        self.log_text.delete('1.0', tk.END)
+        self.log_text.config(state=tk.DISABLED)
 
-            else:
-                self.log_message("AVISO: Nenhum dado extraído para gerar a aba 'Controle'.", "WARNING")
-        
-        # --- Prepara o DataFrame para a aba 'Relatorio' (apenas com as colunas originais) ---
-        df_extracted_data = pd.DataFrame()
-        if not df_full_data.empty:
-            df_extracted_data = df_full_data.reindex(columns=final_columns_order_data)
-
-            # Formata colunas de moeda para cálculo
-            for col_name in currency_cols_names_for_excel_fmt:
-                if col_name in df_extracted_data.columns:
-                    df_extracted_data[col_name] = pd.to_numeric(df_extracted_data[col_name], errors='coerce').fillna(0.0)
-
-        # --- Create TOTAL row for extracted data ('Relatorio') ---
-        df_total_row = pd.DataFrame() # Initialize empty
-        if not df_extracted_data.empty:
-            total_row_data = {"UC": "Totais:"}
-            for col in final_columns_order_data:
-                if col in currency_cols_names_for_excel_fmt:
-                    total_row_data[col] = df_extracted_data[col].sum()
-                elif col != "UC":
-                    total_row_data[col] = ""
-            df_total_row = pd.DataFrame([total_row_data]).reindex(columns=final_columns_order_data)
-
-        # --- Create Valor Cobrado summary row ---
-        df_cobrado_summary_row = pd.DataFrame() # Initialize empty
-        if all_valor_cobrado_results:
-            total_valor_cobrado_sum = sum(res.get("liquido_total_verified", 0.0) for res in all_valor_cobrado_results if res.get("liquido_total_verified") is not None)
-            
-            cobrado_summary_row_data = {col: "" for col in final_columns_order_data}
-            cobrado_summary_row_data["UC"] = "TOTAL conta:"
-            if "LÍQUIDO (R$)" in final_columns_order_data:
-                cobrado_summary_row_data["LÍQUIDO (R$)"] = total_valor_cobrado_sum
-            df_cobrado_summary_row = pd.DataFrame([cobrado_summary_row_data]).reindex(columns=final_columns_order_data)
-            self.log_message(f"Soma total de 'Valor Cobrado Verificado': {total_valor_cobrado_sum}", "INFO")
-
-        # --- Assemble the final report DataFrame ('Relatorio') with blank rows ---
-        final_report_parts = []
-        if not df_extracted_data.empty:
-            final_report_parts.append(df_extracted_data)
-            if not df_total_row.empty or not df_cobrado_summary_row.empty:
-                blank_row_df = pd.DataFrame([{col: "" for col in final_columns_order_data}])
-                final_report_parts.append(blank_row_df)
-
-        if not df_total_row.empty:
-            final_report_parts.append(df_total_row)
-        if not df_cobrado_summary_row.empty:
-            final_report_parts.append(df_cobrado_summary_row)
-        
-        df_final_report = pd.concat(final_report_parts, ignore_index=True) if final_report_parts else pd.DataFrame(columns=final_columns_order_data)
+        self.current_severity = 0
+        self.has_specific_warnings = False # Reset flag
+        self.account_values_mismatched = False # Reset flag
 
-        # --- Process df_errors ---
-        df_errors = pd.DataFrame()
-        if error_items:
-            df_errors = pd.DataFrame(error_items).reindex(columns=final_columns_order_errors)
+        if not self.pdf_files:
+            msg = "Nenhum arquivo PDF selecionado."
+            self.log_message(msg, "ERROR")
+            messagebox.showerror("Erro de Configuração", msg)
+            self.status_label.config(text="Erro de configuração: PDFs não selecionados.")
+            return
+
+        self.process_button.config(state=tk.DISABLED)
+        self.relink_button.config(state=tk.DISABLED)
+        self.retry_button.config(state=tk.DISABLED)
+        self.totais_button.config(state=tk.DISABLED)
+        self.progress_bar["value"] = 0
+        self.progress_bar["maximum"] = 1
+        self.set_progress_bar_style("Success.Horizontal.TProgressbar")
+        self.status_label.config(text="Calculando totais rápidos...")
+        self.root.update_idletasks()
+
+        totais_thread = threading.Thread(target=self._totais_rapidos, args=(list(self.pdf_files),))
+        totais_thread.start()
 
-        # --- Save and open the Excel file ---
+    def _totais_rapidos(self, pdf_files):
+        """Executa em uma thread separada a conferência prévia dos totais do lote."""
+        start_time = time.time()
+        self.log_message(f"Calculando os totais rápidos de {len(pdf_files)} arquivo(s)...", "INFO")
+        processos = max(self.configuracoes["processos_extracao"], os.cpu_count() or 1)
         try:
-            self.log_message(f"Salvando relatório em: {output_file_path}", "INFO")
-            with pd.ExcelWriter(output_file_path, engine='openpyxl') as writer:
-                worksheet = None # Initialize worksheet variable
-                if not df_final_report.empty:
-                    df_final_report.to_excel(writer, index=False, sheet_name='Relatorio')
-                    workbook = writer.book
-                    worksheet = writer.sheets['Relatorio'] # Get worksheet here
-                    worksheet.freeze_panes = 'A2' # Congela a linha de cabeçalho
-                    yellow_fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
-                    
-                    # Alinhar à direita a coluna 'Numero da Pagina'
-                    try:
-                        col_index = final_columns_order_data.index("Numero da Pagina") + 1
-                        col_letter = get_column_letter(col_index)
-                        for row in range(2, worksheet.max_row + 1):
-                            cell = worksheet[f"{col_letter}{row}"]
-                            cell.alignment = Alignment(horizontal="right")
-                    except (ValueError, IndexError):
-                        pass # Ignora se a coluna não for encontrada
-
-                    # Formata colunas de moeda e aplica destaque condicional
-                    for col_name_df in currency_cols_names_for_excel_fmt:
-                        if col_name_df in df_final_report.columns:
-                            excel_col_idx = final_columns_order_data.index(col_name_df) + 1
-                            col_letter = get_column_letter(excel_col_idx)
-                            
-                            for row_idx_in_final_df in range(df_final_report.shape[0]):
-                                row_excel_num = row_idx_in_final_df + 2 
-                                cell = worksheet[f'{col_letter}{row_excel_num}']
-                                if isinstance(cell.value, (int, float)):
-                                    cell.number_format = 'R$ #,##0.00'
-                                    if cell.value == 0 and col_name_df in ["LÍQUIDO (R$)", "COSIP (R$)"]:
-                                        cell.fill = yellow_fill
-
-                    # Ajusta largura das colunas
-                    for col_idx_df, col_name_df in enumerate(final_columns_order_data):
-                        excel_col_idx = col_idx_df + 1
-                        column_letter_val = get_column_letter(excel_col_idx)
-                        max_len = len(str(worksheet[f'{column_letter_val}1'].value))
-                        
-                        for cell in worksheet[column_letter_val]:
-                            if cell.value:
-                                cell_str_val = str(cell.value)
-                                if col_name_df in currency_cols_names_for_excel_fmt and isinstance(cell.value, (int, float)):
-                                    cell_str_val = f"R$ {cell.value:,.2f}"
-                                max_len = max(max_len, len(cell_str_val))
-                        
-                        adjusted_width = (max_len + 2) if max_len > 0 else 12
-                        if col_name_df == "UC":
-                             adjusted_width = max(adjusted_width, 15) 
-                        worksheet.column_dimensions[column_letter_val].width = adjusted_width
+            arquivos, totais = calcular_totais_rapidos(pdf_files, processos, self.registro_log)
+        except Exception as e:
+            msg = f"Não foi possível calcular os totais rápidos: {e}"
+            self.log_message(msg, "ERROR")
+            self.root.after(0, lambda: self._falha_configuracao(msg, "Erro no cálculo dos totais rápidos."))
+            return
+        self.registro_log.emitir_resumo()
+        self.log_message(f"Totais rápidos calculados em {time.time() - start_time:.2f} segundos.", "INFO")
+        self.root.after(0, lambda: self._totais_rapidos_concluidos(totais))
+
+    def _totais_rapidos_concluidos(self, totais):
+        """Exibe o resumo da conferência prévia e libera a interface."""
+        summary_message = (f"Arquivos: {totais['arquivos']}\nPáginas: {totais['paginas']}\nUCs: {totais['ucs']}\n"
+                           f"Valor Cobrado verificado: R$ {centavos_para_reais(totais['total_verificado']):,.2f}")
+        if totais["arquivos_nao_verificados"]:
+            summary_message += (f"\n\n{totais['arquivos_nao_verificados']} arquivo(s) não somado(s) "
+                                "(valor não verificado, duplicado ou PDF com problema). Verifique o log.")
+            self.set_progress_bar_style("Warning.Horizontal.TProgressbar")
+            messagebox.showwarning("Totais Rápidos", summary_message)
+        else:
+            messagebox.showinfo("Totais Rápidos", summary_message)
+        self.progress_bar["value"] = 1
+        self.status_label.config(text="Totais rápidos concluídos.")
+        self.process_button.config(state=tk.NORMAL)
+        self.retry_button.config(state=tk.NORMAL)
+        self.totais_button.config(state=tk.NORMAL)
+        if os.path.exists(self.estado_execucao_path):
+            self.relink_button.config(state=tk.NORMAL)
+
+    def _processing_complete(self, all_extracted_data, error_items, erros_encontrados_no_processamento, all_valor_cobrado_results,
+                             agregador_controle=None, gerar_aba_relatorio=True, cancelado=False):
+        """
+        Finaliza o processamento: o relatório Excel é montado e gravado em uma thread separada
+        (_gerar_relatorio_em_segundo_plano), para não bloquear a interface, e apenas a conclusão
+        (_relatorio_concluido) volta à thread da interface.
+        Com 'gerar_aba_relatorio' False, apenas a aba 'Controle' (somada em 'agregador_controle') é gerada.
+        Com 'cancelado', o relatório é parcial (extração interrompida pelo usuário).
+        """
 
-                # --- GRAVAR A ABA 'CONTROLE' (SE GERADA) ---
-                if not df_controle.empty:
-                    df_controle.to_excel(writer, index=False, sheet_name='Controle')
-                    worksheet_controle = writer.sheets['Controle']
-                    worksheet_controle.freeze_panes = 'A2'
-
-                    # Lista de colunas de moeda para a nova aba 'Controle'
-                    controle_currency_cols = [
-                        "COSIP (R$)",
-                        "Energia (1,2%)", "Retenção(1,2%)",
-                        "Energia (4,8%)", "Retenção(4,8%)"
-                    ]
-                    
-                    # Formatar colunas para a aba 'Controle'
-                    for col_idx, col_name in enumerate(df_controle.columns):
-                        col_letter = get_column_letter(col_idx + 1)
-                        for row_num in range(2, worksheet_controle.max_row + 1):
-                            cell = worksheet_controle[f'{col_letter}{row_num}']
-                            if col_idx == 0: worksheet_controle.row_dimensions[row_num].height = 15
-                            # Formata colunas de moeda
-                            if col_name in controle_currency_cols and isinstance(cell.value, (int, float)):
-                                cell.number_format = 'R$ #,##0.00'
-                            # Aplica quebra de linha na coluna UC
-                            if col_name == 'UC' and cell.value and isinstance(cell.value, str) and '\n' in cell.value:
-                                cell.alignment = Alignment(wrap_text=True, vertical='top')
-
-                    # Ajustar largura das colunas para a aba 'Controle'
-                    for col_idx, col_name in enumerate(df_controle.columns):
-                        column_letter = get_column_letter(col_idx + 1)
-                        max_len = len(str(worksheet_controle[f'{column_letter}1'].value))
-                        for cell in worksheet_controle[column_letter]:
-                            if cell.value:
-                                cell_str = str(cell.value)
-                                if col_name == 'UC':
-                                    # Para a coluna UC, a largura é baseada na linha mais longa (UC mais longa)
-                                    lines = cell_str.split('\n')
-                                    current_max_line_len = max(len(line) for line in lines) if lines else 0
-                                    max_len = max(max_len, current_max_line_len)
-                                else:
-                                    # Para outras colunas, usa o comprimento total da string
-                                    if col_name in controle_currency_cols and isinstance(cell.value, (int, float)):
-                                        cell_str = f"R$ {cell.value:,.2f}"
-                                    max_len = max(max_len, len(cell_str))
-                        adjusted_width = (max_len + 2) if max_len > 0 else 12
-                        worksheet_controle.column_dimensions[column_letter].width = adjusted_width
+        # --- Geração do nome do arquivo com data ---
+        try:
+            output_file_path = caminho_relatorio(self.output_dir)
+            self.log_message(f"Nome do arquivo de saída gerado: {os.path.basename(output_file_path)}", "INFO")
+        except Exception as e:
+            self.log_message(f"Erro ao gerar nome do arquivo de saída: {e}. Usando nome padrão.", "WARNING")
+            output_file_path = os.path.join(self.output_dir, "Relatorio_Celesc.xlsx")
 
-                if not df_errors.empty:
-                    df_errors.to_excel(writer, index=False, sheet_name='Relatorio_Erros')
-                    worksheet_errors = writer.sheets['Relatorio_Erros']
-                    worksheet_errors.freeze_panes = 'A2' # Congela a linha de cabeçalho
-                    for col_idx_df, col_name_df in enumerate(final_columns_order_errors):
-                        excel_col_idx = col_idx_df + 1
-                        column_letter_val = get_column_letter(excel_col_idx)
-                        max_len = len(str(worksheet_errors[f'{column_letter_val}1'].value))
-                        for cell in worksheet_errors[column_letter_val]:
-                             if cell.value:
-                                max_len = max(max_len, len(str(cell.value)))
-                        adjusted_width = (max_len + 2) if max_len > 0 else 12
-                        if col_name_df == "Observação":
-                            adjusted_width = min(adjusted_width, 80) # Limita a largura da coluna de observação
-                        worksheet_errors.column_dimensions[column_letter_val].width = adjusted_width
-            
-            # --- Perform the value comparison and apply highlight ---
-            calculated_total_liquido = df_total_row['LÍQUIDO (R$)'].iloc[0] if not df_total_row.empty else 0.0
-            account_total_liquido = df_cobrado_summary_row['LÍQUIDO (R$)'].iloc[0] if not df_cobrado_summary_row.empty else 0.0
+        self.status_label.config(text="Gerando relatório...")
+        self.progress_bar.config(value=0, maximum=1)
+        # As variáveis Tk são lidas aqui, na thread da interface
+        relatorio_thread = threading.Thread(target=self._gerar_relatorio_em_segundo_plano,
+                                            args=(output_file_path, all_extracted_data, error_items, all_valor_cobrado_results,
+                                                  self.gerar_controle_var.get(), self.gerar_txt_var.get(),
+                                                  agregador_controle, gerar_aba_relatorio, cancelado))
+        relatorio_thread.start()
+
+    def _gerar_relatorio_em_segundo_plano(self, output_file_path, all_extracted_data, error_items, all_valor_cobrado_results,
+                                          gerar_controle, gerar_txt, agregador_controle, gerar_aba_relatorio, cancelado=False):
+        """
+        Monta e grava o relatório (DataFrame, 'Controle', TXT e Excel) fora da thread da interface.
+        O progresso (linhas gravadas por aba) e a conclusão são repassados à interface via root.after.
+        """
+        def progresso(nome_aba, linhas_aba, linhas_gravadas, linhas_total):
+            self.root.after(0, lambda: self.progress_bar.config(value=linhas_gravadas, maximum=max(1, linhas_total)))
+            self.root.after(0, lambda: self.status_label.config(
+                text=f"Gerando relatório: aba '{nome_aba}' gravada ({linhas_gravadas} de {linhas_total} linhas)..."))
 
-            if abs(calculated_total_liquido - account_total_liquido) > 1e-9:
+        resultado, erro = None, None
+        try:
+            resultado = gerar_relatorio(all_extracted_data, error_items, all_valor_cobrado_results, output_file_path,
+                                        self.configuracoes, gerar_controle, gerar_txt,
+                                        self.log_message, agregador_controle, gerar_aba_relatorio, progresso)
+        except Exception as e:
+            erro = e
+        self.root.after(0, lambda: self._relatorio_concluido(output_file_path, resultado, erro, gerar_aba_relatorio, cancelado))
+
+    def _relatorio_concluido(self, output_file_path, resultado, erro, gerar_aba_relatorio, cancelado=False):
+        """Executado na thread da interface ao fim da geração do relatório: abre o arquivo, exibe o resumo e libera os botões."""
+        self._aplicar_log()
+        self._atualizar_severidade() # Inclui as mensagens não exibidas (filtradas pelo nível de log)
+        if erro is None:
+            # O relatório é aberto já, enquanto o resumo é exibido
+            self._abrir_relatorio(output_file_path)
+        try:
+            if erro is not None:
+                raise erro
+            if resultado["falha_txt"]:
+                messagebox.showerror("Erro na Geração de TXT", f"Ocorreu um erro ao gerar os arquivos TXT: {resultado['falha_txt']}")
+            if resultado["valores_divergentes"]:
                 self.account_values_mismatched = True
-                self.log_message("Valores da conta não conferem! (Total Extraído vs Total da Fatura)", "WARNING")
-
-                if worksheet is not None:
-                    totais_row_index_in_sheet = -1
-                    for r_idx in range(2, worksheet.max_row + 1):
-                        if worksheet[f'A{r_idx}'].value == "Totais":
-                            totais_row_index_in_sheet = r_idx
-                            break
-
-                    if totais_row_index_in_sheet != -1:
-                        col_name_to_highlight = "LÍQUIDO (R$)"
-                        if col_name_to_highlight in final_columns_order_data:
-                            excel_col_idx_highlight = final_columns_order_data.index(col_name_to_highlight) + 1
-                            col_letter_highlight = get_column_letter(excel_col_idx_highlight)
-                            
-                            worksheet[f'{col_letter_highlight}{totais_row_index_in_sheet}'].fill = yellow_fill
-                            self.log_message(f"Célula {col_letter_highlight}{totais_row_index_in_sheet} (Totais, LÍQUIDO) destacada em amarelo.", "INFO")
-                    else:
-                        self.log_message("AVISO: Não foi possível localizar a linha 'Totais' para destacar o valor.", "WARNING")
 
             # --- Determine Final Status and Messages ---
+            destino_faturas = "na aba 'Relatorio'" if gerar_aba_relatorio else "e somados na aba 'Controle'"
             final_status_message = ""
             final_messagebox_title = ""
             final_messagebox_type = messagebox.showinfo
             summary_message = ""
 
-            if self.account_values_mismatched:
+            if cancelado:
+                final_status_message = "Cancelado: relatório parcial gerado."
+                final_messagebox_title = "Processamento Cancelado"
+                summary_message = (f"Processamento cancelado pelo usuário.\n"
+                                   f"O relatório parcial contém {resultado['faturas']} registros de fatura extraídos {destino_faturas} até o cancelamento.\n"
+                                   f"Os arquivos não processados estão listados na aba 'Relatorio_Erros' como \"não processado\".")
+                final_messagebox_type = messagebox.showwarning
+                if self.current_severity < 1:
+                    self.current_severity = 1
+            elif self.account_values_mismatched:
                 final_status_message = "Concluído: Valores da conta não conferem!"
                 final_messagebox_title = "Alerta Crítico: Discrepância nos Valores!"
                 summary_message = (f"ATENÇÃO: Os valores totais calculados e os valores informados na conta não conferem.\n"
-                                   f"Verifique a linha 'Totais' na aba 'Relatorio' (destacada em amarelo).\n"
-                                   f"Total Calculado: R$ {calculated_total_liquido:,.2f}\n"
-                                   f"Total da Fatura: R$ {account_total_liquido:,.2f}\n\n")
+                                   + (f"Verifique a linha 'Totais' na aba '{resultado['aba_totais']}' (destacada em amarelo).\n"
+                                      if resultado['aba_totais'] else "")
+                                   + f"Total Calculado: R$ {centavos_para_reais(resultado['total_calculado']):,.2f}\n"
+                                   f"Total da Fatura: R$ {centavos_para_reais(resultado['total_conta']):,.2f}\n\n")
                 final_messagebox_type = messagebox.showwarning
                 if self.current_severity < 1:
                     self.current_severity = 1
@@ -1118,18 +5662,18 @@ class AppCelescReporter:
                 final_status_message = "Concluído com ERROS."
                 final_messagebox_title = "Processamento Concluído com Alertas"
                 summary_message = f"Processamento concluído com ERROS!\n"
-                if not df_extracted_data.empty:
-                    summary_message += f"{len(df_extracted_data)} registros de fatura extraídos com sucesso na aba 'Relatorio'.\n"
-                summary_message += f"{len(df_errors)} problemas/erros encontrados na aba 'Relatorio_Erros'."
+                if resultado["faturas"]:
+                    summary_message += f"{resultado['faturas']} registros de fatura extraídos com sucesso {destino_faturas}.\n"
+                summary_message += f"{resultado['erros']} problemas/erros encontrados na aba 'Relatorio_Erros'."
                 final_messagebox_type = messagebox.showerror
             elif self.has_specific_warnings:
                 final_status_message = "Concluído com Avisos!"
                 final_messagebox_title = "Processamento Concluído com Avisos"
                 summary_message = f"Processamento concluído com Avisos!\n"
-                if not df_extracted_data.empty:
-                    summary_message += f"{len(df_extracted_data)} registros de fatura extraídos na aba 'Relatorio'.\n"
+                if resultado["faturas"]:
+                    summary_message += f"{resultado['faturas']} registros de fatura extraídos {destino_faturas}.\n"
                 final_messagebox_type = messagebox.showwarning
-            elif df_final_report.empty:
+            elif resultado["relatorio_vazio"]:
                 final_status_message = "Concluído (Sem dados extraídos)."
                 final_messagebox_title = "Processamento Concluído"
                 summary_message = ("Processamento concluído. Nenhum dado de fatura válido foi extraído.\n"
@@ -1138,7 +5682,7 @@ class AppCelescReporter:
             else:
                 final_status_message = "Concluído com sucesso!"
                 final_messagebox_title = "Processamento Concluído"
-                summary_message = f"Processamento concluído com sucesso!\n{len(df_extracted_data)} registros de fatura extraídos na aba 'Relatorio'."
+                summary_message = f"Processamento concluído com sucesso!\n{resultado['faturas']} registros de fatura extraídos {destino_faturas}."
                 final_messagebox_type = messagebox.showinfo
             
             final_progress_bar_style = "Success.Horizontal.TProgressbar"
@@ -1151,7 +5695,9 @@ class AppCelescReporter:
             self.status_label.config(text=final_status_message)
 
             if output_file_path:
-                final_summary_msg_for_box = summary_message + f"\nRelatório salvo em:\n{output_file_path}"
+                final_summary_msg_for_box = summary_message
+                if resultado["arquivos"]:
+                    final_summary_msg_for_box += f"\nRelatório salvo em:\n{output_file_path}"
                 final_messagebox_type(final_messagebox_title, final_summary_msg_for_box)
 
         except Exception as e:
@@ -1160,107 +5706,36 @@ class AppCelescReporter:
             self.status_label.config(text="Erro ao salvar relatório.")
         finally:
             self.process_button.config(state=tk.NORMAL)
-            
-            if os.path.exists(output_file_path):
-                try:
-                    if sys.platform == "win32":
-                        os.startfile(output_file_path)
-                    elif sys.platform == "darwin":
-                        subprocess.call(("open", output_file_path))
-                    else:
-                        subprocess.call(("xdg-open", output_file_path))
-                except Exception as open_e:
-                    self.log_message(f"Não foi possível abrir o relatório automaticamente: {open_e}", "WARNING")
-            else:
-                self.log_message(f"AVISO: Arquivo de relatório não encontrado para abrir: {output_file_path}", "WARNING")
+            self.retry_button.config(state=tk.NORMAL)
+            self.totais_button.config(state=tk.NORMAL)
+            if os.path.exists(self.estado_execucao_path):
+                self.relink_button.config(state=tk.NORMAL)
 
+            self._encerrar_registro_log()
 
-    # --- FUNÇÃO ADICIONADA: Extrair e Verificar Valor Cobrado ---
-    def clean_currency(self, value_str):
-        """Limpia uma string de valor monetário (ex: 1.234,56) para float (ex: 1234.56)."""
-        if not isinstance(value_str, str) or not value_str.strip():
-            return None
-        # Remove todos os pontos e substitui a vírgula por ponto para conversão para float
-        cleaned_str = value_str.strip().replace('.', '').replace(',', '.')
-        try:
-            return float(cleaned_str)
-        except ValueError:
-            return None # Retorna None se não puder converter
-
-    def extract_and_verify_valor_cobrado(self, pdf_path):
-        """
-        Extrai o 'Valor Cobrado' e verifica sua duplicação na primeira página do PDF.
-        Retorna o valor cobrado, sua string original, o líquido total (se duplicado)
-        e uma lista de mensagens de status.
-        """
-        valor_cobrado = None
-        valor_cobrado_str_original = None
-        liquido_total = None # Representa o valor cobrado verificado
-        status_messages = []
-
-        try:
-            # 1 Abrir o PDF e acessar a primeira página
-            doc = fitz.open(pdf_path)
-            if doc.page_count == 0:
-                doc.close()
-                return None, None, None, ["Erro: O PDF não contém páginas."]
-            
-            page = doc[0] # Foca apenas na primeira página
-            text = page.get_text("text") # Extrai todo o texto da primeira página
-            doc.close() # Fecha o documento
-
-            # 2 Procurar o rótulo "Valor Cobrado (R$)"
-            match_label_cobrado = re.search(r"Valor Cobrado \(R\$\)", text, re.IGNORECASE)
-
-            if match_label_cobrado:
-                # 3 Definir uma área de busca restrita após o rótulo
-                search_start = match_label_cobrado.end()
-                # Limita a busca aos próximos 150 caracteres após o rótulo (ajustável)
-                search_end = min(search_start + 150, len(text))
-                search_text_area = text[search_start:search_end]
-
-                # 4 Extrair o(s) valor(es) numérico(s) da área de busca
-                potential_values = re.findall(r"([\d.,]+)", search_text_area)
-
-                if potential_values:
-                    # 5 Limpar e converter as strings de valores para números reais
-                    # 6 Pegar o primeiro valor numérico encontrado
-                    for val_str in potential_values:
-                        cleaned_val = self.clean_currency(val_str)
-                        if cleaned_val is not None:
-                            valor_cobrado_str_original = val_str # Guarda a string original
-                            valor_cobrado = cleaned_val
-                            status_messages.append(f"Encontrado 'Valor Cobrado': '{valor_cobrado_str_original}' -> {valor_cobrado}")
-                            break # Para no primeiro valor válido encontrado
-
-                    if valor_cobrado is None:
-                        status_messages.append("Aviso: Nenhum valor numérico válido encontrado após 'Valor Cobrado (R$)'.")
-                else:
-                    status_messages.append("Aviso: Nenhum valor numérico encontrado na área de busca após 'Valor Cobrado (R$)'.")
-            else:
-                status_messages.append("Aviso: Rótulo 'Valor Cobrado (R$)' não encontrado na primeira página.")
-
-            # 7 Verificar a duplicação na primeira página
-            if valor_cobrado is not None and valor_cobrado_str_original is not None:
-                # Busca TODAS as ocorrências da STRING original do valor cobrado no texto COMPLETO da primeira página
-                all_occurrences = list(re.finditer(re.escape(valor_cobrado_str_original), text))
-
-                # Conta as ocorrências
-                if len(all_occurrences) >= 2: # Se o valor aparece 2 vezes ou mais
-                    # 9 Salvar o resultado: Se duplicado
-                    liquido_total = valor_cobrado # Confirma o valor que será somado
-                    status_messages.append(f"Sucesso: Valor '{valor_cobrado_str_original}' encontrado {len(all_occurrences)} vezes na página.")
+    def _abrir_relatorio(self, output_file_path):
+        """Abre o relatório gerado no programa padrão do sistema."""
+        if os.path.exists(output_file_path):
+            try:
+                if sys.platform == "win32":
+                    os.startfile(output_file_path)
+                elif sys.platform == "darwin":
+                    subprocess.call(("open", output_file_path))
                 else:
-                    status_messages.append("Falha: O valor do 'Valor Cobrado' não foi encontrado duplicado na página.")
-            elif valor_cobrado is None:
-                 status_messages.append("Falha: Não é possível verificar duplicação pois 'Valor Cobrado' não foi extraído.")
+                    subprocess.call(("xdg-open", output_file_path))
+            except Exception as open_e:
+                self.log_message(f"Não foi possível abrir o relatório automaticamente: {open_e}", "WARNING")
+        else:
+            self.log_message(f"AVISO: Arquivo de relatório não encontrado para abrir: {output_file_path}", "WARNING")
 
-            return valor_cobrado, valor_cobrado_str_original, liquido_total, status_messages
 
-        except Exception as e:
-            # Captura qualquer erro inesperado durante o processamento
-            status_messages.append(f"Erro inesperado durante a extração/verificação: {e}")
-            return None, None, None, status_messages
+    def clean_currency(self, value_str):
+        """Limpa uma string de valor monetário (ex: 1.234,56) para centavos inteiros (ex: 123456)."""
+        return clean_currency(value_str)
+
+    def extract_and_verify_valor_cobrado(self, pdf_path, pdf_bytes=None):
+        """Extrai o 'Valor Cobrado' e verifica sua duplicação na primeira página do PDF."""
+        return extract_and_verify_valor_cobrado(pdf_path, pdf_bytes)
 
     def show_info(self):
         """
@@ -1314,6 +5789,22 @@ def create_rounded_button(parent, text, command, width=20, height=20, bg_color=N
     return canvas
 
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = AppCelescReporter(root)
-    root.mainloop()
\ No newline at end of file
+    multiprocessing.freeze_support() # Necessário para os processos de OCR no executável (PyInstaller)
+    if "--servico" in sys.argv[1:]:
+        # Modo residente: 'relatorio.py --servico [--porta N]' (sem interface gráfica)
+        configuracoes = carregar_configuracoes(os.path.join(diretorio_base(), "base", "config.json"),
+                                               lambda message, level="INFO": print(f"[{level}] {message}", flush=True))
+        porta = configuracoes["servico_porta"]
+        if "--porta" in sys.argv[1:]:
+            porta = int(sys.argv[sys.argv.index("--porta") + 1])
+        ServicoRelatorios(diretorio_base(), configuracoes, porta).iniciar()
+    elif "--fragmento" in sys.argv[1:] or "--mesclar" in sys.argv[1:]:
+        # Execução em várias máquinas: 'relatorio.py --fragmento I/N ...' em cada uma e 'relatorio.py --mesclar ...' ao final
+        sys.exit(executar_linha_de_comando_fragmentos(sys.argv[1:]))
+    elif "--totais" in sys.argv[1:]:
+        # Conferência prévia: 'relatorio.py --totais ENTRADAS...'
+        sys.exit(executar_linha_de_comando_totais(sys.argv[1:]))
+    else:
+        root = tk.Tk()
+        app = AppCelescReporter(root)
+        root.mainloop()
\ No newline at end of file